@@ -1,305 +1,195 @@
-from fastapi import FastAPI, Depends, File, UploadFile, HTTPException, Query
-from fastapi.responses import JSONResponse
-import xmltodict
-import numpy as np
-from scipy import stats
-from sklearn.linear_model import LinearRegression
+from fastapi import FastAPI, Depends, File, UploadFile, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import datetime, date
-from typing import Optional
+from datetime import date, datetime
+from typing import Optional, List, Annotated
+from contextlib import asynccontextmanager
 from pydantic import conint
-from sqlalchemy import text
 
-from app.database.database import get_db
-from app.models.models import CFDComprobante, CFDEmisor, CFDReceptor, CFDConcepto, CFDImpuestoTrasladadoGeneral, CFDImpuestoTrasladadoConcepto
+from app.database.database import get_db, async_session
+from app.database.particiones import crear_particiones_futuras
+from app.database import auth_pool
+from app.security.jwt_handler import cerrar_executor
+from app.security.dependencias import dependencias_analisis
+from app.database.consultas import rango_fechas, parametros_rango, consulta_registros, parametros_registros, codificar_cursor, decodificar_cursor, consulta_resumen, RESUMEN_POR_TIPO, RESUMEN_POR_EMISOR
+from app.utils.ingesta import insertar_cfdi, id_emisor_por_rfc
+from app.utils.cfdi_parser import leer_cfdi, validar_cfdi, CFDIInvalido
+from app.utils.metricas import MiddlewareMetricas, INGESTA_ETAPA, cronometro, exponer
+from app.utils.lote import procesar_lote, cerrar_pool
+from app.utils.stats import estadisticas_desde_resumen, prueba_t_welch, anova_desde_momentos, precargar, PRECARGA_ANALISIS
+from app.utils.exportacion import exportar, formatear_registro, FORMATOS, PARQUET_DISPONIBLE
+from app.utils.cache_respuestas import cache_respuestas, alcance
+from app.utils.regresion import consulta_estado, consulta_extremos, ajustar, predecir, curva
+from app.utils.purga import purgar_emisor
+from app.utils.resumen import consulta_agregados, parametros_agregados, estadisticas_desde_agregados, consulta_momentos, momentos_por_tipo
 from app.routes.auth import auth_router
-
-from typing import Dict
-
-from typing import Annotated
-from pydantic import conint
-from fastapi import Query, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
-
-
-
-app = FastAPI(title="API de Análisis CFDI", version="1.0", openapi_prefix="/api/")
+from app.routes.trabajos import trabajos_router
+from app.utils.trabajos import iniciar_trabajos, detener_trabajos
+from app.utils.snapshot import snapshot_analisis, iniciar_snapshot, detener_snapshot
+
+# rango_fechas convierte fecha_fin en fecha < fecha_fin + 1 día
+DESCRIPCION_FECHA_FIN = "Fecha final, inclusiva (día completo; YYYY-MM-DD)"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await auth_pool.abrir_pool()
+    async with async_session() as db:
+        await crear_particiones_futuras(db)
+    # Antes de la cola de ingesta: lo que esta escriba ya se agrega al snapshot
+    await iniciar_snapshot()
+    await iniciar_trabajos()
+    if PRECARGA_ANALISIS:
+        # En un hilo: el import de scipy no bloquea el event loop
+        await run_in_threadpool(precargar)
+    yield
+    await detener_trabajos()
+    await detener_snapshot()
+    cerrar_pool()
+    await auth_pool.cerrar_pool()
+    cerrar_executor()
+
+app = FastAPI(title="API de Análisis CFDI", version="1.0", openapi_prefix="/api/", lifespan=lifespan)
+
+app.add_middleware(MiddlewareMetricas)
 
 app.include_router(auth_router, prefix="/auth", tags=["Authentication"])
+app.include_router(trabajos_router, prefix="/trabajos", tags=["Trabajos"])
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Formato de texto de Prometheus
+    return PlainTextResponse(exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.post("/procesar_xml")
 async def procesar_xml(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
-    # Leer y parsear el archivo XML
-    xml_content = await file.read()
-    xml_str = xml_content.decode("utf-8").replace("cfdi:", "")
-    data_dict = xmltodict.parse(xml_str)
-    comprobante_data = data_dict.get("Comprobante", {})
-
-    # Validación de datos del comprobante
-    if not comprobante_data:
-        return {"error": "No se pudo procesar el comprobante."}
-
-    fecha_str = comprobante_data.get("@Fecha")
-    if fecha_str:
-        try:
-            fecha = datetime.strptime(fecha_str, "%Y-%m-%dT%H:%M:%S")
-        except ValueError:
-            return {"error": "Formato de fecha incorrecto."}
-    else:
-        return {"error": "El campo Fecha es obligatorio."}
-
-    # Datos del Emisor
-    emisor_data = comprobante_data.get("Emisor", {})
-    rfc_emisor = emisor_data.get("@Rfc")
-    nombre_emisor = emisor_data.get("@Nombre")
-    regimen_fiscal_emisor = emisor_data.get("@RegimenFiscal")
-    
-    if not rfc_emisor or not nombre_emisor or not regimen_fiscal_emisor:
-        return {"error": "El Emisor debe contener RFC, Nombre y Régimen Fiscal."}
-
-    # Crear el registro del Emisor
-    emisor = CFDEmisor(rfc=rfc_emisor, nombre=nombre_emisor, regimen_fiscal=regimen_fiscal_emisor)
-    db.add(emisor)
-    await db.commit()
-    await db.refresh(emisor)
-
-    # Datos del Receptor
-    receptor_data = comprobante_data.get("Receptor", {})
-    rfc_receptor = receptor_data.get("@Rfc")
-    nombre_receptor = receptor_data.get("@Nombre")
-    regimen_fiscal_receptor = receptor_data.get("@RegimenFiscalReceptor")
-    uso_cfdi = receptor_data.get("@UsoCFDI")
-    
-    if not rfc_receptor or not nombre_receptor or not regimen_fiscal_receptor or not uso_cfdi:
-        return {"error": "El Receptor debe contener RFC, Nombre, Régimen Fiscal y Uso CFDI."}
-
-    # Crear el registro del Receptor
-    receptor = CFDReceptor(
-        rfc=rfc_receptor,
-        nombre=nombre_receptor,
-        regimen_fiscal=regimen_fiscal_receptor,
-        uso_cfdi=uso_cfdi
-    )
-    db.add(receptor)
-    await db.commit()
-    await db.refresh(receptor)
-
-    # Crear el registro del Comprobante
-    comprobante = CFDComprobante(
-        version=comprobante_data.get("@Version"),
-        serie=comprobante_data.get("@Serie"),
-        folio=comprobante_data.get("@Folio"),
-        fecha=fecha,
-        subtotal=float(comprobante_data.get("@SubTotal")),
-        descuento=float(comprobante_data.get("@Descuento", 0)),
-        moneda=comprobante_data.get("@Moneda"),
-        tipo_cambio=float(comprobante_data.get("@TipoCambio", 1)),
-        total=float(comprobante_data.get("@Total")),
-        tipo_de_comprobante=comprobante_data.get("@TipoDeComprobante"),
-        exportacion=comprobante_data.get("@Exportacion"),
-        lugar_expedicion=comprobante_data.get("@LugarExpedicion"),
-        id_emisor=emisor.id_emisor,
-        id_receptor=receptor.id_receptor,
-        total_impuestos_trasladados=float(comprobante_data.get("Impuestos", {}).get("@TotalImpuestosTrasladados", 0))
-    )
-    db.add(comprobante)
-    await db.commit()
-    await db.refresh(comprobante)
-
-    # Procesar los Conceptos
-    conceptos_data = comprobante_data.get("Conceptos", {}).get("Concepto", [])
-    if not isinstance(conceptos_data, list):
-        conceptos_data = [conceptos_data]
-
-    for concepto_data in conceptos_data:
-        concepto = CFDConcepto(
-            id_comprobante=comprobante.id_comprobante,
-            clave_prod_serv=concepto_data.get("@ClaveProdServ"),
-            cantidad=float(concepto_data.get("@Cantidad")),
-            clave_unidad=concepto_data.get("@ClaveUnidad"),
-            descripcion=concepto_data.get("@Descripcion"),
-            valor_unitario=float(concepto_data.get("@ValorUnitario")),
-            importe=float(concepto_data.get("@Importe")),
-            descuento=float(concepto_data.get("@Descuento", 0)),
-            objeto_imp=concepto_data.get("@ObjetoImp")
-        )
-        db.add(concepto)
-        await db.commit()
-        await db.refresh(concepto)
-
-        # Procesar impuestos trasladados por concepto
-        impuestos_data = concepto_data.get("Impuestos", {}).get("Traslados", {}).get("Traslado", [])
-        if not isinstance(impuestos_data, list):
-            impuestos_data = [impuestos_data]
-
-        for impuesto_data in impuestos_data:
-            impuesto_concepto = CFDImpuestoTrasladadoConcepto(
-                id_concepto=concepto.id_concepto,
-                base=float(impuesto_data.get("@Base")),
-                impuesto=impuesto_data.get("@Impuesto"),
-                tipo_factor=impuesto_data.get("@TipoFactor"),
-                tasa_o_cuota=float(impuesto_data.get("@TasaOCuota")),
-                importe=float(impuesto_data.get("@Importe"))
-            )
-            db.add(impuesto_concepto)
-
-        await db.commit()
-
-    # Procesar impuestos generales
-    impuestos_data = comprobante_data.get("Impuestos", {}).get("Traslados", {}).get("Traslado", [])
-    if not isinstance(impuestos_data, list):
-        impuestos_data = [impuestos_data]
-
-    for impuesto_data in impuestos_data:
-        impuesto_general = CFDImpuestoTrasladadoGeneral(
-            id_comprobante=comprobante.id_comprobante,
-            base=float(impuesto_data.get("@Base")),
-            impuesto=impuesto_data.get("@Impuesto"),
-            tipo_factor=impuesto_data.get("@TipoFactor"),
-            tasa_o_cuota=float(impuesto_data.get("@TasaOCuota")),
-            importe=float(impuesto_data.get("@Importe"))
-        )
-        db.add(impuesto_general)
-
-    await db.commit()
+    try:
+        # Parsear el XML de forma incremental sin bloquear el event loop
+        with cronometro(INGESTA_ETAPA, etapa="parseo"):
+            registros = await run_in_threadpool(leer_cfdi, file.file)
+        with cronometro(INGESTA_ETAPA, etapa="validacion"):
+            cfdi = validar_cfdi(registros)
+    except CFDIInvalido as e:
+        return {"error": str(e)}
+
+    # Todo el comprobante se escribe en una sola transacción; un UUID ya
+    # registrado no se vuelve a insertar
+    with cronometro(INGESTA_ETAPA, etapa="escritura"):
+        id_comprobante = await insertar_cfdi(db, cfdi)
+
+    if id_comprobante is None:
+        return {
+            "mensaje": "El comprobante ya estaba registrado",
+            "uuid": cfdi["comprobante"]["uuid"],
+            "nuevos": 0,
+            "duplicados": 1
+        }
+    return {
+        "mensaje": "Archivo XML procesado correctamente",
+        "id_comprobante": id_comprobante,
+        "uuid": cfdi["comprobante"]["uuid"],
+        "nuevos": 1,
+        "duplicados": 0
+    }
 
-    return {"mensaje": "Archivo XML procesado correctamente"}
+@app.post("/procesar_xml/lote")
+async def procesar_xml_lote(files: List[UploadFile] = File(..., description="Archivos XML o ZIP con XML"), db: AsyncSession = Depends(get_db)):
+    return await procesar_lote(db, files)
 
 @app.delete("/emisor/{rfc}")
 async def eliminar_emisor(rfc: str, db: AsyncSession = Depends(get_db)):
-    emisor = await db.execute(text("SELECT id_emisor FROM cfd_emisor WHERE rfc = :rfc"), {"rfc": rfc})
-    emisor_id = emisor.scalar()
+    # Borra todos los ids con ese RFC, por bloques y en orden de dependencias
+    resultado = await purgar_emisor(db, rfc)
 
-    if not emisor_id:
+    if resultado is None:
         raise HTTPException(status_code=404, detail="Emisor no encontrado")
 
-    await db.execute(text("DELETE FROM cfd_impuesto_trasladado_general WHERE id_comprobante IN (SELECT id_comprobante FROM cfd_comprobante WHERE id_emisor = :emisor_id)"), {"emisor_id": emisor_id})
-    await db.execute(text("DELETE FROM cfd_concepto WHERE id_comprobante IN (SELECT id_comprobante FROM cfd_comprobante WHERE id_emisor = :emisor_id)"), {"emisor_id": emisor_id})
-    await db.execute(text("DELETE FROM cfd_impuesto_trasladado_concepto WHERE id_concepto IN (SELECT id_concepto FROM cfd_concepto WHERE id_comprobante IN (SELECT id_comprobante FROM cfd_comprobante WHERE id_emisor = :emisor_id))"), {"emisor_id": emisor_id})
-    await db.execute(text("DELETE FROM cfd_comprobante WHERE id_emisor = :emisor_id"), {"emisor_id": emisor_id})
-    await db.execute(text("DELETE FROM cfd_emisor WHERE id_emisor = :emisor_id"), {"emisor_id": emisor_id})
-    await db.commit()
+    return {"mensaje": f"Emisor con RFC {rfc} eliminado correctamente", **resultado}
 
-    return {"mensaje": f"Emisor con RFC {rfc} eliminado correctamente"}
+@app.get("/cache/metricas")
+async def metricas_cache():
+    return await cache_respuestas.metricas()
 
-@app.get("/estadisticas")
+@app.get("/snapshot/metricas")
+async def metricas_snapshot():
+    return snapshot_analisis.metricas()
+
+@app.get("/estadisticas", dependencies=dependencias_analisis)
 async def obtener_estadisticas(
+    request: Request,
     fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
-    fecha_fin: Optional[date] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
+    fecha_fin: Optional[date] = Query(None, description=DESCRIPCION_FECHA_FIN),
     year: Optional[int] = Query(None, description="Año específico"),
     month: Optional[int] = Query(None, description="Mes específico (1-12)"),
     day: Optional[int] = Query(None, description="Día específico (1-31)"),
+    aproximado: bool = Query(False, description="Usar el resumen diario (mediana, moda y percentiles aproximados)"),
     db: AsyncSession = Depends(get_db)
 ):
-    query = text("""
-        SELECT total, fecha 
-        FROM cfd_comprobante
-        WHERE 1=1
-    """)
-    params = {}
-    
-    if fecha_inicio and fecha_fin:
-        query = text(str(query) + " AND fecha BETWEEN :fecha_inicio AND :fecha_fin")
-        params.update({"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin})
-    elif year is not None:
-        if month is not None:
-            if day is not None:
-                query = text(str(query) + " AND EXTRACT(YEAR FROM fecha) = :year AND EXTRACT(MONTH FROM fecha) = :month AND EXTRACT(DAY FROM fecha) = :day")
-                params.update({"year": year, "month": month, "day": day})
-            else:
-                query = text(str(query) + " AND EXTRACT(YEAR FROM fecha) = :year AND EXTRACT(MONTH FROM fecha) = :month")
-                params.update({"year": year, "month": month})
-        else:
-            query = text(str(query) + " AND EXTRACT(YEAR FROM fecha) = :year")
-            params.update({"year": year})
-    
-    resultados = await db.execute(query, params)
-    datos = resultados.fetchall()
-    
-    if not datos:
-        raise HTTPException(status_code=404, detail="No se encontraron datos para los filtros aplicados")
-    
-    valores = [float(row[0]) for row in datos]
-    fechas = [row[1] for row in datos]
-    datos_np = np.array(valores)
-    moda_result = stats.mode(datos_np, keepdims=False)
-    moda = moda_result.mode.tolist()
-    if isinstance(moda, (int, float)):
-        moda = [moda]
-    
-    estadisticas = {
-        "cantidad_registros": len(valores),
-        "media": float(np.mean(datos_np)),
-        "mediana": float(np.median(datos_np)),
-        "moda": [float(x) for x in moda],
-        "varianza": float(np.var(datos_np)),
-        "desviacion_estandar": float(np.std(datos_np)),
-        "minimo": float(np.min(datos_np)),
-        "maximo": float(np.max(datos_np)),
-        "rango": float(np.ptp(datos_np)),
-        "percentiles": {
-            "25": float(np.percentile(datos_np, 25)),
-            "50": float(np.percentile(datos_np, 50)),
-            "75": float(np.percentile(datos_np, 75))
-        }
-    }
-    
-    return {
-        "filtros_aplicados": {
-            "fecha_inicio": fecha_inicio,
-            "fecha_fin": fecha_fin,
-            "year": year,
-            "month": month,
-            "day": day
-        },
-        "estadisticas": estadisticas,
-        "primer_registro": fechas[0].isoformat(),
-        "ultimo_registro": fechas[-1].isoformat()
-    }
+    rango = rango_fechas(fecha_inicio, fecha_fin, year, month, day)
+
+    async def calcular():
+        if aproximado:
+            resultado = await db.execute(consulta_agregados(rango), parametros_agregados(rango))
+            agregados = resultado.mappings().one()
+            if not agregados["cantidad"]:
+                raise HTTPException(status_code=404, detail="No se encontraron datos para los filtros aplicados")
+            return {
+                "filtros_aplicados": {
+                    "fecha_inicio": fecha_inicio,
+                    "fecha_fin": fecha_fin,
+                    "year": year,
+                    "month": month,
+                    "day": day,
+                    "aproximado": aproximado
+                },
+                "estadisticas": estadisticas_desde_agregados(agregados),
+                "primer_registro": agregados["primer_dia"].isoformat(),
+                "ultimo_registro": agregados["ultimo_dia"].isoformat()
+            }
 
+        # Del snapshot en memoria si está activo; si no, Postgres
+        resumen = await snapshot_analisis.resumen(rango)
+        if resumen is None:
+            resultado = await db.execute(consulta_resumen(rango), parametros_rango(rango))
+            resumen = resultado.mappings().one()
+
+        if not resumen["cantidad"]:
+            raise HTTPException(status_code=404, detail="No se encontraron datos para los filtros aplicados")
+
+        return {
+            "filtros_aplicados": {
+                "fecha_inicio": fecha_inicio,
+                "fecha_fin": fecha_fin,
+                "year": year,
+                "month": month,
+                "day": day
+            },
+            "estadisticas": estadisticas_desde_resumen(resumen),
+            "primer_registro": resumen["primer_registro"].isoformat(),
+            "ultimo_registro": resumen["ultimo_registro"].isoformat()
+        }
 
-    return await obtener_estadisticas(db=db)
+    return await cache_respuestas.responder(request, alcance(rango=rango), calcular)
 
-@app.get("/registros")
+@app.get("/registros", dependencies=dependencias_analisis)
 async def obtener_registros(
     fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
-    fecha_fin: Optional[date] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
+    fecha_fin: Optional[date] = Query(None, description=DESCRIPCION_FECHA_FIN),
     year: Optional[int] = Query(None, description="Año específico"),
     month: Optional[int] = Query(None, description="Mes específico (1-12)"),
     day: Optional[int] = Query(None, description="Día específico (1-31)"),
     limit: int = Query(100, description="Límite de registros"),
-    offset: int = Query(0, description="Desplazamiento"),
+    offset: int = Query(0, description="Desplazamiento (se ignora si se envía cursor)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (siguiente_cursor)"),
     db: AsyncSession = Depends(get_db)
 ):
-    query = text("""
-        SELECT 
-            c.id_comprobante, c.fecha, c.total, c.tipo_de_comprobante,
-            e.rfc as rfc_emisor, e.nombre as nombre_emisor,
-            r.rfc as rfc_receptor, r.nombre as nombre_receptor
-        FROM cfd_comprobante c
-        JOIN cfd_emisor e ON c.id_emisor = e.id_emisor
-        JOIN cfd_receptor r ON c.id_receptor = r.id_receptor
-        WHERE 1=1
-    """)
-    params = {}
-    
-    if fecha_inicio and fecha_fin:
-        query = text(str(query) + " AND c.fecha BETWEEN :fecha_inicio AND :fecha_fin")
-        params.update({"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin})
-    elif year is not None:
-        if month is not None:
-            if day is not None:
-                query = text(str(query) + " AND EXTRACT(YEAR FROM c.fecha) = :year AND EXTRACT(MONTH FROM c.fecha) = :month AND EXTRACT(DAY FROM c.fecha) = :day")
-                params.update({"year": year, "month": month, "day": day})
-            else:
-                query = text(str(query) + " AND EXTRACT(YEAR FROM c.fecha) = :year AND EXTRACT(MONTH FROM c.fecha) = :month")
-                params.update({"year": year, "month": month})
-        else:
-            query = text(str(query) + " AND EXTRACT(YEAR FROM c.fecha) = :year")
-            params.update({"year": year})
-    
-    query = text(str(query) + " ORDER BY c.fecha DESC LIMIT :limit OFFSET :offset")
-    params.update({"limit": limit, "offset": offset})
+    rango = rango_fechas(fecha_inicio, fecha_fin, year, month, day)
+    try:
+        posicion = decodificar_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    query = consulta_registros(rango, posicion)
+    params = parametros_registros(rango, limit, offset, posicion)
     
     resultados = await db.execute(query, params)
     registros = resultados.fetchall()
@@ -307,22 +197,7 @@ async def obtener_registros(
     if not registros:
         raise HTTPException(status_code=404, detail="No se encontraron registros para los filtros aplicados")
     
-    registros_formateados = []
-    for row in registros:
-        registros_formateados.append({
-            "id_comprobante": row[0],
-            "fecha": row[1].isoformat(),
-            "total": float(row[2]),
-            "tipo_comprobante": row[3],
-            "emisor": {
-                "rfc": row[4],
-                "nombre": row[5]
-            },
-            "receptor": {
-                "rfc": row[6],
-                "nombre": row[7]
-            }
-        })
+    registros_formateados = [formatear_registro(row) for row in registros]
     
     return {
         "filtros_aplicados": {
@@ -332,136 +207,217 @@ async def obtener_registros(
             "month": month,
             "day": day,
             "limit": limit,
-            "offset": offset
+            "offset": offset,
+            "cursor": cursor
         },
         "total_registros": len(registros_formateados),
-        "registros": registros_formateados
+        "registros": registros_formateados,
+        "siguiente_cursor": codificar_cursor(registros[-1][1], registros[-1][0]) if len(registros) == limit else None
     }
 
-@app.get("/registros/dia/{year}/{month}/{day}")
+@app.get("/registros/exportar", dependencies=dependencias_analisis)
+async def exportar_registros(
+    formato: str = Query("ndjson", description="Formato: ndjson, csv o parquet"),
+    fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
+    fecha_fin: Optional[date] = Query(None, description=DESCRIPCION_FECHA_FIN),
+    year: Optional[int] = Query(None, description="Año específico"),
+    month: Optional[int] = Query(None, description="Mes específico (1-12)"),
+    day: Optional[int] = Query(None, description="Día específico (1-31)")
+):
+    if formato not in FORMATOS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {formato}")
+    if formato == "parquet" and not PARQUET_DISPONIBLE:
+        raise HTTPException(status_code=400, detail="La exportación a Parquet requiere pyarrow")
+
+    rango = rango_fechas(fecha_inicio, fecha_fin, year, month, day)
+    return StreamingResponse(
+        exportar(formato, rango),
+        media_type=FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="comprobantes.{formato}"'}
+    )
+
+@app.get("/registros/dia/{year}/{month}/{day}", dependencies=dependencias_analisis)
 async def registros_por_dia(
     year: Annotated[int, conint(ge=2000, le=2100)],
     month: Annotated[int, conint(ge=1, le=12)],
     day: Annotated[int, conint(ge=1, le=31)],
     limit: int = Query(100, description="Límite de registros"),
-    offset: int = Query(0, description="Desplazamiento"),
+    offset: int = Query(0, description="Desplazamiento (se ignora si se envía cursor)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (siguiente_cursor)"),
     db: AsyncSession = Depends(get_db)
 ):
-    return await obtener_registros(year=year, month=month, day=day, limit=limit, offset=offset, db=db)
+    return await obtener_registros(fecha_inicio=None, fecha_fin=None, year=year, month=month, day=day, limit=limit, offset=offset, cursor=cursor, db=db)
 
-@app.get("/registros/mes/{year}/{month}")
+@app.get("/registros/mes/{year}/{month}", dependencies=dependencias_analisis)
 async def registros_por_mes(
     year: Annotated[int, conint(ge=2000, le=2100)],
     month: Annotated[int, conint(ge=1, le=12)],
     limit: int = Query(100, description="Límite de registros"),
-    offset: int = Query(0, description="Desplazamiento"),
+    offset: int = Query(0, description="Desplazamiento (se ignora si se envía cursor)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (siguiente_cursor)"),
     db: AsyncSession = Depends(get_db)
 ):
-    return await obtener_registros(year=year, month=month, limit=limit, offset=offset, db=db)
+    return await obtener_registros(fecha_inicio=None, fecha_fin=None, year=year, month=month, day=None, limit=limit, offset=offset, cursor=cursor, db=db)
 
-@app.get("/registros/ano/{year}")
+@app.get("/registros/ano/{year}", dependencies=dependencias_analisis)
 async def registros_por_ano(
     year: Annotated[int, conint(ge=2000, le=2100)],
     limit: int = Query(100, description="Límite de registros"),
-    offset: int = Query(0, description="Desplazamiento"),
+    offset: int = Query(0, description="Desplazamiento (se ignora si se envía cursor)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (siguiente_cursor)"),
     db: AsyncSession = Depends(get_db)
 ):
-    return await obtener_registros(year=year, limit=limit, offset=offset, db=db)
+    return await obtener_registros(fecha_inicio=None, fecha_fin=None, year=year, month=None, day=None, limit=limit, offset=offset, cursor=cursor, db=db)
 
-@app.get("/registros/todos")
+@app.get("/registros/todos", dependencies=dependencias_analisis)
 async def registros_todos(
     limit: int = Query(100, description="Límite de registros"),
-    offset: int = Query(0, description="Desplazamiento"),
+    offset: int = Query(0, description="Desplazamiento (se ignora si se envía cursor)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (siguiente_cursor)"),
     db: AsyncSession = Depends(get_db)
 ):
-    return await obtener_registros(limit=limit, offset=offset, db=db)
+    return await obtener_registros(fecha_inicio=None, fecha_fin=None, year=None, month=None, day=None, limit=limit, offset=offset, cursor=cursor, db=db)
 
-@app.get("/estadisticas/tipo-comprobante")
+@app.get("/estadisticas/tipo-comprobante", dependencies=dependencias_analisis)
 async def estadisticas_por_tipo_comprobante(
+    request: Request,
     tipo: str = Query(..., description="Tipo de comprobante (I, E, etc.)"),
     db: AsyncSession = Depends(get_db)
 ):
-    query = text("SELECT total FROM cfd_comprobante WHERE tipo_de_comprobante = :tipo")
-    resultados = await db.execute(query, {"tipo": tipo})
-    valores = [float(row[0]) for row in resultados.fetchall()]
-    
-    if not valores:
-        raise HTTPException(status_code=404, detail=f"No se encontraron comprobantes del tipo {tipo}")
-    
-    datos_np = np.array(valores)
-    
-    return {
-        "tipo_comprobante": tipo,
-        "cantidad": len(valores),
-        "media": float(np.mean(datos_np)),
-        "mediana": float(np.median(datos_np)),
-        "desviacion_estandar": float(np.std(datos_np))
-    }
+    async def calcular():
+        resumen = await snapshot_analisis.resumen(tipo=tipo)
+        if resumen is None:
+            resultado = await db.execute(RESUMEN_POR_TIPO, {"tipo": tipo})
+            resumen = resultado.mappings().one()
+
+        if not resumen["cantidad"]:
+            raise HTTPException(status_code=404, detail=f"No se encontraron comprobantes del tipo {tipo}")
+
+        return {
+            "tipo_comprobante": tipo,
+            "cantidad": resumen["cantidad"],
+            "media": float(resumen["media"]),
+            "mediana": float(resumen["p50"]),
+            "desviacion_estandar": float(resumen["desviacion_estandar"])
+        }
+
+    return await cache_respuestas.responder(request, alcance(tipos=[tipo]), calcular)
 
-@app.get("/estadisticas/emisor/{rfc}")
+@app.get("/estadisticas/emisor/{rfc}", dependencies=dependencias_analisis)
 async def estadisticas_por_emisor(
+    request: Request,
     rfc: str,
     db: AsyncSession = Depends(get_db)
 ):
-    query = text("""
-        SELECT c.total 
-        FROM cfd_comprobante c
-        JOIN cfd_emisor e ON c.id_emisor = e.id_emisor
-        WHERE e.rfc = :rfc
-    """)
-    resultados = await db.execute(query, {"rfc": rfc})
-    valores = [float(row[0]) for row in resultados.fetchall()]
-    
-    if not valores:
-        raise HTTPException(status_code=404, detail=f"No se encontraron comprobantes para el emisor con RFC {rfc}")
-    
-    datos_np = np.array(valores)
-    
-    return {
-        "rfc_emisor": rfc,
-        "cantidad": len(valores),
-        "total_general": float(np.sum(datos_np)),
-        "promedio": float(np.mean(datos_np))
-    }
-
-@app.post("/analisis_inferencial")
-async def analisis_inferencial(db: AsyncSession = Depends(get_db)):
-    grupo1_result = await db.execute(text("SELECT total FROM cfd_comprobante WHERE tipo_de_comprobante = 'I'"))
-    grupo2_result = await db.execute(text("SELECT total FROM cfd_comprobante WHERE tipo_de_comprobante = 'E'"))
-    
-    grupo1 = [float(row[0]) for row in grupo1_result.fetchall()]
-    grupo2 = [float(row[0]) for row in grupo2_result.fetchall()]
+    async def calcular():
+        resumen = None
+        if snapshot_analisis.disponible():
+            id_emisor = await id_emisor_por_rfc(db, rfc)
+            resumen = {"cantidad": 0} if id_emisor is None else await snapshot_analisis.resumen(id_emisor=id_emisor)
+        if resumen is None:
+            resultado = await db.execute(RESUMEN_POR_EMISOR, {"rfc": rfc})
+            resumen = resultado.mappings().one()
+
+        if not resumen["cantidad"]:
+            raise HTTPException(status_code=404, detail=f"No se encontraron comprobantes para el emisor con RFC {rfc}")
+
+        return {
+            "rfc_emisor": rfc,
+            "cantidad": resumen["cantidad"],
+            "total_general": float(resumen["suma"]),
+            "promedio": float(resumen["media"])
+        }
 
-    if not grupo1 or not grupo2:
-        return {"error": "No se encontraron suficientes datos en la base de datos."}
+    return await cache_respuestas.responder(request, alcance(rfcs=[rfc]), calcular)
 
-    t_test = stats.ttest_ind(grupo1, grupo2, equal_var=False)
-    
-    return {
-        "prueba_t": {
-            "statistica": t_test.statistic,
-            "p_valor": t_test.pvalue
+@app.post("/analisis_inferencial", dependencies=dependencias_analisis)
+async def analisis_inferencial(
+    request: Request,
+    tipo_a: str = Query("I", description="Primer tipo de comprobante de la prueba t"),
+    tipo_b: str = Query("E", description="Segundo tipo de comprobante de la prueba t"),
+    anova: bool = Query(False, description="Agregar ANOVA de un factor entre todos los tipos"),
+    fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
+    fecha_fin: Optional[date] = Query(None, description=DESCRIPCION_FECHA_FIN),
+    year: Optional[int] = Query(None, description="Año específico"),
+    month: Optional[int] = Query(None, description="Mes específico (1-12)"),
+    day: Optional[int] = Query(None, description="Día específico (1-31)"),
+    db: AsyncSession = Depends(get_db)
+):
+    rango = rango_fechas(fecha_inicio, fecha_fin, year, month, day)
+
+    async def calcular():
+        # n, media y varianza por tipo en una sola consulta sobre el resumen diario
+        resultado = await db.execute(consulta_momentos(rango), parametros_agregados(rango))
+        momentos = momentos_por_tipo(resultado.mappings().all())
+
+        grupo_a = momentos.get(tipo_a)
+        grupo_b = momentos.get(tipo_b)
+        if not grupo_a or not grupo_b or grupo_a["varianza"] is None or grupo_b["varianza"] is None:
+            return {"error": "No se encontraron suficientes datos en la base de datos."}
+
+        # La primera vez importa scipy fuera del event loop (sin efecto si ya está cargado)
+        await run_in_threadpool(precargar)
+        respuesta = {
+            "prueba_t": prueba_t_welch(grupo_a, grupo_b),
+            "grupos": {
+                tipo: {"n": grupo["n"], "media": float(grupo["media"]), "varianza": float(grupo["varianza"])}
+                for tipo, grupo in ((tipo_a, grupo_a), (tipo_b, grupo_b))
+            }
         }
-    }
+        if anova:
+            # Entran también los tipos con un solo comprobante, como en f_oneway
+            respuesta["anova"] = (
+                anova_desde_momentos(list(momentos.values())) | {"tipos": sorted(momentos)}
+                if len(momentos) >= 2 else None
+            )
+        return respuesta
+
+    tipos = None if anova else [tipo_a, tipo_b]
+    return await cache_respuestas.responder(request, alcance(rango=rango, tipos=tipos), calcular)
+
+# 🔮 Análisis Predictivo con Regresión Lineal sobre el estado incremental
+@app.post("/analisis_predictivo", dependencies=dependencias_analisis)
+async def analisis_predictivo(
+    request: Request,
+    tipo: Optional[str] = Query(None, description="Ajustar solo los comprobantes de este tipo"),
+    rfc: Optional[str] = Query(None, description="Ajustar solo los comprobantes de este emisor"),
+    fechas: Optional[List[date]] = Query(None, description="Fechas a pronosticar (YYYY-MM-DD)"),
+    puntos: conint(ge=2, le=1000) = Query(50, description="Puntos de la curva cuando no se piden fechas"),
+    db: AsyncSession = Depends(get_db)
+):
+    if tipo is not None and rfc is not None:
+        raise HTTPException(status_code=400, detail="Agrupe por tipo o por emisor, no por ambos")
+    dimension = "tipo" if tipo is not None else "emisor" if rfc is not None else "todos"
+    parametros = {"tipo": tipo} if tipo is not None else {"rfc": rfc} if rfc is not None else {}
 
-# 🔮 Análisis Predictivo con Regresión Lineal (existente)
-@app.post("/analisis_predictivo")
-async def analisis_predictivo(db: AsyncSession = Depends(get_db)):
-    datos_result = await db.execute(text("SELECT fecha, total FROM cfd_comprobante ORDER BY fecha ASC"))
-    datos = [(row[0], float(row[1])) for row in datos_result.fetchall()]
+    async def calcular():
+        resultado = await db.execute(consulta_estado(dimension), parametros)
+        fila = resultado.mappings().one_or_none()
+        modelo = ajustar(fila) if fila is not None else None
 
-    if not datos:
-        return {"error": "No se encontraron datos suficientes en la base de datos."}
+        if modelo is None:
+            return {"error": "No se encontraron datos suficientes en la base de datos."}
 
-    fechas = np.array([dato[0].timestamp() for dato in datos]).reshape(-1, 1)
-    valores = np.array([dato[1] for dato in datos])
+        if fechas:
+            predicciones = predecir(modelo, [datetime.combine(fecha, datetime.min.time()) for fecha in fechas])
+        else:
+            extremos = (await db.execute(consulta_extremos(dimension), parametros)).mappings().one()
+            predicciones = curva(
+                modelo,
+                datetime.combine(extremos["primer_dia"], datetime.min.time()),
+                datetime.combine(extremos["ultimo_dia"], datetime.max.time()),
+                puntos
+            )
 
-    modelo = LinearRegression()
-    modelo.fit(fechas, valores)
-    predicciones = modelo.predict(fechas).tolist()
+        return {
+            "grupo": {"tipo": tipo, "rfc": rfc},
+            "cantidad_registros": fila["n"],
+            "coeficiente": [float(modelo["pendiente"])],
+            "intercepto": float(modelo["intercepto"]),
+            "r2": float(modelo["r2"]),
+            "predicciones": predicciones
+        }
 
-    return {
-        "coeficiente": modelo.coef_.tolist(),
-        "intercepto": modelo.intercept_.tolist(),
-        "predicciones": predicciones
-    }
\ No newline at end of file
+    return await cache_respuestas.responder(
+        request, alcance(tipos=[tipo] if tipo is not None else None, rfcs=[rfc] if rfc is not None else None), calcular
+    )
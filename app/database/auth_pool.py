@@ -0,0 +1,86 @@
+import os
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+# Configuración del pool de la base de datos de usuarios
+AUTH_DB_USER = os.getenv("AUTH_DB_USER", "kong")
+AUTH_DB_PASSWORD = os.getenv("AUTH_DB_PASSWORD", "kong")
+AUTH_DB_NAME = os.getenv("AUTH_DB_NAME", "kong")
+AUTH_DB_HOST = os.getenv("AUTH_DB_HOST", "db")
+AUTH_POOL_MIN = int(os.getenv("AUTH_POOL_MIN", 2))
+AUTH_POOL_MAX = int(os.getenv("AUTH_POOL_MAX", 10))
+# Segundos máximos de espera por una conexión libre
+AUTH_POOL_TIMEOUT = float(os.getenv("AUTH_POOL_TIMEOUT", 5))
+# Segundos máximos por sentencia
+AUTH_COMMAND_TIMEOUT = float(os.getenv("AUTH_COMMAND_TIMEOUT", 10))
+AUTH_STATEMENT_CACHE_SIZE = int(os.getenv("AUTH_STATEMENT_CACHE_SIZE", 100))
+
+_pool = None
+_metricas = {
+    "adquisiciones": 0,
+    "tiempos_agotados": 0,
+    "espera_total_s": 0.0,
+    "espera_maxima_s": 0.0,
+}
+
+
+async def abrir_pool():
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            user=AUTH_DB_USER,
+            password=AUTH_DB_PASSWORD,
+            database=AUTH_DB_NAME,
+            host=AUTH_DB_HOST,
+            min_size=AUTH_POOL_MIN,
+            max_size=AUTH_POOL_MAX,
+            command_timeout=AUTH_COMMAND_TIMEOUT,
+            statement_cache_size=AUTH_STATEMENT_CACHE_SIZE
+        )
+    return _pool
+
+
+async def cerrar_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+@asynccontextmanager
+async def adquirir():
+    """
+    Toma una conexión del pool y la devuelve siempre, aunque el bloque falle.
+    Registra cuánto se esperó por ella.
+    """
+    pool = await abrir_pool()
+    inicio = time.perf_counter()
+    try:
+        conexion = await pool.acquire(timeout=AUTH_POOL_TIMEOUT)
+    except TimeoutError:
+        _metricas["tiempos_agotados"] += 1
+        raise
+    espera = time.perf_counter() - inicio
+    _metricas["adquisiciones"] += 1
+    _metricas["espera_total_s"] += espera
+    _metricas["espera_maxima_s"] = max(_metricas["espera_maxima_s"], espera)
+    try:
+        yield conexion
+    finally:
+        await pool.release(conexion)
+
+
+def metricas():
+    adquisiciones = _metricas["adquisiciones"]
+    return {
+        "tamano": _pool.get_size() if _pool else 0,
+        "en_uso": _pool.get_size() - _pool.get_idle_size() if _pool else 0,
+        "minimo": AUTH_POOL_MIN,
+        "maximo": AUTH_POOL_MAX,
+        "adquisiciones": adquisiciones,
+        "tiempos_agotados": _metricas["tiempos_agotados"],
+        "espera_promedio_ms": _metricas["espera_total_s"] / adquisiciones * 1000 if adquisiciones else None,
+        "espera_maxima_ms": _metricas["espera_maxima_s"] * 1000,
+    }
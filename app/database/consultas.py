@@ -0,0 +1,199 @@
+import base64
+import json
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, bindparam, func, tuple_
+
+from app.models.models import CFDComprobante, CFDEmisor, CFDReceptor
+
+comprobante = CFDComprobante.__table__
+emisor = CFDEmisor.__table__
+receptor = CFDReceptor.__table__
+
+# Rango vacío para fechas que no existen (p. ej. 31 de febrero)
+_RANGO_VACIO = (datetime(1970, 1, 1), datetime(1970, 1, 1))
+
+
+def rango_fechas(fecha_inicio=None, fecha_fin=None, year=None, month=None, day=None):
+    """
+    Convierte los filtros de fecha de los endpoints en un rango semiabierto.
+    El filtro resultante `fecha >= inicio AND fecha < fin` puede usar los
+    índices sobre fecha, a diferencia de EXTRACT(YEAR/MONTH/DAY ...).
+    :return: Tupla (inicio, fin) o None si no hay filtro de fecha.
+    """
+    try:
+        if fecha_inicio and fecha_fin:
+            # fecha_fin es inclusiva: se incluye el día completo
+            inicio = fecha_inicio
+            fin = fecha_fin + timedelta(days=1)
+        elif year is not None:
+            if month is not None:
+                if day is not None:
+                    inicio = date(year, month, day)
+                    fin = inicio + timedelta(days=1)
+                else:
+                    inicio = date(year, month, 1)
+                    fin = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+            else:
+                inicio = date(year, 1, 1)
+                fin = date(year + 1, 1, 1)
+        else:
+            return None
+    except (ValueError, OverflowError):
+        return _RANGO_VACIO
+
+    return datetime.combine(inicio, datetime.min.time()), datetime.combine(fin, datetime.min.time())
+
+
+def parametros_rango(rango):
+    if rango is None:
+        return {}
+    return {"inicio": rango[0], "fin": rango[1]}
+
+
+def _filtrar_fecha(stmt, columna):
+    return stmt.where(columna >= bindparam("inicio"), columna < bindparam("fin"))
+
+
+def codificar_cursor(fecha, id_comprobante):
+    """
+    Cursor opaco con la posición (fecha, id_comprobante) del último registro de la página.
+    """
+    contenido = json.dumps([fecha.isoformat(), id_comprobante]).encode("utf-8")
+    return base64.urlsafe_b64encode(contenido).decode("ascii")
+
+
+def decodificar_cursor(cursor):
+    """
+    :return: Tupla (fecha, id_comprobante).
+    :raises ValueError: Si el cursor no es válido.
+    """
+    try:
+        fecha, id_comprobante = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(fecha), int(id_comprobante)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Cursor inválido")
+
+
+def _columnas_registros():
+    return (
+        select(
+            comprobante.c.id_comprobante, comprobante.c.fecha, comprobante.c.total, comprobante.c.tipo_de_comprobante,
+            emisor.c.rfc.label("rfc_emisor"), emisor.c.nombre.label("nombre_emisor"),
+            receptor.c.rfc.label("rfc_receptor"), receptor.c.nombre.label("nombre_receptor")
+        )
+        .select_from(
+            comprobante
+            .join(emisor, comprobante.c.id_emisor == emisor.c.id_emisor)
+            .join(receptor, comprobante.c.id_receptor == receptor.c.id_receptor)
+        )
+    )
+
+
+def _registros(con_rango, con_cursor):
+    stmt = _columnas_registros()
+    if con_rango:
+        stmt = _filtrar_fecha(stmt, comprobante.c.fecha)
+    # id_comprobante desempata fechas iguales para que el orden sea total
+    stmt = stmt.order_by(comprobante.c.fecha.desc(), comprobante.c.id_comprobante.desc()).limit(bindparam("limit"))
+    if con_cursor:
+        # Paginación por llave: la página N cuesta lo mismo que la primera
+        return stmt.where(
+            tuple_(comprobante.c.fecha, comprobante.c.id_comprobante)
+            < tuple_(bindparam("cursor_fecha"), bindparam("cursor_id"))
+        )
+    return stmt.offset(bindparam("offset"))
+
+
+def _exportacion(con_rango):
+    stmt = _columnas_registros()
+    if con_rango:
+        stmt = _filtrar_fecha(stmt, comprobante.c.fecha)
+    return stmt.order_by(comprobante.c.fecha, comprobante.c.id_comprobante)
+
+
+def _resumen(*filtros):
+    # Estadísticas descriptivas calculadas por Postgres en una sola consulta
+    total = comprobante.c.total
+    return select(
+        func.count().label("cantidad"),
+        func.sum(total).label("suma"),
+        func.avg(total).label("media"),
+        func.var_pop(total).label("varianza"),
+        func.stddev_pop(total).label("desviacion_estandar"),
+        func.min(total).label("minimo"),
+        func.max(total).label("maximo"),
+        func.percentile_cont(0.25).within_group(total).label("p25"),
+        func.percentile_cont(0.5).within_group(total).label("p50"),
+        func.percentile_cont(0.75).within_group(total).label("p75"),
+        func.mode().within_group(total).label("moda"),
+        func.min(comprobante.c.fecha).label("primer_registro"),
+        func.max(comprobante.c.fecha).label("ultimo_registro")
+    ).where(*filtros)
+
+
+def _resumen_basico(*filtros):
+    # Solo lo que leen /estadisticas/tipo-comprobante y /estadisticas/emisor:
+    # cada percentil extra o la moda es otro ordenamiento completo del grupo
+    total = comprobante.c.total
+    return select(
+        func.count().label("cantidad"),
+        func.sum(total).label("suma"),
+        func.avg(total).label("media"),
+        func.percentile_cont(0.5).within_group(total).label("p50"),
+        func.stddev_pop(total).label("desviacion_estandar")
+    ).where(*filtros)
+
+
+# 📌 Sentencias compuestas una sola vez; SQLAlchemy reutiliza su compilación
+# y asyncpg las mantiene como prepared statements por conexión.
+_REGISTROS = {
+    (con_rango, con_cursor): _registros(con_rango, con_cursor)
+    for con_rango in (False, True)
+    for con_cursor in (False, True)
+}
+_EXPORTACION = {False: _exportacion(False), True: _exportacion(True)}
+_RESUMEN = {
+    False: _resumen(),
+    True: _resumen(comprobante.c.fecha >= bindparam("inicio"), comprobante.c.fecha < bindparam("fin"))
+}
+
+RESUMEN_POR_TIPO = _resumen_basico(comprobante.c.tipo_de_comprobante == bindparam("tipo"))
+
+RESUMEN_POR_EMISOR = _resumen_basico(
+    comprobante.c.id_emisor.in_(select(emisor.c.id_emisor).where(emisor.c.rfc == bindparam("rfc")))
+)
+
+
+def consulta_registros(rango, cursor=None):
+    """
+    Consulta de /registros; requiere limit y además offset, o cursor_fecha y
+    cursor_id cuando se pagina con cursor.
+    :param rango: Resultado de rango_fechas.
+    :param cursor: Resultado de decodificar_cursor, o None para paginar por offset.
+    """
+    return _REGISTROS[(rango is not None, cursor is not None)]
+
+
+def parametros_registros(rango, limit, offset=0, cursor=None):
+    params = parametros_rango(rango) | {"limit": limit}
+    if cursor is None:
+        return params | {"offset": offset}
+    return params | {"cursor_fecha": cursor[0], "cursor_id": cursor[1]}
+
+
+def consulta_exportacion(rango):
+    """
+    Todos los registros del rango en orden cronológico, sin límite; pensada
+    para leerse con un cursor del servidor (AsyncSession.stream).
+    :param rango: Resultado de rango_fechas.
+    """
+    return _EXPORTACION[rango is not None]
+
+
+def consulta_resumen(rango):
+    """
+    Consulta de estadísticas agregadas usada por /estadisticas.
+    :param rango: Resultado de rango_fechas.
+    """
+    return _RESUMEN[rango is not None]
@@ -0,0 +1,142 @@
+import os
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Tablas co-particionadas por mes de fecha (migración 0007), de padre a hijas
+TABLAS_PARTICIONADAS = (
+    "cfd_comprobante",
+    "cfd_concepto",
+    "cfd_impuesto_trasladado_concepto",
+    "cfd_impuesto_trasladado_general",
+)
+# Orden para separar un mes: primero las tablas que referencian a otras
+ORDEN_ARCHIVO = (
+    "cfd_impuesto_trasladado_concepto",
+    "cfd_concepto",
+    "cfd_impuesto_trasladado_general",
+    "cfd_comprobante",
+)
+
+# Meses futuros que se crean al iniciar la aplicación
+PARTICIONES_MESES_ADELANTE = int(os.getenv("PARTICIONES_MESES_ADELANTE", 3))
+ESQUEMA_ARCHIVO = os.getenv("ESQUEMA_ARCHIVO", "archivo")
+
+_CREAR = text("SELECT cfd_crear_particiones(:desde, :hasta)")
+
+_PARTICIONES = text("""
+    SELECT hija.relname AS nombre,
+           pg_get_expr(hija.relpartbound, hija.oid) AS limites,
+           hija.reltuples::bigint AS filas_estimadas
+    FROM pg_inherits
+    JOIN pg_class padre ON padre.oid = pg_inherits.inhparent
+    JOIN pg_class hija ON hija.oid = pg_inherits.inhrelid
+    WHERE padre.relname = :tabla
+    ORDER BY hija.relname
+""")
+
+# Meses cuya partición ya existe; evita consultar el catálogo en cada ingesta.
+# Si otro proceso archiva un mes, el INSERT falla y la ingesta llama a
+# olvidar_particiones antes de reintentar.
+_meses_existentes = set()
+
+
+def mes_de(fecha):
+    return date(fecha.year, fecha.month, 1)
+
+
+def mes_siguiente(mes: date):
+    return date(mes.year + 1, 1, 1) if mes.month == 12 else date(mes.year, mes.month + 1, 1)
+
+
+def nombre_particion(tabla, mes: date):
+    return f"{tabla}_p{mes:%Y_%m}"
+
+
+async def crear_particiones(db: AsyncSession, desde: date, hasta: date):
+    """
+    Crea las particiones mensuales faltantes de [desde, hasta) en una
+    transacción corta propia (crear una partición bloquea a la tabla padre).
+    :return: Número de particiones creadas.
+    """
+    creadas = (await db.execute(_CREAR, {"desde": desde, "hasta": hasta})).scalar()
+    await db.commit()
+    mes = mes_de(desde)
+    while mes < hasta:
+        _meses_existentes.add(mes)
+        mes = mes_siguiente(mes)
+    return creadas
+
+
+async def asegurar_particiones(db: AsyncSession, fechas):
+    """
+    Garantiza que existan las particiones de los meses de las fechas dadas;
+    se llama antes de insertar, fuera de la transacción de la ingesta.
+    """
+    for mes in sorted({mes_de(fecha) for fecha in fechas} - _meses_existentes):
+        await crear_particiones(db, mes, mes_siguiente(mes))
+
+
+def olvidar_particiones():
+    _meses_existentes.clear()
+
+
+def es_particion_faltante(error):
+    """
+    :param error: Excepción de SQLAlchemy (DBAPIError).
+    :return: True si Postgres rechazó una fila porque su mes no tiene
+        partición (SQLSTATE 23514, "no partition of relation ... found for row").
+    """
+    orig = getattr(error, "orig", None)
+    return getattr(orig, "sqlstate", None) == "23514" and "no partition of relation" in str(orig)
+
+
+async def crear_particiones_futuras(db: AsyncSession, meses: int = PARTICIONES_MESES_ADELANTE):
+    desde = mes_de(date.today())
+    hasta = desde
+    for _ in range(meses + 1):
+        hasta = mes_siguiente(hasta)
+    return await crear_particiones(db, desde, hasta)
+
+
+async def listar_particiones(db: AsyncSession, tabla="cfd_comprobante"):
+    return (await db.execute(_PARTICIONES, {"tabla": tabla})).mappings().all()
+
+
+async def separar_mes(db: AsyncSession, mes: date, eliminar=False):
+    """
+    Separa (DETACH) la partición del mes de las cuatro tablas y la mueve al
+    esquema de archivo, o la borra si eliminar es verdadero. No confirma la
+    transacción: quien llama descuenta antes los agregados y hace commit.
+    :return: Lista de particiones separadas.
+    """
+    separadas = []
+    if not eliminar:
+        await db.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{ESQUEMA_ARCHIVO}"'))
+    for tabla in ORDEN_ARCHIVO:
+        particion = nombre_particion(tabla, mes)
+        existe = (await db.execute(text("SELECT to_regclass(:nombre)"), {"nombre": particion})).scalar()
+        if existe is None:
+            continue
+        await db.execute(text(f'ALTER TABLE "{tabla}" DETACH PARTITION "{particion}"'))
+        if eliminar:
+            await db.execute(text(f'DROP TABLE "{particion}"'))
+        else:
+            # Las llaves foráneas clonadas seguirían apuntando a las tablas
+            # activas e impedirían separar el mes del padre
+            await db.execute(text(f"""
+                DO $$
+                DECLARE llave record;
+                BEGIN
+                    FOR llave IN SELECT conname FROM pg_constraint
+                                 WHERE conrelid = '"{particion}"'::regclass AND contype = 'f' LOOP
+                        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', '{particion}', llave.conname);
+                    END LOOP;
+                END
+                $$
+            """))
+            await db.execute(text(f'ALTER TABLE "{particion}" SET SCHEMA "{ESQUEMA_ARCHIVO}"'))
+        separadas.append(particion)
+    _meses_existentes.discard(mes)
+    return separadas
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Numeric, ForeignKey, TIMESTAMP
+from sqlalchemy import Column, Integer, BigInteger, String, Numeric, ForeignKey, ForeignKeyConstraint, TIMESTAMP, Date, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -8,7 +9,7 @@ class CFDEmisor(Base):
     __tablename__ = "cfd_emisor"
     
     id_emisor = Column(Integer, primary_key=True, autoincrement=True)
-    rfc = Column(String(15), nullable=False)
+    rfc = Column(String(15), nullable=False, unique=True)
     nombre = Column(String(255), nullable=False)
     regimen_fiscal = Column(String(5), nullable=False)
 
@@ -17,7 +18,7 @@ class CFDReceptor(Base):
     __tablename__ = "cfd_receptor"
 
     id_receptor = Column(Integer, primary_key=True, autoincrement=True)
-    rfc = Column(String(15), nullable=False)
+    rfc = Column(String(15), nullable=False, unique=True)
     nombre = Column(String(255), nullable=False)
     domicilio_fiscal = Column(String(10))
     regimen_fiscal = Column(String(5), nullable=False)
@@ -26,12 +27,22 @@ class CFDReceptor(Base):
 # 📌 Modelo para la tabla de Comprobante
 class CFDComprobante(Base):
     __tablename__ = "cfd_comprobante"
+    __table_args__ = (
+        Index("ix_cfd_comprobante_fecha_id", "fecha", "id_comprobante"),
+        Index("ix_cfd_comprobante_tipo_fecha", "tipo_de_comprobante", "fecha"),
+        Index("ix_cfd_comprobante_id_emisor", "id_emisor"),
+        Index("brin_cfd_comprobante_fecha", "fecha", postgresql_using="brin"),
+        # Único por partición: incluye fecha, que es parte del mismo XML timbrado
+        Index("ux_cfd_comprobante_uuid_fecha", "uuid", "fecha", unique=True),
+        {"postgresql_partition_by": "RANGE (fecha)"},
+    )
 
+    # Particionada por mes de fecha (migración 0007); la llave primaria debe incluirla
     id_comprobante = Column(Integer, primary_key=True, autoincrement=True)
     version = Column(String(10), nullable=False)
     serie = Column(String(50))
     folio = Column(String(50))
-    fecha = Column(TIMESTAMP, nullable=False)
+    fecha = Column(TIMESTAMP, primary_key=True)
     subtotal = Column(Numeric(19, 4), nullable=False)
     descuento = Column(Numeric(19, 4))
     moneda = Column(String(10), nullable=False)
@@ -43,13 +54,22 @@ class CFDComprobante(Base):
     id_emisor = Column(Integer, ForeignKey("cfd_emisor.id_emisor"), nullable=False)
     id_receptor = Column(Integer, ForeignKey("cfd_receptor.id_receptor"), nullable=False)
     total_impuestos_trasladados = Column(Numeric(19, 4))
+    # Folio fiscal del TimbreFiscalDigital; evita duplicar reenvíos del mismo XML
+    uuid = Column(String(36))
 
 # 📌 Modelo para la tabla de Conceptos
 class CFDConcepto(Base):
     __tablename__ = "cfd_concepto"
+    __table_args__ = (
+        Index("ix_cfd_concepto_id_comprobante", "id_comprobante"),
+        ForeignKeyConstraint(["id_comprobante", "fecha"], ["cfd_comprobante.id_comprobante", "cfd_comprobante.fecha"]),
+        {"postgresql_partition_by": "RANGE (fecha)"},
+    )
 
     id_concepto = Column(Integer, primary_key=True, autoincrement=True)
-    id_comprobante = Column(Integer, ForeignKey("cfd_comprobante.id_comprobante"), nullable=False)
+    # Fecha del comprobante, copiada para particionar igual que cfd_comprobante
+    fecha = Column(TIMESTAMP, primary_key=True)
+    id_comprobante = Column(Integer, nullable=False)
     clave_prod_serv = Column(String(10), nullable=False)
     cantidad = Column(Numeric(19, 4), nullable=False)
     clave_unidad = Column(String(10), nullable=False)
@@ -62,9 +82,15 @@ class CFDConcepto(Base):
 # 📌 Modelo para la tabla de Impuestos Trasladados por Concepto
 class CFDImpuestoTrasladadoConcepto(Base):
     __tablename__ = "cfd_impuesto_trasladado_concepto"
+    __table_args__ = (
+        Index("ix_cfd_impuesto_trasladado_concepto_id_concepto", "id_concepto"),
+        ForeignKeyConstraint(["id_concepto", "fecha"], ["cfd_concepto.id_concepto", "cfd_concepto.fecha"]),
+        {"postgresql_partition_by": "RANGE (fecha)"},
+    )
 
     id_impuesto_trasladado_concepto = Column(Integer, primary_key=True, autoincrement=True)
-    id_concepto = Column(Integer, ForeignKey("cfd_concepto.id_concepto"), nullable=False)
+    fecha = Column(TIMESTAMP, primary_key=True)
+    id_concepto = Column(Integer, nullable=False)
     base = Column(Numeric(19, 4), nullable=False)
     impuesto = Column(String(3), nullable=False)
     tipo_factor = Column(String(10), nullable=False)
@@ -74,11 +100,49 @@ class CFDImpuestoTrasladadoConcepto(Base):
 # 📌 Modelo para la tabla de Impuestos Trasladados Generales
 class CFDImpuestoTrasladadoGeneral(Base):
     __tablename__ = "cfd_impuesto_trasladado_general"
+    __table_args__ = (
+        Index("ix_cfd_impuesto_trasladado_general_id_comprobante", "id_comprobante"),
+        ForeignKeyConstraint(["id_comprobante", "fecha"], ["cfd_comprobante.id_comprobante", "cfd_comprobante.fecha"]),
+        {"postgresql_partition_by": "RANGE (fecha)"},
+    )
 
     id_impuesto_trasladado_general = Column(Integer, primary_key=True, autoincrement=True)
-    id_comprobante = Column(Integer, ForeignKey("cfd_comprobante.id_comprobante"), nullable=False)
+    fecha = Column(TIMESTAMP, primary_key=True)
+    id_comprobante = Column(Integer, nullable=False)
     base = Column(Numeric(19, 4), nullable=False)
     impuesto = Column(String(3), nullable=False)
     tipo_factor = Column(String(10), nullable=False)
     tasa_o_cuota = Column(Numeric(19, 6))
-    importe = Column(Numeric(19, 4))
\ No newline at end of file
+    importe = Column(Numeric(19, 4))
+
+# 📌 Resumen diario por tipo de comprobante y emisor (mantenido por la ingesta)
+class CFDResumenDiario(Base):
+    __tablename__ = "cfd_resumen_diario"
+    __table_args__ = (
+        Index("ix_cfd_resumen_diario_id_emisor", "id_emisor"),
+    )
+
+    dia = Column(Date, primary_key=True)
+    tipo_de_comprobante = Column(String(1), primary_key=True)
+    id_emisor = Column(Integer, ForeignKey("cfd_emisor.id_emisor"), primary_key=True)
+    cantidad = Column(BigInteger, nullable=False)
+    suma = Column(Numeric, nullable=False)
+    suma_cuadrados = Column(Numeric, nullable=False)
+    minimo = Column(Numeric(19, 4), nullable=False)
+    maximo = Column(Numeric(19, 4), nullable=False)
+    sketch = Column(JSONB, nullable=False)
+
+# 📌 Estadísticas suficientes de la regresión total ~ fecha, por grupo
+# (dimension "tipo" o "emisor"; clave el tipo o el id_emisor). El total
+# general se obtiene sumando las filas de "tipo".
+class CFDRegresionEstado(Base):
+    __tablename__ = "cfd_regresion_estado"
+
+    dimension = Column(String(6), primary_key=True)
+    clave = Column(String(20), primary_key=True)
+    n = Column(BigInteger, nullable=False)
+    suma_x = Column(Numeric, nullable=False)
+    suma_y = Column(Numeric, nullable=False)
+    suma_xy = Column(Numeric, nullable=False)
+    suma_xx = Column(Numeric, nullable=False)
+    suma_yy = Column(Numeric, nullable=False)
@@ -1,13 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
-from jose import JWTError, jwt
-from app.security.jwt_handler import get_password_hash, verify_password, create_access_token, SECRET_KEY, ALGORITHM
+from app.security import jwt_handler
+from app.security.jwt_handler import hash_password, verificar_password, HashSaturado, create_access_token
+from app.security.dependencias import oauth2_scheme, current_user, cache_tokens
+from app.database import auth_pool
 import asyncpg
 from datetime import timedelta
 
 auth_router = APIRouter()
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 class UserCreate(BaseModel):
     username: str
@@ -18,52 +18,61 @@ class UserLogin(BaseModel):
     username: str
     password: str
 
-async def get_db():
-    return await asyncpg.connect(
-        user="kong", 
-        password="kong", 
-        database="kong", 
-        host="db"
-    )
+# Las conexiones se toman del pool compartido solo mientras se usan y se
+# devuelven siempre, también cuando hay excepciones.
 
 # Registro de usuarios
 @auth_router.post("/signup")
 async def signup(user: UserCreate):
-    db = await get_db()
-    hashed_password = get_password_hash(user.password)
+    try:
+        hashed_password = await hash_password(user.password)
+    except HashSaturado as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
 
     try:
-        await db.execute(
-            "INSERT INTO users (username, email, password_hash) VALUES ($1, $2, $3)",
-            user.username, user.email, hashed_password
-        )
-        await db.close()
+        async with auth_pool.adquirir() as db:
+            await db.execute(
+                "INSERT INTO users (username, email, password_hash) VALUES ($1, $2, $3)",
+                user.username, user.email, hashed_password
+            )
         return {"message": "Usuario registrado exitosamente", "username": user.username}
     except asyncpg.UniqueViolationError:
-        await db.close()
         raise HTTPException(status_code=400, detail="El usuario o email ya existen.")
 
 # Login y generación de token
 @auth_router.post("/token")
 async def login(user: UserLogin):
-    db = await get_db()
-    result = await db.fetchrow("SELECT * FROM users WHERE username=$1", user.username)
+    async with auth_pool.adquirir() as db:
+        result = await db.fetchrow("SELECT * FROM users WHERE username=$1", user.username)
+
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciales incorrectas")
 
-    if result is None or not verify_password(user.password, result["password_hash"]):
-        await db.close()
+    try:
+        valida, nuevo_hash = await verificar_password(user.password, result["password_hash"])
+    except HashSaturado as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    if not valida:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciales incorrectas")
 
+    # El costo de bcrypt cambió: se guarda el hash recalculado
+    if nuevo_hash is not None:
+        async with auth_pool.adquirir() as db:
+            await db.execute(
+                "UPDATE users SET password_hash=$1 WHERE username=$2 AND password_hash=$3",
+                nuevo_hash, user.username, result["password_hash"]
+            )
+
     access_token = create_access_token(data={"sub": user.username}, expires_delta=timedelta(minutes=30))
 
-    await db.close()
     return {"access_token": access_token, "token_type": "bearer"}
 
+# Métricas del pool de conexiones y del hashing de contraseñas
+@auth_router.get("/metricas")
+async def metricas():
+    return {"pool": auth_pool.metricas(), "hash": jwt_handler.metricas(), "tokens": cache_tokens.metricas()}
+
 # Ruta protegida
 @auth_router.get("/protected-route")
-async def protected_route(token: str = Depends(oauth2_scheme)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        return {"message": f"Bienvenido, {username}. Esta es una ruta protegida."}
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Token inválido o expirado")
\ No newline at end of file
+async def protected_route(usuario: dict = Depends(current_user)):
+    return {"message": f"Bienvenido, {usuario['sub']}. Esta es una ruta protegida."}
@@ -0,0 +1,39 @@
+from typing import List
+
+from fastapi import APIRouter, File, UploadFile, HTTPException, status
+
+from app.utils.trabajos import encolar, estado_trabajo, estado_lote, metricas, ColaLlena, TRABAJOS_REINTENTAR_DESPUES
+
+trabajos_router = APIRouter()
+
+# La subida solo guarda los XML en disco y responde de inmediato; los
+# workers de ingesta los procesan después y el cliente consulta el estado.
+
+@trabajos_router.post("", status_code=status.HTTP_202_ACCEPTED)
+async def crear_trabajos(files: List[UploadFile] = File(..., description="Archivos XML o ZIP con XML")):
+    try:
+        return await encolar(files)
+    except ColaLlena as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(TRABAJOS_REINTENTAR_DESPUES)}
+        )
+
+@trabajos_router.get("/metricas")
+async def metricas_trabajos():
+    return metricas()
+
+@trabajos_router.get("/lote/{id_lote}")
+async def obtener_lote(id_lote: str):
+    lote = await estado_lote(id_lote)
+    if lote is None:
+        raise HTTPException(status_code=404, detail="Lote no encontrado")
+    return lote
+
+@trabajos_router.get("/{id_trabajo}")
+async def obtener_trabajo(id_trabajo: str):
+    trabajo = await estado_trabajo(id_trabajo)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return trabajo
@@ -1 +1 @@
-from .jwt_handler import get_password_hash, verify_password, create_access_token
\ No newline at end of file
+from .jwt_handler import get_password_hash, verify_password, hash_password, verificar_password, create_access_token
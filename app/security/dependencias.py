@@ -0,0 +1,63 @@
+import hashlib
+import os
+import time
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+
+from app.security.jwt_handler import SECRET_KEY, ALGORITHM
+from app.utils.cache import TTLCache
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
+
+# Tokens verificados que se recuerdan a la vez; 0 desactiva el cache
+JWT_CACHE_TAMANO = int(os.getenv("JWT_CACHE_TAMANO", 10000))
+# Segundos máximos que se recuerda un token aunque su exp sea posterior
+JWT_CACHE_TTL_MAXIMO = float(os.getenv("JWT_CACHE_TTL_MAXIMO", 300))
+# Exige token en los endpoints de análisis de app/app.py
+PROTEGER_ANALISIS = os.getenv("PROTEGER_ANALISIS", "false").lower() in ("1", "true", "si", "sí")
+
+# Llave: sha256 del token, para no guardar el token en claro
+cache_tokens = TTLCache(JWT_CACHE_TAMANO)
+
+_CREDENCIALES_INVALIDAS = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Token inválido o expirado",
+    headers={"WWW-Authenticate": "Bearer"}
+)
+
+
+def _digesto(token: str):
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+async def current_user(token: str = Depends(oauth2_scheme)):
+    """
+    Dependencia para rutas protegidas. Un token ya verificado se toma del
+    cache hasta su exp (o JWT_CACHE_TTL_MAXIMO) sin volver a decodificarlo.
+    :return: Payload del token.
+    :raises HTTPException: 401 si el token no es válido o expiró.
+    """
+    clave = _digesto(token)
+    payload = cache_tokens.get(clave)
+    if payload is not None:
+        return payload
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise _CREDENCIALES_INVALIDAS
+    if payload.get("sub") is None:
+        raise _CREDENCIALES_INVALIDAS
+
+    # Sin exp el token no caduca, pero el cache lo vuelve a verificar tras el TTL máximo
+    expira_en = time.time() + JWT_CACHE_TTL_MAXIMO
+    if payload.get("exp") is not None:
+        expira_en = min(expira_en, float(payload["exp"]))
+    cache_tokens.put(clave, payload, expira_en)
+    return payload
+
+
+# Dependencias de las rutas de análisis; vacías mientras no se exija token
+dependencias_analisis = [Depends(current_user)] if PROTEGER_ANALISIS else []
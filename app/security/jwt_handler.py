@@ -1,3 +1,8 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
@@ -6,7 +11,42 @@ SECRET_KEY = "tu_clave_secreta_super_segura"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Costo de bcrypt; al cambiarlo, los hashes existentes se actualizan en el siguiente login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# Hilos dedicados a bcrypt (libera el GIL mientras calcula)
+HASH_HILOS = int(os.getenv("HASH_HILOS", os.cpu_count() or 1))
+# Operaciones de hash en curso como máximo; el resto espera en cola
+HASH_CONCURRENCIA = int(os.getenv("HASH_CONCURRENCIA", HASH_HILOS))
+# Operaciones en espera como máximo antes de rechazar la petición
+HASH_COLA_MAXIMA = int(os.getenv("HASH_COLA_MAXIMA", 100))
+
+# min_rounds y max_rounds iguales al costo hacen que verify_and_update marque
+# para rehash cualquier hash con un costo distinto
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+_executor = None
+_semaforo = None
+_metricas = {
+    "operaciones": 0,
+    "en_espera": 0,
+    "rechazadas": 0,
+    "rehashes": 0,
+    "hash_total_s": 0.0,
+    "hash_maximo_s": 0.0,
+    "espera_total_s": 0.0,
+    "espera_maxima_s": 0.0,
+}
+
+
+class HashSaturado(Exception):
+    """La cola de operaciones de hash está llena."""
+
 
 # Encriptar contraseñas
 def get_password_hash(password: str):
@@ -16,9 +56,94 @@ def get_password_hash(password: str):
 def verify_password(plain_password: str, hashed_password: str):
     return pwd_context.verify(plain_password, hashed_password)
 
+
+def _obtener_executor():
+    global _executor, _semaforo
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=HASH_HILOS, thread_name_prefix="bcrypt")
+        _semaforo = asyncio.Semaphore(HASH_CONCURRENCIA)
+    return _executor
+
+
+def cerrar_executor():
+    global _executor, _semaforo
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = _semaforo = None
+
+
+def _medido(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return resultado, time.perf_counter() - inicio
+
+
+async def _ejecutar(funcion, *args):
+    """
+    Ejecuta una operación de bcrypt fuera del event loop, con concurrencia acotada.
+    :raises HashSaturado: Si ya hay HASH_COLA_MAXIMA operaciones esperando.
+    """
+    executor = _obtener_executor()
+    if _semaforo.locked() and _metricas["en_espera"] >= HASH_COLA_MAXIMA:
+        _metricas["rechazadas"] += 1
+        raise HashSaturado("Demasiadas operaciones de autenticación en espera")
+
+    inicio = time.perf_counter()
+    _metricas["en_espera"] += 1
+    try:
+        await _semaforo.acquire()
+    finally:
+        _metricas["en_espera"] -= 1
+    espera = time.perf_counter() - inicio
+    try:
+        resultado, duracion = await asyncio.get_running_loop().run_in_executor(executor, _medido, funcion, *args)
+    finally:
+        _semaforo.release()
+
+    _metricas["operaciones"] += 1
+    _metricas["hash_total_s"] += duracion
+    _metricas["hash_maximo_s"] = max(_metricas["hash_maximo_s"], duracion)
+    _metricas["espera_total_s"] += espera
+    _metricas["espera_maxima_s"] = max(_metricas["espera_maxima_s"], espera)
+    return resultado
+
+
+async def hash_password(password: str):
+    return await _ejecutar(pwd_context.hash, password)
+
+
+async def verificar_password(plain_password: str, hashed_password: str):
+    """
+    Verifica la contraseña sin bloquear el event loop.
+    :return: Tupla (valida, nuevo_hash); nuevo_hash no es None cuando el hash
+        guardado usa otro costo y debe reemplazarse.
+    """
+    valida, nuevo_hash = await _ejecutar(pwd_context.verify_and_update, plain_password, hashed_password)
+    if nuevo_hash is not None:
+        _metricas["rehashes"] += 1
+    return valida, nuevo_hash
+
+
+def metricas():
+    operaciones = _metricas["operaciones"]
+    return {
+        "costo_bcrypt": BCRYPT_ROUNDS,
+        "hilos": HASH_HILOS,
+        "concurrencia": HASH_CONCURRENCIA,
+        "operaciones": operaciones,
+        "en_espera": _metricas["en_espera"],
+        "rechazadas": _metricas["rechazadas"],
+        "rehashes": _metricas["rehashes"],
+        "hash_promedio_ms": _metricas["hash_total_s"] / operaciones * 1000 if operaciones else None,
+        "hash_maximo_ms": _metricas["hash_maximo_s"] * 1000,
+        "hash_total_s": _metricas["hash_total_s"],
+        "espera_promedio_ms": _metricas["espera_total_s"] / operaciones * 1000 if operaciones else None,
+        "espera_maxima_ms": _metricas["espera_maxima_s"] * 1000,
+    }
+
 # Generar token JWT
 def create_access_token(data: dict, expires_delta: timedelta):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
\ No newline at end of file
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
@@ -0,0 +1,85 @@
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Cache en memoria con capacidad acotada; descarta la entrada menos usada.
+    Lleva contadores de aciertos y fallos para exponerlos como métricas.
+    """
+
+    def __init__(self, capacidad: int):
+        self.capacidad = capacidad
+        self._datos = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def get(self, clave):
+        try:
+            valor = self._datos[clave]
+        except KeyError:
+            self.fallos += 1
+            return None
+        self._datos.move_to_end(clave)
+        self.aciertos += 1
+        return valor
+
+    def put(self, clave, valor):
+        self._datos[clave] = valor
+        self._datos.move_to_end(clave)
+        if len(self._datos) > self.capacidad:
+            self._datos.popitem(last=False)
+
+    def invalidar(self, clave):
+        self._datos.pop(clave, None)
+
+    def limpiar(self):
+        self._datos.clear()
+
+    def items(self):
+        # Copia de las entradas sin afectar el orden de uso ni los contadores
+        return list(self._datos.items())
+
+    def __len__(self):
+        return len(self._datos)
+
+    def metricas(self):
+        consultas = self.aciertos + self.fallos
+        return {
+            "entradas": len(self._datos),
+            "capacidad": self.capacidad,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else None
+        }
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache cuyas entradas además caducan en un instante dado (segundos
+    desde epoch); una entrada caducada cuenta como fallo y se descarta.
+    """
+
+    def get(self, clave):
+        entrada = self._datos.get(clave)
+        if entrada is not None and entrada[1] <= time.time():
+            del self._datos[clave]
+            entrada = None
+        if entrada is None:
+            self.fallos += 1
+            return None
+        self._datos.move_to_end(clave)
+        self.aciertos += 1
+        return entrada[0]
+
+    def put(self, clave, valor, expira_en: float):
+        if expira_en <= time.time():
+            return
+        super().put(clave, (valor, expira_en))
+
+    def purgar_caducadas(self):
+        ahora = time.time()
+        caducadas = [clave for clave, (_, expira_en) in self._datos.items() if expira_en <= ahora]
+        for clave in caducadas:
+            del self._datos[clave]
+        return len(caducadas)
@@ -0,0 +1,355 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from app.utils.cache import TTLCache
+
+# Redis es opcional: requiere redis (redis.asyncio)
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+# "memoria", "redis" o "desactivado"
+CACHE_RESPUESTAS = os.getenv("CACHE_RESPUESTAS", "memoria")
+CACHE_RESPUESTAS_TAMANO = int(os.getenv("CACHE_RESPUESTAS_TAMANO", 1000))
+# Caducidad de respaldo (memoria y Redis); la invalidación normal la hace la ingesta
+CACHE_RESPUESTAS_TTL = int(os.getenv("CACHE_RESPUESTAS_TTL", 3600))
+# Archivo que comparten los workers de gunicorn y los scripts (cargador masivo,
+# particiones) para avisarse invalidaciones del cache en memoria; vacío = no compartir
+CACHE_RESPUESTAS_GENERACION = os.getenv("CACHE_RESPUESTAS_GENERACION", "spool/cache_respuestas.generacion")
+# Segundos entre lecturas de ese archivo; es lo que tarda en verse una
+# invalidación hecha en otro proceso
+CACHE_RESPUESTAS_SINCRONIZAR = float(os.getenv("CACHE_RESPUESTAS_SINCRONIZAR", 1))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+# 📌 Alcance de una respuesta: los datos de los que depende. None en una
+# dimensión significa "cualquier valor"; un alcance vacío depende de todo.
+def alcance(rango=None, tipos=None, rfcs=None):
+    """
+    :param rango: Resultado de rango_fechas.
+    :param tipos: Tipos de comprobante que se leen.
+    :param rfcs: RFCs de emisor que se leen.
+    """
+    return {
+        "rango": [rango[0].isoformat(), rango[1].isoformat()] if rango else None,
+        "tipos": sorted(tipos) if tipos is not None else None,
+        "rfcs": sorted(rfcs) if rfcs is not None else None
+    }
+
+
+def cambios(rangos, tipos, rfcs):
+    """
+    Datos modificados por una ingesta o un borrado.
+    :param rangos: Lista de tuplas (inicio, fin) de datetimes afectados.
+    :param tipos: Tipos de comprobante afectados, o None si pueden ser todos.
+    :param rfcs: RFCs de emisor afectados, o None si pueden ser todos.
+    """
+    return {
+        "rangos": list(rangos),
+        "tipos": set(tipos) if tipos is not None else None,
+        "rfcs": set(rfcs) if rfcs is not None else None
+    }
+
+
+def cambios_de_cfdis(cfdis):
+    """
+    Cambios que produce la inserción de una lista de CFDI: días completos
+    (los contiguos se unen en un solo rango), tipos y RFCs de emisor.
+    """
+    dias = sorted({cfdi["comprobante"]["fecha"].date() for cfdi in cfdis})
+    rangos = []
+    for dia in dias:
+        if rangos and rangos[-1][1] == dia:
+            rangos[-1][1] = dia + timedelta(days=1)
+        else:
+            rangos.append([dia, dia + timedelta(days=1)])
+    return cambios(
+        [(datetime.combine(inicio, datetime.min.time()), datetime.combine(fin, datetime.min.time())) for inicio, fin in rangos],
+        {cfdi["comprobante"]["tipo_de_comprobante"] for cfdi in cfdis},
+        {cfdi["emisor"]["rfc"] for cfdi in cfdis}
+    )
+
+
+def afectado(alcance_entrada, cambios_datos):
+    # Una respuesta caduca si los cambios tocan todas las dimensiones de las que depende
+    for dimension in ("tipos", "rfcs"):
+        if (
+            alcance_entrada[dimension] is not None and cambios_datos[dimension] is not None
+            and not cambios_datos[dimension].intersection(alcance_entrada[dimension])
+        ):
+            return False
+    if alcance_entrada["rango"] is not None:
+        inicio, fin = (datetime.fromisoformat(valor) for valor in alcance_entrada["rango"])
+        return any(c_inicio < fin and inicio < c_fin for c_inicio, c_fin in cambios_datos["rangos"])
+    return True
+
+
+class CacheMemoria:
+    """
+    Respuestas en un TTLCache del proceso. Cada worker tiene su propio cache;
+    para que una invalidación hecha en otro proceso (otro worker, el cargador
+    masivo) también cuente, quien invalida escribe una marca nueva en
+    archivo_generacion y cada proceso compara la marca con la última que vio
+    (a lo más cada CACHE_RESPUESTAS_SINCRONIZAR segundos, para no leer el
+    archivo en cada petición): si cambió, descarta todas sus respuestas.
+    """
+
+    def __init__(self, capacidad: int, ttl: int = CACHE_RESPUESTAS_TTL, archivo_generacion=CACHE_RESPUESTAS_GENERACION):
+        self._entradas = TTLCache(capacidad)
+        self.ttl = ttl
+        self.archivo_generacion = archivo_generacion or None
+        self._generacion = 0
+        self._marca = self._leer_marca()
+        self._proxima_revision = time.monotonic() + CACHE_RESPUESTAS_SINCRONIZAR
+
+    def _leer_marca(self):
+        if self.archivo_generacion is None:
+            return None
+        try:
+            with open(self.archivo_generacion) as archivo:
+                return archivo.read()
+        except FileNotFoundError:
+            return None
+
+    def _sincronizar(self, forzar=False):
+        ahora = time.monotonic()
+        if not forzar and ahora < self._proxima_revision:
+            return
+        self._proxima_revision = ahora + CACHE_RESPUESTAS_SINCRONIZAR
+        # No se sabe qué invalidó el otro proceso: se descarta todo
+        marca = self._leer_marca()
+        if marca != self._marca:
+            self._marca = marca
+            self._generacion += 1
+            self._entradas.limpiar()
+
+    def _publicar(self):
+        """
+        Escribe una marca nueva para los demás procesos. Bajo candado, para no
+        pisar sin ver la marca que otro proceso escribió al mismo tiempo.
+        """
+        if self.archivo_generacion is None:
+            return
+        os.makedirs(os.path.dirname(self.archivo_generacion) or ".", exist_ok=True)
+        with open(f"{self.archivo_generacion}.lock", "a") as candado:
+            fcntl.flock(candado, fcntl.LOCK_EX)
+            self._sincronizar(forzar=True)
+            marca = uuid.uuid4().hex
+            temporal = f"{self.archivo_generacion}.{os.getpid()}.tmp"
+            with open(temporal, "w") as archivo:
+                archivo.write(marca)
+            os.replace(temporal, self.archivo_generacion)
+            self._marca = marca
+
+    async def generacion(self):
+        self._sincronizar()
+        return self._generacion
+
+    async def obtener(self, clave):
+        self._sincronizar()
+        return self._entradas.get(clave)
+
+    async def guardar(self, clave, entrada, generacion):
+        # Si hubo una invalidación mientras se calculaba, la respuesta ya puede estar vieja
+        self._sincronizar()
+        if generacion == self._generacion:
+            self._entradas.put(clave, entrada, time.time() + self.ttl)
+
+    async def invalidar(self, cambios_datos):
+        self._publicar()
+        self._generacion += 1
+        afectadas = [
+            clave for clave, (entrada, _) in self._entradas.items() if afectado(entrada["alcance"], cambios_datos)
+        ]
+        for clave in afectadas:
+            self._entradas.invalidar(clave)
+        return len(afectadas)
+
+    async def limpiar(self):
+        self._publicar()
+        self._generacion += 1
+        self._entradas.limpiar()
+
+    async def entradas(self):
+        self._entradas.purgar_caducadas()
+        return len(self._entradas)
+
+
+class CacheRedis:
+    """
+    Respuestas compartidas por todos los workers en Redis (o cualquier
+    servidor compatible, p. ej. fakeredis.aioredis.FakeRedis en pruebas).
+    El cliente debe crearse con decode_responses=True.
+    """
+
+    PREFIJO = "cfdi:respuestas:"
+
+    def __init__(self, cliente, ttl: int = CACHE_RESPUESTAS_TTL):
+        self.cliente = cliente
+        self.ttl = ttl
+        self._llave_generacion = self.PREFIJO + "generacion"
+        self._llave_alcances = self.PREFIJO + "alcances"
+
+    async def generacion(self):
+        return int(await self.cliente.get(self._llave_generacion) or 0)
+
+    async def obtener(self, clave):
+        datos = await self.cliente.get(self.PREFIJO + clave)
+        return json.loads(datos) if datos is not None else None
+
+    async def guardar(self, clave, entrada, generacion):
+        async with self.cliente.pipeline(transaction=True) as pipe:
+            try:
+                # WATCH aborta el guardado si otra instancia invalida entre la lectura y el MULTI
+                await pipe.watch(self._llave_generacion)
+                if int(await pipe.get(self._llave_generacion) or 0) != generacion:
+                    return
+                pipe.multi()
+                pipe.set(self.PREFIJO + clave, json.dumps(entrada), ex=self.ttl)
+                pipe.hset(self._llave_alcances, clave, json.dumps(entrada["alcance"]))
+                await pipe.execute()
+            except redis.WatchError:
+                pass
+
+    async def invalidar(self, cambios_datos):
+        await self.cliente.incr(self._llave_generacion)
+        alcances = await self.cliente.hgetall(self._llave_alcances)
+        claves = list(alcances)
+        if not claves:
+            return 0
+        # Las entradas que ya caducaron por TTL también se quitan del índice
+        async with self.cliente.pipeline(transaction=False) as pipe:
+            for clave in claves:
+                pipe.exists(self.PREFIJO + clave)
+            vivas = await pipe.execute()
+        afectadas = [
+            clave for clave, viva in zip(claves, vivas)
+            if not viva or afectado(json.loads(alcances[clave]), cambios_datos)
+        ]
+        if afectadas:
+            await self.cliente.delete(*(self.PREFIJO + clave for clave in afectadas))
+            await self.cliente.hdel(self._llave_alcances, *afectadas)
+        return len(afectadas)
+
+    async def limpiar(self):
+        await self.cliente.incr(self._llave_generacion)
+        claves = list(await self.cliente.hkeys(self._llave_alcances))
+        if claves:
+            await self.cliente.delete(*(self.PREFIJO + clave for clave in claves))
+        await self.cliente.delete(self._llave_alcances)
+
+    async def entradas(self):
+        return await self.cliente.hlen(self._llave_alcances)
+
+
+class CacheRespuestas:
+    """
+    Cache de respuestas JSON de los endpoints de análisis, con ETag y
+    respuestas 304 para el dashboard.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.aciertos = 0
+        self.fallos = 0
+        self.no_modificadas = 0
+        self.invalidaciones = 0
+        self.entradas_invalidadas = 0
+
+    @staticmethod
+    def clave(request: Request):
+        # Endpoint + parámetros ordenados y sin valores vacíos
+        parametros = sorted((nombre, valor) for nombre, valor in request.query_params.multi_items() if valor != "")
+        return hashlib.sha256(f"{request.url.path}?{urlencode(parametros)}".encode("utf-8")).hexdigest()
+
+    async def responder(self, request: Request, alcance_respuesta, calcular):
+        """
+        Devuelve la respuesta guardada o la calcula y la guarda.
+        :param alcance_respuesta: Resultado de alcance().
+        :param calcular: Función asíncrona sin argumentos que produce el cuerpo.
+        :return: Response JSON con ETag, o 304 si el cliente ya la tiene.
+        """
+        if self.backend is None:
+            return await calcular()
+
+        clave = self.clave(request)
+        entrada = await self.backend.obtener(clave)
+        if entrada is not None:
+            self.aciertos += 1
+            return self._respuesta(request, entrada)
+
+        self.fallos += 1
+        generacion = await self.backend.generacion()
+        cuerpo = json.dumps(
+            jsonable_encoder(await calcular()), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        )
+        entrada = {
+            "cuerpo": cuerpo,
+            "etag": '"' + hashlib.sha256(cuerpo.encode("utf-8")).hexdigest()[:32] + '"',
+            "alcance": alcance_respuesta
+        }
+        await self.backend.guardar(clave, entrada, generacion)
+        return self._respuesta(request, entrada)
+
+    def _respuesta(self, request, entrada):
+        cabeceras = {"ETag": entrada["etag"], "Cache-Control": "no-cache"}
+        etags_cliente = {
+            etag.strip().removeprefix("W/") for etag in request.headers.get("if-none-match", "").split(",")
+        }
+        if entrada["etag"] in etags_cliente or "*" in etags_cliente:
+            self.no_modificadas += 1
+            return Response(status_code=304, headers=cabeceras)
+        return Response(content=entrada["cuerpo"], media_type="application/json", headers=cabeceras)
+
+    async def invalidar(self, cambios_datos):
+        """
+        Descarta las respuestas que dependen de los datos modificados.
+        :param cambios_datos: Resultado de cambios() o cambios_de_cfdis().
+        :return: Número de respuestas descartadas.
+        """
+        if self.backend is None:
+            return 0
+        descartadas = await self.backend.invalidar(cambios_datos)
+        self.invalidaciones += 1
+        self.entradas_invalidadas += descartadas
+        return descartadas
+
+    async def limpiar(self):
+        if self.backend is not None:
+            await self.backend.limpiar()
+
+    async def metricas(self):
+        consultas = self.aciertos + self.fallos
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "entradas": await self.backend.entradas() if self.backend is not None else 0,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else None,
+            "no_modificadas": self.no_modificadas,
+            "invalidaciones": self.invalidaciones,
+            "entradas_invalidadas": self.entradas_invalidadas
+        }
+
+
+def crear_backend(tipo=CACHE_RESPUESTAS):
+    if tipo == "desactivado":
+        return None
+    if tipo == "redis":
+        if redis is None:
+            raise RuntimeError("CACHE_RESPUESTAS=redis requiere el paquete redis")
+        return CacheRedis(redis.from_url(REDIS_URL, decode_responses=True))
+    return CacheMemoria(CACHE_RESPUESTAS_TAMANO)
+
+
+cache_respuestas = CacheRespuestas(crear_backend())
@@ -0,0 +1,300 @@
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import List, Optional
+from xml.etree.ElementTree import iterparse, ParseError
+
+# Espacios de nombres del anexo 20 (CFDI 3.3 y 4.0). None: XML sin espacio
+# de nombres, que el parser anterior (xmltodict) también aceptaba
+NAMESPACES_CFDI = {
+    "http://www.sat.gob.mx/cfd/3",
+    "http://www.sat.gob.mx/cfd/4",
+    None,
+}
+NAMESPACE_TFD = "http://www.sat.gob.mx/TimbreFiscalDigital"
+
+
+class CFDIInvalido(ValueError):
+    """El XML no contiene un comprobante válido."""
+
+
+# 📌 Registros que emite el parser
+@dataclass
+class Emisor:
+    rfc: Optional[str]
+    nombre: Optional[str]
+    regimen_fiscal: Optional[str]
+
+
+@dataclass
+class Receptor:
+    rfc: Optional[str]
+    nombre: Optional[str]
+    regimen_fiscal: Optional[str]
+    uso_cfdi: Optional[str]
+
+
+@dataclass
+class Comprobante:
+    version: Optional[str]
+    serie: Optional[str]
+    folio: Optional[str]
+    fecha: datetime
+    subtotal: Decimal
+    descuento: Decimal
+    moneda: Optional[str]
+    tipo_cambio: Decimal
+    total: Decimal
+    tipo_de_comprobante: Optional[str]
+    exportacion: Optional[str]
+    lugar_expedicion: Optional[str]
+
+
+@dataclass
+class Traslado:
+    base: Decimal
+    impuesto: Optional[str]
+    tipo_factor: Optional[str]
+    tasa_o_cuota: Optional[Decimal]
+    importe: Optional[Decimal]
+
+
+@dataclass
+class Concepto:
+    clave_prod_serv: Optional[str]
+    cantidad: Decimal
+    clave_unidad: Optional[str]
+    descripcion: Optional[str]
+    valor_unitario: Decimal
+    importe: Decimal
+    descuento: Decimal
+    objeto_imp: Optional[str]
+    traslados: List[Traslado] = field(default_factory=list)
+
+
+@dataclass
+class ImpuestosComprobante:
+    total_impuestos_trasladados: Decimal
+
+
+@dataclass
+class TimbreFiscal:
+    # Folio fiscal asignado por el SAT; identifica al CFDI
+    uuid: Optional[str]
+
+
+def _decimal(valor, default=None):
+    if valor is None:
+        return default
+    try:
+        return Decimal(valor)
+    except InvalidOperation:
+        raise CFDIInvalido("El comprobante contiene importes inválidos.")
+
+
+def _requerido(attrs, nombre):
+    valor = attrs.get(nombre)
+    if valor is None:
+        raise CFDIInvalido(f"Falta el atributo obligatorio {nombre}.")
+    return _decimal(valor)
+
+
+def _traslado(attrs):
+    return Traslado(
+        base=_requerido(attrs, "Base"),
+        impuesto=attrs.get("Impuesto"),
+        tipo_factor=attrs.get("TipoFactor"),
+        tasa_o_cuota=_decimal(attrs.get("TasaOCuota")),
+        importe=_decimal(attrs.get("Importe"))
+    )
+
+
+def _comprobante(attrs):
+    fecha_str = attrs.get("Fecha")
+    if not fecha_str:
+        raise CFDIInvalido("El campo Fecha es obligatorio.")
+    try:
+        fecha = datetime.strptime(fecha_str, "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        raise CFDIInvalido("Formato de fecha incorrecto.")
+
+    return Comprobante(
+        version=attrs.get("Version"),
+        serie=attrs.get("Serie"),
+        folio=attrs.get("Folio"),
+        fecha=fecha,
+        subtotal=_requerido(attrs, "SubTotal"),
+        descuento=_decimal(attrs.get("Descuento"), Decimal(0)),
+        moneda=attrs.get("Moneda"),
+        tipo_cambio=_decimal(attrs.get("TipoCambio"), Decimal(1)),
+        total=_requerido(attrs, "Total"),
+        tipo_de_comprobante=attrs.get("TipoDeComprobante"),
+        exportacion=attrs.get("Exportacion"),
+        lugar_expedicion=attrs.get("LugarExpedicion")
+    )
+
+
+def _concepto(attrs):
+    return Concepto(
+        clave_prod_serv=attrs.get("ClaveProdServ"),
+        cantidad=_requerido(attrs, "Cantidad"),
+        clave_unidad=attrs.get("ClaveUnidad"),
+        descripcion=attrs.get("Descripcion"),
+        valor_unitario=_requerido(attrs, "ValorUnitario"),
+        importe=_requerido(attrs, "Importe"),
+        descuento=_decimal(attrs.get("Descuento"), Decimal(0)),
+        objeto_imp=attrs.get("ObjetoImp")
+    )
+
+
+def _nombre_local(tag):
+    # "{http://www.sat.gob.mx/cfd/4}Concepto" -> ("http://www.sat.gob.mx/cfd/4", "Concepto")
+    if tag[0] == "{":
+        namespace, _, local = tag[1:].partition("}")
+        return namespace, local
+    return None, tag
+
+
+def iterar_cfdi(fuente):
+    """
+    Recorre un CFDI de forma incremental y emite sus registros en orden de documento.
+    Los elementos ya procesados se liberan, así que la memoria no crece con el
+    número de conceptos.
+    :param fuente: Ruta o archivo binario con el XML.
+    :return: Generador de Comprobante, Emisor, Receptor, Concepto, ImpuestosComprobante,
+        Traslado (generales) y TimbreFiscal.
+    """
+    ruta = []
+    pila = []
+    concepto = None
+    try:
+        for evento, elem in iterparse(fuente, events=("start", "end")):
+            namespace, local = _nombre_local(elem.tag)
+            es_cfdi = namespace in NAMESPACES_CFDI
+
+            if evento == "start":
+                pila.append(elem)
+                ruta.append(local if es_cfdi else None)
+                if not es_cfdi:
+                    # El timbre vive en su propio espacio de nombres dentro de Complemento
+                    if namespace == NAMESPACE_TFD and local == "TimbreFiscalDigital" and ruta[:-1] == ["Comprobante", "Complemento"]:
+                        uuid = elem.get("UUID")
+                        yield TimbreFiscal(uuid=uuid.strip().upper() if uuid else None)
+                    continue
+
+                if ruta == ["Comprobante"]:
+                    yield _comprobante(elem.attrib)
+                elif ruta == ["Comprobante", "Emisor"]:
+                    yield Emisor(
+                        rfc=elem.get("Rfc"),
+                        nombre=elem.get("Nombre"),
+                        regimen_fiscal=elem.get("RegimenFiscal")
+                    )
+                elif ruta == ["Comprobante", "Receptor"]:
+                    yield Receptor(
+                        rfc=elem.get("Rfc"),
+                        nombre=elem.get("Nombre"),
+                        regimen_fiscal=elem.get("RegimenFiscalReceptor"),
+                        uso_cfdi=elem.get("UsoCFDI")
+                    )
+                elif ruta == ["Comprobante", "Conceptos", "Concepto"]:
+                    concepto = _concepto(elem.attrib)
+                elif ruta == ["Comprobante", "Conceptos", "Concepto", "Impuestos", "Traslados", "Traslado"]:
+                    concepto.traslados.append(_traslado(elem.attrib))
+                elif ruta == ["Comprobante", "Impuestos"]:
+                    yield ImpuestosComprobante(
+                        total_impuestos_trasladados=_decimal(elem.get("TotalImpuestosTrasladados"), Decimal(0))
+                    )
+                elif ruta == ["Comprobante", "Impuestos", "Traslados", "Traslado"]:
+                    yield _traslado(elem.attrib)
+                continue
+
+            pila.pop()
+            if ruta == ["Comprobante", "Conceptos", "Concepto"]:
+                yield concepto
+                concepto = None
+            ruta.pop()
+
+            # Liberar el elemento y desprenderlo de su padre
+            elem.clear()
+            if pila:
+                pila[-1].remove(elem)
+    except ParseError:
+        raise CFDIInvalido("El archivo no es un XML válido.")
+
+
+def leer_cfdi(fuente):
+    """
+    Recorre un CFDI y agrupa sus registros, sin validarlos.
+    :param fuente: Ruta o archivo binario con el XML.
+    :return: Diccionario con los registros para validar_cfdi.
+    """
+    registros = {
+        "comprobante": None, "emisor": None, "receptor": None, "uuid": None,
+        "total_impuestos_trasladados": Decimal(0), "conceptos": [], "traslados": []
+    }
+
+    for registro in iterar_cfdi(fuente):
+        if isinstance(registro, Comprobante):
+            registros["comprobante"] = registro
+        elif isinstance(registro, Emisor):
+            registros["emisor"] = registro
+        elif isinstance(registro, Receptor):
+            registros["receptor"] = registro
+        elif isinstance(registro, Concepto):
+            registros["conceptos"].append(asdict(registro))
+        elif isinstance(registro, ImpuestosComprobante):
+            registros["total_impuestos_trasladados"] = registro.total_impuestos_trasladados
+        elif isinstance(registro, Traslado):
+            registros["traslados"].append(asdict(registro))
+        elif isinstance(registro, TimbreFiscal):
+            registros["uuid"] = registro.uuid
+
+    return registros
+
+
+def validar_cfdi(registros):
+    """
+    Valida los registros leídos y los agrupa por tabla para la ingesta.
+    :param registros: Diccionario generado por leer_cfdi.
+    :return: Diccionario con emisor, receptor, comprobante (con el uuid del
+        timbre, o None si no está timbrado), conceptos y traslados.
+    """
+    comprobante, emisor, receptor = registros["comprobante"], registros["emisor"], registros["receptor"]
+
+    # Validación de datos del comprobante
+    if comprobante is None:
+        raise CFDIInvalido("No se pudo procesar el comprobante.")
+    if emisor is None or not all(asdict(emisor).values()):
+        raise CFDIInvalido("El Emisor debe contener RFC, Nombre y Régimen Fiscal.")
+    if receptor is None or not all(asdict(receptor).values()):
+        raise CFDIInvalido("El Receptor debe contener RFC, Nombre, Régimen Fiscal y Uso CFDI.")
+    # 📌 Columnas NOT NULL: mejor rechazar aquí que fallar en el INSERT del lote
+    if None in (comprobante.version, comprobante.moneda, comprobante.tipo_de_comprobante):
+        raise CFDIInvalido("El Comprobante debe contener Version, Moneda y TipoDeComprobante.")
+    for concepto in registros["conceptos"]:
+        if None in (concepto["clave_prod_serv"], concepto["clave_unidad"], concepto["descripcion"]):
+            raise CFDIInvalido("Cada Concepto debe contener ClaveProdServ, ClaveUnidad y Descripcion.")
+        if any(None in (t["impuesto"], t["tipo_factor"]) for t in concepto["traslados"]):
+            raise CFDIInvalido("Cada Traslado debe contener Impuesto y TipoFactor.")
+    if any(None in (t["impuesto"], t["tipo_factor"]) for t in registros["traslados"]):
+        raise CFDIInvalido("Cada Traslado debe contener Impuesto y TipoFactor.")
+
+    return {
+        "emisor": asdict(emisor),
+        "receptor": asdict(receptor),
+        "comprobante": asdict(comprobante) | {
+            "total_impuestos_trasladados": registros["total_impuestos_trasladados"], "uuid": registros["uuid"]
+        },
+        "conceptos": registros["conceptos"],
+        "traslados": registros["traslados"]
+    }
+
+
+def parsear_cfdi(fuente):
+    """
+    Parsea un CFDI y agrupa sus registros por tabla para la ingesta.
+    :param fuente: Ruta o archivo binario con el XML.
+    :return: Diccionario generado por validar_cfdi.
+    """
+    return validar_cfdi(leer_cfdi(fuente))
@@ -0,0 +1,139 @@
+import csv
+import importlib.util
+import io
+import json
+import os
+
+from app.database.database import async_session
+from app.database.consultas import consulta_exportacion, parametros_rango
+
+# Parquet es opcional: requiere pyarrow, que se importa hasta la primera
+# exportación (cargarlo al arrancar cuesta tiempo y memoria en cada worker)
+PARQUET_DISPONIBLE = importlib.util.find_spec("pyarrow") is not None
+
+# Filas que se leen del cursor del servidor por cada viaje a Postgres
+EXPORTACION_FILAS_POR_LOTE = int(os.getenv("EXPORTACION_FILAS_POR_LOTE", 5000))
+
+FORMATOS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+COLUMNAS_CSV = [
+    "id_comprobante", "fecha", "total", "tipo_comprobante",
+    "rfc_emisor", "nombre_emisor", "rfc_receptor", "nombre_receptor"
+]
+
+
+def formatear_registro(row):
+    # Mismo formato que cada elemento de /registros
+    return {
+        "id_comprobante": row[0],
+        "fecha": row[1].isoformat(),
+        "total": float(row[2]),
+        "tipo_comprobante": row[3],
+        "emisor": {
+            "rfc": row[4],
+            "nombre": row[5]
+        },
+        "receptor": {
+            "rfc": row[6],
+            "nombre": row[7]
+        }
+    }
+
+
+async def _lotes(rango):
+    # Sesión propia: la respuesta se sigue enviando después de que termina el endpoint
+    async with async_session() as db:
+        resultado = await db.stream(
+            consulta_exportacion(rango).execution_options(yield_per=EXPORTACION_FILAS_POR_LOTE),
+            parametros_rango(rango)
+        )
+        async for lote in resultado.partitions():
+            yield lote
+
+
+async def _ndjson(rango):
+    async for lote in _lotes(rango):
+        yield "".join(json.dumps(formatear_registro(row), ensure_ascii=False) + "\n" for row in lote)
+
+
+async def _csv(rango):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUMNAS_CSV)
+    async for lote in _lotes(rango):
+        escritor.writerows(
+            (row[0], row[1].isoformat(), row[2], row[3], row[4], row[5], row[6], row[7]) for row in lote
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _BufferSalida(io.RawIOBase):
+    # Destino de escritura que acumula los bytes hasta que se vacían a la respuesta
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def vaciar(self):
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+async def _parquet(rango):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([
+        ("id_comprobante", pa.int64()),
+        ("fecha", pa.timestamp("us")),
+        ("total", pa.decimal128(19, 4)),
+        ("tipo_comprobante", pa.string()),
+        ("rfc_emisor", pa.string()),
+        ("nombre_emisor", pa.string()),
+        ("rfc_receptor", pa.string()),
+        ("nombre_receptor", pa.string()),
+    ])
+    buffer = _BufferSalida()
+    # Cada lote se escribe como un row group y se envía en cuanto está listo
+    with pq.ParquetWriter(pa.PythonFile(buffer, mode="w"), esquema) as escritor:
+        async for lote in _lotes(rango):
+            columnas = list(zip(*lote))
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(columnas, esquema)],
+                schema=esquema
+            ))
+            yield buffer.vaciar()
+    yield buffer.vaciar()
+
+
+def exportar(formato, rango):
+    """
+    Genera el contenido de la exportación por lotes, con memoria constante.
+    :param formato: "ndjson", "csv" o "parquet".
+    :param rango: Resultado de rango_fechas.
+    :return: Generador asíncrono de fragmentos para StreamingResponse.
+    """
+    if formato == "ndjson":
+        return _ndjson(rango)
+    if formato == "csv":
+        return _csv(rango)
+    return _parquet(rango)
@@ -0,0 +1,308 @@
+import io
+import os
+
+from sqlalchemy import insert, select, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.particiones import asegurar_particiones, es_particion_faltante, olvidar_particiones
+from app.models.models import CFDComprobante, CFDEmisor, CFDReceptor, CFDConcepto, CFDImpuestoTrasladadoGeneral, CFDImpuestoTrasladadoConcepto
+from app.utils.cfdi_parser import CFDIInvalido, parsear_cfdi
+from app.utils.cache import LRUCache
+from app.utils.cache_respuestas import cache_respuestas, cambios_de_cfdis
+from app.utils.metricas import Contador, Medidor
+from app.utils.resumen import actualizar_resumen
+from app.utils.regresion import actualizar_regresion
+from app.utils.snapshot import snapshot_analisis
+
+# Cache RFC -> id de emisores y receptores ya registrados
+CACHE_RFC_TAMANO = int(os.getenv("CACHE_RFC_TAMANO", 10000))
+cache_emisores = LRUCache(CACHE_RFC_TAMANO)
+cache_receptores = LRUCache(CACHE_RFC_TAMANO)
+
+# 📌 Métricas de las caches de RFC, leídas al exponer /metrics
+_CACHES_RFC = {("emisores",): cache_emisores, ("receptores",): cache_receptores}
+Contador("cache_rfc_aciertos_total", "Búsquedas de RFC resueltas desde la cache", ("cache",),
+         funcion=lambda: {clave: cache.aciertos for clave, cache in _CACHES_RFC.items()})
+Contador("cache_rfc_fallos_total", "Búsquedas de RFC que tuvieron que ir a la base", ("cache",),
+         funcion=lambda: {clave: cache.fallos for clave, cache in _CACHES_RFC.items()})
+Medidor("cache_rfc_entradas", "RFCs guardados en la cache", ("cache",),
+        funcion=lambda: {clave: len(cache) for clave, cache in _CACHES_RFC.items()})
+
+
+def parsear_xml(xml_content: bytes):
+    """
+    Parsea el contenido de un archivo XML y lo convierte en registros.
+    Es una función de módulo para poder ejecutarse en un ProcessPoolExecutor.
+    :param xml_content: Bytes del archivo XML.
+    :return: Diccionario generado por parsear_cfdi.
+    """
+    return parsear_cfdi(io.BytesIO(xml_content))
+
+
+def contar_filas(cfdi):
+    # emisor + receptor + comprobante + conceptos + impuestos
+    return (
+        3
+        + len(cfdi["conceptos"])
+        + sum(len(concepto["traslados"]) for concepto in cfdi["conceptos"])
+        + len(cfdi["traslados"])
+    )
+
+
+async def _insertar_con_ids(db: AsyncSession, modelo, columna_id, filas):
+    resultado = await db.scalars(insert(modelo).returning(columna_id, sort_by_parameter_order=True), filas)
+    return resultado.all()
+
+
+async def _resolver_rfcs(db: AsyncSession, modelo, columna_id, cache, registros):
+    """
+    Obtiene el id de cada RFC; los que no están en cache se insertan o
+    actualizan con un solo INSERT ... ON CONFLICT (rfc) DO UPDATE ... RETURNING,
+    que solo reescribe las filas cuyo nombre o régimen cambió.
+    :return: Tupla ({rfc: id} de todos los registros, {rfc: id} de los que no estaban en cache).
+    """
+    ids = {}
+    faltantes = {}
+    for registro in registros:
+        rfc = registro["rfc"]
+        if rfc in ids or rfc in faltantes:
+            continue
+        id_registro = cache.get(rfc)
+        if id_registro is None:
+            faltantes[rfc] = registro
+        else:
+            ids[rfc] = id_registro
+
+    nuevos = {}
+    if faltantes:
+        # 📌 En orden de RFC: dos lotes concurrentes bloquean las filas en la misma secuencia
+        faltantes = dict(sorted(faltantes.items()))
+        columnas = [columna for columna in next(iter(faltantes.values())) if columna != "rfc"]
+        stmt = pg_insert(modelo)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[modelo.rfc],
+            set_={columna: stmt.excluded[columna] for columna in columnas},
+            # Si los datos no cambiaron no se reescribe la fila (sin versión nueva ni WAL)
+            where=or_(*(getattr(modelo, columna).is_distinct_from(stmt.excluded[columna]) for columna in columnas))
+        ).returning(modelo.rfc, columna_id)
+        nuevos = dict((await db.execute(stmt, list(faltantes.values()))).all())
+        # Las filas que no cambiaron no salen en RETURNING: se leen aparte
+        sin_cambios = [rfc for rfc in faltantes if rfc not in nuevos]
+        if sin_cambios:
+            nuevos |= dict((await db.execute(select(modelo.rfc, columna_id).where(modelo.rfc.in_(sin_cambios)))).all())
+
+    return ids | nuevos, nuevos
+
+
+def _es_llave_foranea_rfc(error: IntegrityError):
+    # SQLSTATE 23503: el id de emisor o receptor tomado del cache ya no existe
+    return getattr(error.orig, "sqlstate", None) == "23503"
+
+
+def _olvidar_rfcs(cfdis):
+    for cfdi in cfdis:
+        cache_emisores.invalidar(cfdi["emisor"]["rfc"])
+        cache_receptores.invalidar(cfdi["receptor"]["rfc"])
+
+
+# 📌 Los UUID ya registrados se omiten sin error (reintentos del mismo XML)
+_INSERTAR_COMPROBANTES = pg_insert(CFDComprobante).on_conflict_do_nothing(
+    index_elements=[CFDComprobante.uuid, CFDComprobante.fecha]
+).returning(CFDComprobante.uuid, CFDComprobante.id_comprobante)
+
+
+def _unicos_por_uuid(cfdis):
+    """
+    Descarta los CFDI cuyo UUID ya apareció antes en el mismo lote.
+    :return: Lista de posiciones en cfdis de la primera aparición de cada UUID
+        (los CFDI sin UUID se conservan todos).
+    """
+    vistos = set()
+    posiciones = []
+    for posicion, cfdi in enumerate(cfdis):
+        uuid = cfdi["comprobante"].get("uuid")
+        if uuid is not None:
+            if uuid in vistos:
+                continue
+            vistos.add(uuid)
+        posiciones.append(posicion)
+    return posiciones
+
+
+async def _insertar_comprobantes(db: AsyncSession, comprobantes):
+    """
+    Inserta los comprobantes omitiendo los UUID ya registrados, con un solo
+    INSERT ... ON CONFLICT DO NOTHING RETURNING; los que no traen UUID nunca
+    chocan con el índice y se insertan aparte.
+    :return: Lista de id_comprobante alineada con comprobantes, con None en los ya registrados.
+    """
+    con_uuid = [comprobante for comprobante in comprobantes if comprobante["uuid"] is not None]
+    sin_uuid = [comprobante for comprobante in comprobantes if comprobante["uuid"] is None]
+
+    ids_por_uuid = {}
+    if con_uuid:
+        ids_por_uuid = dict((await db.execute(_INSERTAR_COMPROBANTES, con_uuid)).all())
+    ids_sin_uuid = iter(
+        await _insertar_con_ids(db, CFDComprobante, CFDComprobante.id_comprobante, sin_uuid) if sin_uuid else []
+    )
+
+    return [
+        ids_por_uuid.get(comprobante["uuid"]) if comprobante["uuid"] is not None else next(ids_sin_uuid)
+        for comprobante in comprobantes
+    ]
+
+
+async def insertar_lote(db: AsyncSession, cfdis):
+    """
+    Inserta varios CFDI en una sola transacción.
+    Cada tabla se escribe con un único INSERT ... RETURNING (executemany), así
+    que el número de viajes a Postgres no depende de la cantidad de conceptos
+    ni de comprobantes del lote. Emisores y receptores se reutilizan por RFC.
+    Los CFDI con un UUID repetido en el lote o ya registrado no se insertan.
+    :param cfdis: Lista de diccionarios generados por parsear_cfdi.
+    :return: Lista de id_comprobante en el mismo orden que cfdis, con None en los duplicados.
+    """
+    if not cfdis:
+        return []
+
+    posiciones = _unicos_por_uuid(cfdis)
+    unicos = [cfdis[posicion] for posicion in posiciones]
+
+    # Las particiones de meses nuevos se crean antes, en su propia transacción
+    fechas = [cfdi["comprobante"]["fecha"] for cfdi in unicos]
+    await asegurar_particiones(db, fechas)
+
+    # Otro proceso pudo purgar un emisor cuyo id sigue en nuestro cache, o
+    # archivar un mes que creíamos con partición: se olvida lo cacheado y se
+    # reintenta una vez consultando la base
+    for intento in range(2):
+        try:
+            ids_emisor, emisores_nuevos = await _resolver_rfcs(
+                db, CFDEmisor, CFDEmisor.id_emisor, cache_emisores, [c["emisor"] for c in unicos]
+            )
+            ids_receptor, receptores_nuevos = await _resolver_rfcs(
+                db, CFDReceptor, CFDReceptor.id_receptor, cache_receptores, [c["receptor"] for c in unicos]
+            )
+            comprobantes = [
+                cfdi["comprobante"] | {
+                    "uuid": cfdi["comprobante"].get("uuid"),
+                    "id_emisor": ids_emisor[cfdi["emisor"]["rfc"]],
+                    "id_receptor": ids_receptor[cfdi["receptor"]["rfc"]]
+                }
+                for cfdi in unicos
+            ]
+            ids_unicos = await _insertar_comprobantes(db, comprobantes)
+
+            # Solo los comprobantes recién insertados llevan hijos y cuentan en los agregados
+            insertados = [
+                (cfdi, comprobante, id_comprobante)
+                for cfdi, comprobante, id_comprobante in zip(unicos, comprobantes, ids_unicos)
+                if id_comprobante is not None
+            ]
+            nuevos = [cfdi for cfdi, _, _ in insertados]
+            ids_comprobante = [id_comprobante for _, _, id_comprobante in insertados]
+
+            # Los hijos llevan la fecha del comprobante: es la llave de partición
+            conceptos = [
+                (id_comprobante, cfdi["comprobante"]["fecha"], concepto)
+                for cfdi, id_comprobante in zip(nuevos, ids_comprobante)
+                for concepto in cfdi["conceptos"]
+            ]
+            if conceptos:
+                ids_concepto = await _insertar_con_ids(db, CFDConcepto, CFDConcepto.id_concepto, [
+                    {k: v for k, v in concepto.items() if k != "traslados"} | {"id_comprobante": id_comprobante, "fecha": fecha}
+                    for id_comprobante, fecha, concepto in conceptos
+                ])
+
+                traslados_concepto = [
+                    traslado | {"id_concepto": id_concepto, "fecha": fecha}
+                    for id_concepto, (_, fecha, concepto) in zip(ids_concepto, conceptos)
+                    for traslado in concepto["traslados"]
+                ]
+                if traslados_concepto:
+                    await db.execute(insert(CFDImpuestoTrasladadoConcepto), traslados_concepto)
+
+            traslados = [
+                traslado | {"id_comprobante": id_comprobante, "fecha": cfdi["comprobante"]["fecha"]}
+                for cfdi, id_comprobante in zip(nuevos, ids_comprobante)
+                for traslado in cfdi["traslados"]
+            ]
+            if traslados:
+                await db.execute(insert(CFDImpuestoTrasladadoGeneral), traslados)
+
+            filas_resumen = [(c["fecha"], c["tipo_de_comprobante"], c["id_emisor"], c["total"]) for _, c, _ in insertados]
+            await actualizar_resumen(db, filas_resumen)
+            await actualizar_regresion(db, filas_resumen)
+
+            await db.commit()
+            break
+        except IntegrityError as error:
+            await db.rollback()
+            if intento:
+                raise
+            if es_particion_faltante(error):
+                olvidar_particiones()
+                await asegurar_particiones(db, fechas)
+            elif _es_llave_foranea_rfc(error):
+                _olvidar_rfcs(unicos)
+            else:
+                raise
+        except Exception:
+            await db.rollback()
+            raise
+
+    # Solo se guardan en cache los ids que ya quedaron confirmados
+    for rfc, id_emisor in emisores_nuevos.items():
+        cache_emisores.put(rfc, id_emisor)
+    for rfc, id_receptor in receptores_nuevos.items():
+        cache_receptores.put(rfc, id_receptor)
+    snapshot_analisis.agregar(ids_comprobante, filas_resumen)
+    if nuevos:
+        await cache_respuestas.invalidar(cambios_de_cfdis(nuevos))
+
+    resultado = [None] * len(cfdis)
+    for posicion, id_comprobante in zip(posiciones, ids_unicos):
+        resultado[posicion] = id_comprobante
+    return resultado
+
+
+async def insertar_aislando(db: AsyncSession, cfdis):
+    """
+    Inserta varios CFDI con insertar_lote. Si la base rechaza la transacción,
+    parte la lista a la mitad y reintenta cada parte, así un CFDI que Postgres
+    no acepta solo falla él: O(log n) transacciones extra por CFDI malo.
+    :param cfdis: Lista de diccionarios generados por parsear_cfdi.
+    :return: Lista alineada con cfdis: id_comprobante, None si era duplicado,
+        o la excepción con la que se rechazó ese CFDI.
+    """
+    try:
+        return await insertar_lote(db, cfdis)
+    except Exception as e:
+        if len(cfdis) == 1:
+            return [e]
+    mitad = len(cfdis) // 2
+    return await insertar_aislando(db, cfdis[:mitad]) + await insertar_aislando(db, cfdis[mitad:])
+
+
+async def id_emisor_por_rfc(db: AsyncSession, rfc: str):
+    """
+    :return: id_emisor del RFC (del cache si ya se conoce), o None si no existe.
+    """
+    id_emisor = cache_emisores.get(rfc)
+    if id_emisor is None:
+        id_emisor = await db.scalar(select(CFDEmisor.id_emisor).where(CFDEmisor.rfc == rfc))
+        if id_emisor is not None:
+            cache_emisores.put(rfc, id_emisor)
+    return id_emisor
+
+
+async def insertar_cfdi(db: AsyncSession, cfdi):
+    """
+    Inserta un CFDI completo en una sola transacción.
+    :param cfdi: Diccionario generado por parsear_cfdi.
+    :return: id_comprobante insertado, o None si su UUID ya estaba registrado.
+    """
+    ids = await insertar_lote(db, [cfdi])
+    return ids[0]
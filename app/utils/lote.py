@@ -0,0 +1,147 @@
+import asyncio
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.utils.ingesta import CFDIInvalido, parsear_xml, contar_filas, insertar_aislando
+
+# Procesos para el parseo de XML (por defecto uno por núcleo)
+INGESTA_PROCESOS = int(os.getenv("INGESTA_PROCESOS", os.cpu_count() or 1))
+# Comprobantes por transacción al escribir en la base de datos
+INGESTA_TAMANO_LOTE = int(os.getenv("INGESTA_TAMANO_LOTE", 500))
+# Archivos por tarea enviada al pool, para reducir el costo de IPC
+INGESTA_ARCHIVOS_POR_TAREA = int(os.getenv("INGESTA_ARCHIVOS_POR_TAREA", 32))
+
+_pool = None
+
+
+def obtener_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=INGESTA_PROCESOS)
+    return _pool
+
+
+def cerrar_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def parsear_archivos(archivos):
+    """
+    Parsea una lista de archivos dentro de un proceso del pool.
+    :param archivos: Lista de tuplas (nombre, contenido).
+    :return: Lista de tuplas (nombre, cfdi, error).
+    """
+    resultados = []
+    for nombre, contenido in archivos:
+        try:
+            resultados.append((nombre, parsear_xml(contenido), None))
+        except CFDIInvalido as e:
+            resultados.append((nombre, None, str(e)))
+    return resultados
+
+
+def iterar_archivos(uploads):
+    """
+    Recorre los archivos subidos y el contenido XML de los ZIP.
+    :param uploads: Lista de UploadFile.
+    :return: Generador de tuplas (nombre, contenido).
+    """
+    for upload in uploads:
+        if zipfile.is_zipfile(upload.file):
+            upload.file.seek(0)
+            with zipfile.ZipFile(upload.file) as archivo_zip:
+                for info in archivo_zip.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(".xml"):
+                        yield f"{upload.filename}/{info.filename}", archivo_zip.read(info)
+        else:
+            upload.file.seek(0)
+            yield upload.filename, upload.file.read()
+
+
+def _dividir(iterable, tamano):
+    bloque = []
+    for elemento in iterable:
+        bloque.append(elemento)
+        if len(bloque) == tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+async def parsear_bloque(archivos):
+    loop = asyncio.get_running_loop()
+    pool = obtener_pool()
+    tareas = [
+        loop.run_in_executor(pool, parsear_archivos, parte)
+        for parte in _dividir(archivos, INGESTA_ARCHIVOS_POR_TAREA)
+    ]
+    return [resultado for parte in await asyncio.gather(*tareas) for resultado in parte]
+
+
+async def procesar_lote(db: AsyncSession, uploads):
+    """
+    Parsea los archivos en el pool de procesos y los escribe por lotes.
+    Mientras se escribe un lote ya se está parseando el siguiente. Los UUID
+    repetidos (en la subida o ya registrados) se reportan como duplicados.
+    :param uploads: Lista de UploadFile (XML o ZIP con XML).
+    :return: Resumen por archivo y métricas de rendimiento.
+    """
+    inicio = time.perf_counter()
+    estados = []
+    filas = 0
+
+    # Leer y descomprimir los ZIP bloquea: cada bloque se extrae en un hilo
+    bloques = _dividir(iterar_archivos(uploads), INGESTA_TAMANO_LOTE)
+    siguiente = await asyncio.to_thread(next, bloques, None)
+    pendiente = asyncio.ensure_future(parsear_bloque(siguiente)) if siguiente else None
+
+    while pendiente is not None:
+        resultados = await pendiente
+        siguiente = await asyncio.to_thread(next, bloques, None)
+        pendiente = asyncio.ensure_future(parsear_bloque(siguiente)) if siguiente else None
+
+        validos = [(nombre, cfdi) for nombre, cfdi, error in resultados if error is None]
+        estados.extend(
+            {"archivo": nombre, "estado": "error", "error": error}
+            for nombre, _, error in resultados if error is not None
+        )
+        if not validos:
+            continue
+
+        resultados_insercion = await insertar_aislando(db, [cfdi for _, cfdi in validos])
+        for (nombre, cfdi), resultado in zip(validos, resultados_insercion):
+            if isinstance(resultado, Exception):
+                estados.append({"archivo": nombre, "estado": "error", "error": str(resultado)})
+            elif resultado is None:
+                estados.append({"archivo": nombre, "estado": "duplicado", "uuid": cfdi["comprobante"]["uuid"]})
+            else:
+                filas += contar_filas(cfdi)
+                estados.append(
+                    {"archivo": nombre, "estado": "procesado", "id_comprobante": resultado, "uuid": cfdi["comprobante"]["uuid"]}
+                )
+
+    duracion = time.perf_counter() - inicio
+    procesados = sum(1 for estado in estados if estado["estado"] == "procesado")
+    duplicados = sum(1 for estado in estados if estado["estado"] == "duplicado")
+    return {
+        "resumen": {
+            "archivos": len(estados),
+            "procesados": procesados,
+            "nuevos": procesados,
+            "duplicados": duplicados,
+            "errores": len(estados) - procesados - duplicados,
+            "filas_insertadas": filas,
+            "segundos": round(duracion, 3),
+            "archivos_por_segundo": round(len(estados) / duracion, 2) if duracion else None,
+            "filas_por_segundo": round(filas / duracion, 2) if duracion else None
+        },
+        "archivos": estados
+    }
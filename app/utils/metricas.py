@@ -0,0 +1,227 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+# Umbral a partir del cual una sentencia se registra en el log de consultas lentas
+SQL_LENTA_MS = float(os.getenv("SQL_LENTA_MS", 500))
+
+# Límites en segundos de los histogramas de latencia
+LIMITES_LATENCIA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_FILAS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+logger_sql = logging.getLogger("app.sql")
+
+_registro = []
+
+
+def _etiquetas_texto(nombres, valores, extra=""):
+    pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _numero(valor):
+    return repr(float(valor)) if valor != int(valor) else str(int(valor))
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.series = {}
+        _registro.append(self)
+
+    def _clave(self, etiquetas):
+        return tuple(etiquetas[nombre] for nombre in self.etiquetas)
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        lineas.extend(self._lineas())
+        return lineas
+
+
+# 📌 Contador: solo crece (peticiones, consultas lentas...)
+# Con funcion el valor se lee al exponer: un número, o {valores de etiquetas: número}
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), funcion=None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+
+    def inc(self, valor=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        self.series[clave] = self.series.get(clave, 0) + valor
+
+    def _lineas(self):
+        if self.funcion is not None:
+            valor = self.funcion()
+            self.series = dict(valor) if self.etiquetas else {(): valor}
+        for clave, valor in self.series.items():
+            yield f"{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {_numero(valor)}"
+
+
+# 📌 Medidor: valor que sube y baja; con funcion se lee al exponer
+class Medidor(Contador):
+    tipo = "gauge"
+
+    def dec(self, valor=1, **etiquetas):
+        self.inc(-valor, **etiquetas)
+
+
+# 📌 Histograma con límites fijos, acumulado como en Prometheus
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.limites = tuple(limites)
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        serie = self.series.get(clave)
+        if serie is None:
+            # Conteo por cubeta (la última es +Inf), suma y total
+            serie = self.series[clave] = [[0] * (len(self.limites) + 1), 0.0, 0]
+        serie[0][bisect_left(self.limites, valor)] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def _lineas(self):
+        for clave, (cubetas, suma, cuenta) in self.series.items():
+            acumulado = 0
+            for limite, conteo in zip(self.limites + (float("inf"),), cubetas):
+                acumulado += conteo
+                le = "+Inf" if limite == float("inf") else _numero(limite)
+                etiquetas = _etiquetas_texto(self.etiquetas, clave, f'le="{le}"')
+                yield f"{self.nombre}_bucket{etiquetas} {acumulado}"
+            yield f"{self.nombre}_sum{_etiquetas_texto(self.etiquetas, clave)} {repr(suma)}"
+            yield f"{self.nombre}_count{_etiquetas_texto(self.etiquetas, clave)} {cuenta}"
+
+
+@contextmanager
+def cronometro(histograma: Histograma, **etiquetas):
+    # Observa la duración del bloque, también si termina con excepción
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        histograma.observar(time.perf_counter() - inicio, **etiquetas)
+
+
+def exponer():
+    """
+    :return: Todas las métricas en el formato de texto de Prometheus (0.0.4).
+    """
+    return "\n".join(linea for metrica in _registro for linea in metrica.exponer()) + "\n"
+
+
+# 📌 Métricas de la aplicación
+HTTP_DURACION = Histograma(
+    "http_duracion_segundos", "Duración de las peticiones HTTP por ruta", ("metodo", "ruta", "estado")
+)
+HTTP_EN_CURSO = Medidor("http_peticiones_en_curso", "Peticiones HTTP en curso por ruta", ("metodo", "ruta"))
+
+SQL_DURACION = Histograma("sql_duracion_segundos", "Duración de las sentencias SQL por operación", ("operacion",))
+SQL_FILAS = Histograma(
+    "sql_filas", "Filas devueltas o afectadas por sentencia", ("operacion",), limites=LIMITES_FILAS
+)
+SQL_LENTAS = Contador("sql_lentas_total", f"Sentencias de más de {SQL_LENTA_MS:g} ms", ("operacion",))
+SQL_ERRORES = Contador("sql_errores_total", "Sentencias que terminaron con error", ("operacion",))
+POOL_ESPERA = Histograma("pool_espera_segundos", "Espera para obtener una conexión del pool de SQLAlchemy")
+
+INGESTA_ETAPA = Histograma("ingesta_etapa_segundos", "Duración de cada etapa de /procesar_xml", ("etapa",))
+
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI que mide la latencia y las peticiones en curso por ruta.
+    La ruta es la plantilla (/registros/{periodo}) y no la URL, para no
+    crear una serie por cada valor; las URL sin ruta cuentan como "sin_ruta".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        etiquetas = {"metodo": scope["method"], "ruta": _ruta(scope)}
+        estado = {"codigo": 500}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["codigo"] = mensaje["status"]
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        HTTP_EN_CURSO.inc(**etiquetas)
+        try:
+            # Incluye el envío del cuerpo, también en las respuestas en streaming
+            await self.app(scope, receive, enviar)
+        finally:
+            HTTP_EN_CURSO.dec(**etiquetas)
+            HTTP_DURACION.observar(time.perf_counter() - inicio, estado=str(estado["codigo"]), **etiquetas)
+
+
+def _ruta(scope):
+    # Misma búsqueda que hace el enrutador, antes de que la haga
+    parcial = None
+    for ruta in scope["app"].router.routes:
+        coincidencia, _ = ruta.matches(scope)
+        if coincidencia == Match.FULL:
+            return ruta.path
+        if coincidencia == Match.PARTIAL and parcial is None:
+            parcial = ruta.path
+    return parcial or "sin_ruta"
+
+
+def instrumentar_engine(engine):
+    """
+    Registra en el engine (síncrono) los eventos que miden cada sentencia:
+    duración, filas y errores, y escribe en el log app.sql las que pasan de
+    SQL_LENTA_MS (sin los parámetros, que pueden traer datos fiscales).
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("inicios_sql", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def despues(conn, cursor, statement, parameters, context, executemany):
+        duracion = time.perf_counter() - conn.info["inicios_sql"].pop()
+        operacion = _operacion(statement)
+        SQL_DURACION.observar(duracion, operacion=operacion)
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            SQL_FILAS.observar(cursor.rowcount, operacion=operacion)
+        if duracion * 1000 >= SQL_LENTA_MS:
+            SQL_LENTAS.inc(operacion=operacion)
+            logger_sql.warning("Consulta lenta (%.1f ms, %s filas): %s", duracion * 1000, cursor.rowcount, " ".join(statement.split())[:2000])
+
+    @event.listens_for(engine, "handle_error")
+    def error(contexto):
+        inicios = contexto.connection.info.get("inicios_sql") if contexto.connection is not None else None
+        if inicios:
+            inicios.pop()
+        if contexto.statement:
+            SQL_ERRORES.inc(operacion=_operacion(contexto.statement))
+
+
+def _operacion(statement):
+    # Primera palabra de la sentencia: SELECT, INSERT, WITH...
+    palabras = statement.lstrip(" \n\t(").split(None, 1)
+    return palabras[0].upper() if palabras else ""
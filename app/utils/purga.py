@@ -0,0 +1,138 @@
+import os
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.consultas import rango_fechas
+from app.utils.cache_respuestas import cache_respuestas, cambios
+from app.utils.ingesta import cache_emisores
+from app.utils.regresion import restar_regresion, eliminar_regresion_emisor
+from app.utils.resumen import eliminar_resumen_emisor, restar_resumen
+from app.utils.snapshot import snapshot_analisis
+
+# Comprobantes que se borran por transacción; acota la duración de los locks
+PURGA_TAMANO_BLOQUE = int(os.getenv("PURGA_TAMANO_BLOQUE", 1000))
+
+TABLAS = (
+    "cfd_impuesto_trasladado_concepto",
+    "cfd_concepto",
+    "cfd_impuesto_trasladado_general",
+    "cfd_comprobante",
+    "cfd_resumen_diario",
+    "cfd_emisor",
+)
+
+_IDS_EMISOR = text("SELECT id_emisor FROM cfd_emisor WHERE rfc = :rfc")
+
+_AFECTADOS = text("""
+    SELECT MIN(fecha), MAX(fecha), ARRAY_AGG(DISTINCT tipo_de_comprobante)
+    FROM cfd_comprobante
+    WHERE id_emisor = ANY(:ids_emisor)
+""")
+
+_SIGUIENTE_BLOQUE = text("""
+    SELECT id_comprobante FROM cfd_comprobante
+    WHERE id_emisor = ANY(:ids_emisor)
+    ORDER BY id_comprobante
+    LIMIT :tamano
+    FOR UPDATE
+""")
+
+# 📌 Un solo DELETE encadenado por bloque: los hijos antes que los padres.
+# Las llaves foráneas se revisan al final de la sentencia, cuando ya no
+# quedan hijos, así que no hace falta ON DELETE CASCADE.
+_BORRAR_BLOQUE = text("""
+    WITH conceptos AS (
+        SELECT id_concepto FROM cfd_concepto WHERE id_comprobante = ANY(:ids_comprobante)
+    ), traslados_concepto AS (
+        DELETE FROM cfd_impuesto_trasladado_concepto
+        WHERE id_concepto IN (SELECT id_concepto FROM conceptos)
+        RETURNING 1
+    ), borrados_conceptos AS (
+        DELETE FROM cfd_concepto WHERE id_comprobante = ANY(:ids_comprobante)
+        RETURNING 1
+    ), traslados_general AS (
+        DELETE FROM cfd_impuesto_trasladado_general WHERE id_comprobante = ANY(:ids_comprobante)
+        RETURNING 1
+    ), comprobantes AS (
+        DELETE FROM cfd_comprobante WHERE id_comprobante = ANY(:ids_comprobante)
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM traslados_concepto),
+           (SELECT COUNT(*) FROM borrados_conceptos),
+           (SELECT COUNT(*) FROM traslados_general),
+           (SELECT COUNT(*) FROM comprobantes)
+""")
+
+_BORRAR_EMISORES = text("DELETE FROM cfd_emisor WHERE id_emisor = ANY(:ids_emisor)")
+
+
+async def purgar_emisor(db: AsyncSession, rfc: str, tamano_bloque: int = PURGA_TAMANO_BLOQUE):
+    """
+    Borra todos los emisores con el RFC dado y todo lo que depende de ellos,
+    en transacciones de a lo más tamano_bloque comprobantes. Cada bloque
+    descuenta sus comprobantes del resumen diario y del estado de la regresión
+    en la misma transacción, así que entre bloques (o si la purga falla a la
+    mitad) los agregados coinciden con lo que queda; el emisor se borra al final.
+    :return: Diccionario con los ids, bloques, filas borradas por tabla y
+        segundos, o None si el RFC no existe.
+    """
+    inicio = time.perf_counter()
+    ids_emisor = list((await db.scalars(_IDS_EMISOR, {"rfc": rfc})).all())
+    if not ids_emisor:
+        return None
+    parametros = {"ids_emisor": ids_emisor}
+
+    # Fechas y tipos afectados, para invalidar solo las respuestas que dependen de ellos
+    primera_fecha, ultima_fecha, tipos = (await db.execute(_AFECTADOS, parametros)).one()
+
+    filas = dict.fromkeys(TABLAS, 0)
+    bloques = 0
+    borrados = []
+    completa = False
+    try:
+        while True:
+            ids_comprobante = list((await db.scalars(
+                _SIGUIENTE_BLOQUE, parametros | {"tamano": tamano_bloque}
+            )).all())
+            if not ids_comprobante:
+                break
+            filas_resumen = await restar_resumen(db, ids_comprobante)
+            await restar_regresion(db, ids_comprobante)
+            conteos = (await db.execute(_BORRAR_BLOQUE, {"ids_comprobante": ids_comprobante})).one()
+            await db.commit()
+            for tabla, conteo in zip(TABLAS, conteos):
+                filas[tabla] += conteo
+            filas["cfd_resumen_diario"] += filas_resumen
+            borrados.extend(ids_comprobante)
+            bloques += 1
+
+        # Resumen de comprobantes que llegaron durante la purga, si los hubo
+        resultado = await eliminar_resumen_emisor(db, ids_emisor)
+        filas["cfd_resumen_diario"] += resultado.rowcount
+        await eliminar_regresion_emisor(db, ids_emisor)
+        filas["cfd_emisor"] = (await db.execute(_BORRAR_EMISORES, parametros)).rowcount
+        await db.commit()
+        completa = True
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        # Aun si falla a la mitad, los bloques ya confirmados cambiaron los datos
+        cache_emisores.invalidar(rfc)
+        if completa:
+            snapshot_analisis.eliminar_emisores(ids_emisor)
+        else:
+            snapshot_analisis.eliminar_comprobantes(borrados)
+        if primera_fecha is not None and bloques:
+            await cache_respuestas.invalidar(
+                cambios([rango_fechas(primera_fecha.date(), ultima_fecha.date())], tipos, [rfc])
+            )
+
+    return {
+        "ids_emisor": ids_emisor,
+        "bloques": bloques,
+        "filas_borradas": filas,
+        "segundos": round(time.perf_counter() - inicio, 3)
+    }
@@ -0,0 +1,220 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, localcontext
+
+from sqlalchemy import select, bindparam, func, text, cast, String, BigInteger
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import CFDRegresionEstado, CFDResumenDiario, CFDEmisor
+
+estado = CFDRegresionEstado.__table__
+resumen = CFDResumenDiario.__table__
+emisor = CFDEmisor.__table__
+
+# Regresión total ~ x con x = segundos desde epoch de fecha, igual que
+# EXTRACT(EPOCH FROM fecha) en Postgres
+_EPOCH = datetime(1970, 1, 1)
+_SUMAS = ("n", "suma_x", "suma_y", "suma_xy", "suma_xx", "suma_yy")
+
+_upsert = pg_insert(estado)
+_UPSERT_ESTADO = _upsert.on_conflict_do_update(
+    index_elements=[estado.c.dimension, estado.c.clave],
+    set_={columna: estado.c[columna] + _upsert.excluded[columna] for columna in _SUMAS}
+)
+
+_ESTADO = {
+    # 📌 "todos" no tiene fila propia (sería una sola fila que toda ingesta
+    # actualiza y serializaría a las concurrentes): es la suma de los tipos
+    "todos": (
+        select(*(
+            (cast(func.sum(estado.c[columna]), BigInteger) if columna == "n" else func.sum(estado.c[columna])).label(columna)
+            for columna in _SUMAS
+        ))
+        .where(estado.c.dimension == "tipo")
+        .having(func.count() > 0)
+    ),
+    "tipo": select(estado).where(estado.c.dimension == "tipo", estado.c.clave == bindparam("tipo")),
+    # El emisor se busca por RFC dentro de la misma consulta
+    "emisor": select(estado).where(
+        estado.c.dimension == "emisor",
+        estado.c.clave == select(cast(emisor.c.id_emisor, String)).where(emisor.c.rfc == bindparam("rfc")).scalar_subquery()
+    )
+}
+
+
+def _extremos(*filtros):
+    return select(func.min(resumen.c.dia).label("primer_dia"), func.max(resumen.c.dia).label("ultimo_dia")).where(*filtros)
+
+
+# Días del primer y último comprobante del grupo, leídos del resumen diario
+_EXTREMOS = {
+    "todos": _extremos(),
+    "tipo": _extremos(resumen.c.tipo_de_comprobante == bindparam("tipo")),
+    "emisor": _extremos(
+        resumen.c.id_emisor.in_(select(emisor.c.id_emisor).where(emisor.c.rfc == bindparam("rfc")))
+    )
+}
+
+
+def _restar(filtro):
+    return text(f"""
+        UPDATE cfd_regresion_estado r
+        SET n = r.n - d.n, suma_x = r.suma_x - d.suma_x, suma_y = r.suma_y - d.suma_y,
+            suma_xy = r.suma_xy - d.suma_xy, suma_xx = r.suma_xx - d.suma_xx, suma_yy = r.suma_yy - d.suma_yy
+        FROM (
+            SELECT CASE WHEN GROUPING(tipo_de_comprobante) = 0 THEN 'tipo' ELSE 'emisor' END AS dimension,
+                   CASE WHEN GROUPING(tipo_de_comprobante) = 0 THEN COALESCE(tipo_de_comprobante, '')
+                        ELSE id_emisor::text END AS clave,
+                   COUNT(*) AS n, SUM(x) AS suma_x, SUM(total) AS suma_y,
+                   SUM(x * total) AS suma_xy, SUM(x * x) AS suma_xx, SUM(total * total) AS suma_yy
+            FROM (
+                SELECT tipo_de_comprobante, id_emisor, EXTRACT(EPOCH FROM fecha)::numeric AS x, total
+                FROM cfd_comprobante
+                WHERE {filtro} AND fecha IS NOT NULL AND total IS NOT NULL
+            ) c
+            GROUP BY GROUPING SETS ((tipo_de_comprobante), (id_emisor))
+        ) d
+        WHERE r.dimension = d.dimension AND r.clave = d.clave
+    """)
+
+
+_RESTAR = _restar("id_comprobante = ANY(:ids_comprobante)")
+_RESTAR_RANGO = _restar("fecha >= :inicio AND fecha < :fin")
+
+_RECONSTRUIR = text("""
+    INSERT INTO cfd_regresion_estado
+    SELECT CASE WHEN GROUPING(tipo_de_comprobante) = 0 THEN 'tipo' ELSE 'emisor' END,
+           CASE WHEN GROUPING(tipo_de_comprobante) = 0 THEN COALESCE(tipo_de_comprobante, '')
+                ELSE id_emisor::text END,
+           COUNT(*), SUM(x), SUM(total), SUM(x * total), SUM(x * x), SUM(total * total)
+    FROM (
+        SELECT tipo_de_comprobante, id_emisor, EXTRACT(EPOCH FROM fecha)::numeric AS x, total
+        FROM cfd_comprobante
+        WHERE fecha IS NOT NULL AND total IS NOT NULL
+    ) c
+    GROUP BY GROUPING SETS ((tipo_de_comprobante), (id_emisor))
+""")
+
+
+def segundos(fecha: datetime):
+    # Exacto al microsegundo, como EXTRACT(EPOCH FROM fecha)::numeric
+    return Decimal((fecha - _EPOCH) // timedelta(microseconds=1)) / Decimal(1000000)
+
+
+async def actualizar_regresion(db: AsyncSession, filas):
+    """
+    Suma comprobantes recién insertados al estado de la regresión, dentro de
+    la transacción de la ingesta.
+    :param filas: Iterable de tuplas (fecha, tipo_de_comprobante, id_emisor, total).
+    """
+    sumas = defaultdict(lambda: [0, Decimal(0), Decimal(0), Decimal(0), Decimal(0), Decimal(0)])
+    with localcontext() as contexto:
+        # x² necesita ~32 dígitos; la precisión por omisión (28) redondearía
+        contexto.prec = 60
+        for fecha, tipo, id_emisor, total in filas:
+            if fecha is None or total is None:
+                continue
+            x = segundos(fecha)
+            y = Decimal(total)
+            for grupo in (("tipo", tipo or ""), ("emisor", str(id_emisor))):
+                acumulado = sumas[grupo]
+                acumulado[0] += 1
+                acumulado[1] += x
+                acumulado[2] += y
+                acumulado[3] += x * y
+                acumulado[4] += x * x
+                acumulado[5] += y * y
+    if not sumas:
+        return
+
+    await db.execute(_UPSERT_ESTADO, [
+        {"dimension": dimension, "clave": clave} | dict(zip(_SUMAS, valores))
+        # En orden de llave, como el resumen diario, para no interbloquearse
+        for (dimension, clave), valores in sorted(sumas.items())
+    ])
+
+
+async def restar_regresion(db: AsyncSession, ids_comprobante):
+    """
+    Resta comprobantes del estado de la regresión (por tipo y por emisor). Debe ejecutarse antes de borrarlos, en la misma transacción.
+    """
+    await db.execute(_RESTAR, {"ids_comprobante": list(ids_comprobante)})
+
+
+async def restar_regresion_rango(db: AsyncSession, inicio: datetime, fin: datetime):
+    # Igual que restar_regresion, para todos los comprobantes de [inicio, fin)
+    await db.execute(_RESTAR_RANGO, {"inicio": inicio, "fin": fin})
+    await db.execute(estado.delete().where(estado.c.n <= 0))
+
+
+async def eliminar_regresion_emisor(db: AsyncSession, ids_emisor):
+    # Estado propio de emisores que ya no tienen comprobantes, y grupos que quedaron vacíos
+    await db.execute(estado.delete().where(
+        estado.c.dimension == "emisor", estado.c.clave.in_([str(id_emisor) for id_emisor in ids_emisor])
+    ))
+    await db.execute(estado.delete().where(estado.c.n <= 0))
+
+
+async def reconstruir_regresion(db: AsyncSession):
+    """
+    Recalcula todo el estado desde cfd_comprobante (para backfills).
+    :return: Número de grupos escritos.
+    """
+    await db.execute(text("TRUNCATE cfd_regresion_estado"))
+    resultado = await db.execute(_RECONSTRUIR)
+    await db.commit()
+    return resultado.rowcount
+
+
+def consulta_estado(dimension):
+    """
+    :param dimension: "todos", "tipo" (bind "tipo") o "emisor" (bind "rfc").
+    """
+    return _ESTADO[dimension]
+
+
+def consulta_extremos(dimension):
+    return _EXTREMOS[dimension]
+
+
+def ajustar(fila):
+    """
+    Mínimos cuadrados a partir de las sumas, en Decimal para no perder
+    precisión con x del orden de 1e9 y x² del orden de 1e18.
+    :param fila: Mapping con n y las sumas de cfd_regresion_estado.
+    :return: Diccionario con pendiente, intercepto y r2 (Decimal), o None si
+        no hay al menos dos fechas distintas.
+    """
+    with localcontext() as contexto:
+        contexto.prec = 60
+        n = Decimal(fila["n"])
+        sx, sy, sxy, sxx, syy = (Decimal(fila[columna]) for columna in _SUMAS[1:])
+        varianza_x = n * sxx - sx * sx
+        if n < 2 or varianza_x <= 0:
+            return None
+        covarianza = n * sxy - sx * sy
+        pendiente = covarianza / varianza_x
+        intercepto = (sy - pendiente * sx) / n
+        varianza_y = n * syy - sy * sy
+        r2 = covarianza * covarianza / (varianza_x * varianza_y) if varianza_y > 0 else Decimal(1)
+        return {"pendiente": +pendiente, "intercepto": +intercepto, "r2": +r2}
+
+
+def predecir(modelo, fechas):
+    """
+    :param fechas: Iterable de datetimes.
+    :return: Lista de {"fecha", "valor"}.
+    """
+    with localcontext() as contexto:
+        contexto.prec = 60
+        return [
+            {"fecha": fecha.isoformat(), "valor": float(modelo["intercepto"] + modelo["pendiente"] * segundos(fecha))}
+            for fecha in fechas
+        ]
+
+
+def curva(modelo, inicio: datetime, fin: datetime, puntos: int):
+    # Puntos equiespaciados entre inicio y fin, en lugar de uno por comprobante
+    paso = (fin - inicio) / (puntos - 1)
+    return predecir(modelo, (inicio + paso * i for i in range(puntos)))
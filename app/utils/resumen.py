@@ -0,0 +1,258 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import select, bindparam, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert, JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import CFDResumenDiario
+from app.utils import sketch
+from app.utils.sketch import GAMMA
+
+resumen = CFDResumenDiario.__table__
+
+# Cubeta del sketch calculada en SQL; debe coincidir con sketch.cubeta
+_CUBETA_SQL = f"""
+    CASE WHEN total <= 0 THEN '{sketch.CUBETA_CERO}'
+         ELSE CEIL(LN(total::float8) / LN({GAMMA!r}::float8))::int::text END
+"""
+
+_upsert = pg_insert(resumen)
+_UPSERT_RESUMEN = _upsert.on_conflict_do_update(
+    index_elements=[resumen.c.dia, resumen.c.tipo_de_comprobante, resumen.c.id_emisor],
+    set_={
+        "cantidad": resumen.c.cantidad + _upsert.excluded.cantidad,
+        "suma": resumen.c.suma + _upsert.excluded.suma,
+        "suma_cuadrados": resumen.c.suma_cuadrados + _upsert.excluded.suma_cuadrados,
+        "minimo": func.least(resumen.c.minimo, _upsert.excluded.minimo),
+        "maximo": func.greatest(resumen.c.maximo, _upsert.excluded.maximo),
+        "sketch": func.cfd_sketch_combinar(resumen.c.sketch, _upsert.excluded.sketch, type_=JSONB)
+    }
+)
+
+
+def _agregados(*filtros):
+    return select(
+        func.sum(resumen.c.cantidad).label("cantidad"),
+        func.sum(resumen.c.suma).label("suma"),
+        func.sum(resumen.c.suma_cuadrados).label("suma_cuadrados"),
+        func.min(resumen.c.minimo).label("minimo"),
+        func.max(resumen.c.maximo).label("maximo"),
+        func.cfd_sketch_union(resumen.c.sketch, type_=JSONB).label("sketch"),
+        func.min(resumen.c.dia).label("primer_dia"),
+        func.max(resumen.c.dia).label("ultimo_dia")
+    ).where(*filtros)
+
+
+_AGREGADOS = {
+    False: _agregados(),
+    True: _agregados(resumen.c.dia >= bindparam("inicio"), resumen.c.dia < bindparam("fin"))
+}
+
+
+def consulta_agregados(rango):
+    """
+    Fusiona los resúmenes diarios de un rango; cuesta O(días), no O(comprobantes).
+    :param rango: Resultado de rango_fechas (siempre cae en días completos).
+    """
+    return _AGREGADOS[rango is not None]
+
+
+def _momentos(*filtros):
+    return (
+        select(
+            resumen.c.tipo_de_comprobante.label("tipo"),
+            func.sum(resumen.c.cantidad).label("cantidad"),
+            func.sum(resumen.c.suma).label("suma"),
+            func.sum(resumen.c.suma_cuadrados).label("suma_cuadrados")
+        )
+        .where(*filtros)
+        .group_by(resumen.c.tipo_de_comprobante)
+    )
+
+
+_MOMENTOS = {
+    False: _momentos(),
+    True: _momentos(resumen.c.dia >= bindparam("inicio"), resumen.c.dia < bindparam("fin"))
+}
+
+
+def consulta_momentos(rango):
+    """
+    Cantidad, suma y suma de cuadrados por tipo de comprobante en un rango.
+    Las sumas son NUMERIC, así que media y varianza salen exactas.
+    :param rango: Resultado de rango_fechas; usa parametros_agregados.
+    """
+    return _MOMENTOS[rango is not None]
+
+
+def parametros_agregados(rango):
+    if rango is None:
+        return {}
+    return {"inicio": rango[0].date(), "fin": rango[1].date()}
+
+
+async def actualizar_resumen(db: AsyncSession, filas):
+    """
+    Suma comprobantes recién insertados al resumen diario, dentro de la
+    transacción de la ingesta.
+    :param filas: Iterable de tuplas (fecha, tipo_de_comprobante, id_emisor, total).
+    """
+    grupos = defaultdict(list)
+    for fecha, tipo, id_emisor, total in filas:
+        grupos[(fecha.date(), tipo, id_emisor)].append(Decimal(total))
+    if not grupos:
+        return
+
+    # 📌 Siempre en el mismo orden de llave: dos ingestas concurrentes que tocan
+    # los mismos días bloquean las filas en igual secuencia y no se interbloquean
+    await db.execute(_UPSERT_RESUMEN, [
+        {
+            "dia": dia,
+            "tipo_de_comprobante": tipo,
+            "id_emisor": id_emisor,
+            "cantidad": len(totales),
+            "suma": sum(totales),
+            "suma_cuadrados": sum(total * total for total in totales),
+            "minimo": min(totales),
+            "maximo": max(totales),
+            "sketch": sketch.crear_sketch(totales)
+        }
+        for (dia, tipo, id_emisor), totales in sorted(grupos.items())
+    ])
+
+
+# 📌 Recalcula sin ciertos comprobantes los grupos (día, tipo, emisor) que
+# tocan: exacto también para mínimo, máximo y sketch, que no se pueden restar.
+# Los grupos que se quedan sin comprobantes se borran.
+_RECALCULAR_SIN = text(f"""
+    WITH grupos AS (
+        SELECT DISTINCT fecha::date AS dia, tipo_de_comprobante, id_emisor
+        FROM cfd_comprobante
+        WHERE id_comprobante = ANY(:ids_comprobante)
+    ), restantes AS (
+        SELECT dia, tipo_de_comprobante, id_emisor,
+               SUM(n) AS cantidad, SUM(s) AS suma, SUM(sc) AS suma_cuadrados,
+               MIN(mn) AS minimo, MAX(mx) AS maximo, jsonb_object_agg(cubeta, n) AS sketch
+        FROM (
+            SELECT g.dia, g.tipo_de_comprobante, g.id_emisor, {_CUBETA_SQL} AS cubeta,
+                   COUNT(*) AS n, SUM(total) AS s, SUM(total * total) AS sc, MIN(total) AS mn, MAX(total) AS mx
+            FROM grupos g
+            JOIN cfd_comprobante c
+              ON c.fecha >= g.dia AND c.fecha < g.dia + 1
+             AND c.tipo_de_comprobante = g.tipo_de_comprobante AND c.id_emisor = g.id_emisor
+            WHERE c.id_comprobante <> ALL(:ids_comprobante)
+            GROUP BY 1, 2, 3, 4
+        ) b
+        GROUP BY dia, tipo_de_comprobante, id_emisor
+    ), actualizados AS (
+        UPDATE cfd_resumen_diario r
+        SET cantidad = x.cantidad, suma = x.suma, suma_cuadrados = x.suma_cuadrados,
+            minimo = x.minimo, maximo = x.maximo, sketch = x.sketch
+        FROM restantes x
+        WHERE r.dia = x.dia AND r.tipo_de_comprobante = x.tipo_de_comprobante AND r.id_emisor = x.id_emisor
+        RETURNING 1
+    )
+    DELETE FROM cfd_resumen_diario r
+    USING grupos g
+    WHERE r.dia = g.dia AND r.tipo_de_comprobante = g.tipo_de_comprobante AND r.id_emisor = g.id_emisor
+      AND NOT EXISTS (
+          SELECT 1 FROM restantes x
+          WHERE x.dia = g.dia AND x.tipo_de_comprobante = g.tipo_de_comprobante AND x.id_emisor = g.id_emisor
+      )
+""")
+
+
+async def restar_resumen(db: AsyncSession, ids_comprobante):
+    """
+    Descuenta comprobantes del resumen diario. Debe ejecutarse antes de
+    borrarlos, en la misma transacción.
+    :return: Número de filas de resumen que quedaron vacías y se borraron.
+    """
+    resultado = await db.execute(_RECALCULAR_SIN, {"ids_comprobante": list(ids_comprobante)})
+    return resultado.rowcount
+
+
+async def eliminar_resumen_emisor(db: AsyncSession, ids_emisor):
+    return await db.execute(resumen.delete().where(resumen.c.id_emisor.in_(ids_emisor)))
+
+
+async def eliminar_resumen_rango(db: AsyncSession, rango):
+    return await db.execute(
+        resumen.delete().where(resumen.c.dia >= rango[0].date(), resumen.c.dia < rango[1].date())
+    )
+
+
+async def reconstruir_resumen(db: AsyncSession, rango=None):
+    """
+    Recalcula el resumen diario desde cfd_comprobante (para backfills).
+    :param rango: Tupla (inicio, fin) de datetimes en días completos, o None para toda la tabla.
+    :return: Número de filas de resumen escritas.
+    """
+    filtro = "WHERE fecha >= :inicio AND fecha < :fin" if rango else ""
+    params = {"inicio": rango[0], "fin": rango[1]} if rango else {}
+
+    if rango:
+        await eliminar_resumen_rango(db, rango)
+    else:
+        await db.execute(text("TRUNCATE cfd_resumen_diario"))
+
+    resultado = await db.execute(text(f"""
+        INSERT INTO cfd_resumen_diario
+        SELECT dia, tipo_de_comprobante, id_emisor,
+               SUM(n), SUM(s), SUM(sc), MIN(mn), MAX(mx), jsonb_object_agg(cubeta, n)
+        FROM (
+            SELECT fecha::date AS dia, tipo_de_comprobante, id_emisor, {_CUBETA_SQL} AS cubeta,
+                   COUNT(*) AS n, SUM(total) AS s, SUM(total * total) AS sc, MIN(total) AS mn, MAX(total) AS mx
+            FROM cfd_comprobante
+            {filtro}
+            GROUP BY 1, 2, 3, 4
+        ) b
+        GROUP BY dia, tipo_de_comprobante, id_emisor
+    """), params)
+    await db.commit()
+    return resultado.rowcount
+
+
+def momentos_por_tipo(filas):
+    """
+    :param filas: Filas de consulta_momentos.
+    :return: Diccionario {tipo: {"n", "media", "varianza"}} con varianza muestral (Decimal).
+    """
+    momentos = {}
+    for fila in filas:
+        n = fila["cantidad"]
+        media = fila["suma"] / n
+        varianza = (fila["suma_cuadrados"] - fila["suma"] * media) / (n - 1) if n > 1 else None
+        momentos[fila["tipo"]] = {"n": int(n), "media": media, "varianza": varianza}
+    return momentos
+
+
+def estadisticas_desde_agregados(agregados):
+    """
+    Estadísticas de un rango a partir de los resúmenes fusionados. Media,
+    varianza, mínimo y máximo son exactos; mediana, moda y percentiles son
+    aproximados con la precisión relativa del sketch.
+    :param agregados: Mapping con la fila de consulta_agregados.
+    :return: Diccionario con las mismas llaves que estadisticas_desde_resumen.
+    """
+    cantidad = agregados["cantidad"]
+    media = agregados["suma"] / cantidad
+    varianza = max(agregados["suma_cuadrados"] / cantidad - media * media, Decimal(0))
+    sketch_total = agregados["sketch"]
+    return {
+        "cantidad_registros": int(cantidad),
+        "media": float(media),
+        "mediana": sketch.cuantil(sketch_total, 0.5),
+        "moda": [sketch.moda(sketch_total)],
+        "varianza": float(varianza),
+        "desviacion_estandar": float(varianza.sqrt()),
+        "minimo": float(agregados["minimo"]),
+        "maximo": float(agregados["maximo"]),
+        "rango": float(agregados["maximo"] - agregados["minimo"]),
+        "percentiles": {
+            "25": sketch.cuantil(sketch_total, 0.25),
+            "50": sketch.cuantil(sketch_total, 0.5),
+            "75": sketch.cuantil(sketch_total, 0.75)
+        }
+    }
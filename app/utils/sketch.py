@@ -0,0 +1,77 @@
+import math
+from collections import Counter
+
+# Sketch de cuantiles con cubetas logarítmicas (al estilo DDSketch).
+# Cada valor positivo x cae en la cubeta ceil(log(x) / log(GAMMA)); el valor
+# representativo de la cubeta está a menos de PRECISION_RELATIVA del valor real.
+# Dos sketches se combinan sumando los conteos de cada cubeta, así que los
+# resúmenes diarios pueden fusionarse en cualquier rango de fechas.
+#
+# IMPORTANTE: GAMMA también está fijado en la migración 0004 y en
+# app/utils/resumen.py (cálculo de cubetas en SQL); deben coincidir.
+PRECISION_RELATIVA = 0.01
+GAMMA = (1 + PRECISION_RELATIVA) / (1 - PRECISION_RELATIVA)
+_LOG_GAMMA = math.log(GAMMA)
+
+# Cubeta para ceros (y negativos, que un CFDI no debería tener)
+CUBETA_CERO = "z"
+
+
+def cubeta(valor):
+    valor = float(valor)
+    if valor <= 0:
+        return CUBETA_CERO
+    return str(math.ceil(math.log(valor) / _LOG_GAMMA))
+
+
+def valor_cubeta(clave):
+    if clave == CUBETA_CERO:
+        return 0.0
+    indice = int(clave)
+    return 2 * GAMMA ** indice / (GAMMA + 1)
+
+
+def crear_sketch(valores):
+    """
+    :param valores: Iterable de números.
+    :return: Diccionario {cubeta: conteo} serializable como JSONB.
+    """
+    return dict(Counter(cubeta(valor) for valor in valores))
+
+
+def combinar(*sketches):
+    resultado = Counter()
+    for sketch in sketches:
+        resultado.update(sketch or {})
+    return dict(resultado)
+
+
+def _ordenadas(sketch):
+    return sorted(sketch.items(), key=lambda item: -math.inf if item[0] == CUBETA_CERO else int(item[0]))
+
+
+def cuantil(sketch, q):
+    """
+    Cuantil aproximado con la misma interpolación de rango que percentile_cont.
+    :param sketch: Diccionario {cubeta: conteo}.
+    :param q: Cuantil entre 0 y 1.
+    """
+    cubetas = _ordenadas(sketch)
+    total = sum(conteo for _, conteo in cubetas)
+    if not total:
+        return None
+    rango = q * (total - 1)
+    acumulado = 0
+    for clave, conteo in cubetas:
+        acumulado += conteo
+        if acumulado > rango:
+            return valor_cubeta(clave)
+    return valor_cubeta(cubetas[-1][0])
+
+
+def moda(sketch):
+    # Valor representativo de la cubeta con más observaciones
+    if not sketch:
+        return None
+    clave, _ = max(_ordenadas(sketch), key=lambda item: item[1])
+    return valor_cubeta(clave)
@@ -0,0 +1,546 @@
+import asyncio
+import calendar
+import json
+import logging
+import math
+import os
+import struct
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from app.database.database import async_session
+from app.utils.cache_respuestas import cache_respuestas, cambios
+from app.utils.metricas import Medidor
+
+# Copia columnar de los comprobantes en memoria para /estadisticas,
+# /estadisticas/tipo-comprobante y /estadisticas/emisor/{rfc}; sin ella esos
+# endpoints consultan Postgres
+SNAPSHOT_ANALISIS = os.getenv("SNAPSHOT_ANALISIS", "false").lower() in ("1", "true", "si", "sí")
+# Memoria máxima por worker; si los comprobantes no caben se sigue usando Postgres
+SNAPSHOT_MEMORIA_MB = float(os.getenv("SNAPSHOT_MEMORIA_MB", 512))
+# Archivo del snapshot en disco (se abre con mmap al arrancar); vacío: no se guarda
+SNAPSHOT_ARCHIVO = os.getenv("SNAPSHOT_ARCHIVO", "")
+# Filas agregadas por la ingesta que se acumulan antes de fusionarlas con las ordenadas
+SNAPSHOT_PENDIENTES = int(os.getenv("SNAPSHOT_PENDIENTES", 65536))
+# Segundos entre comparaciones contra cfd_resumen_diario (también recoge lo
+# que ingieren los demás workers y lo que se archiva o purga fuera del proceso)
+SNAPSHOT_VERIFICAR_SEGUNDOS = float(os.getenv("SNAPSHOT_VERIFICAR_SEGUNDOS", 60))
+# A partir de cuántas filas seleccionadas las estadísticas se calculan en un hilo
+SNAPSHOT_FILAS_HILO = int(os.getenv("SNAPSHOT_FILAS_HILO", 200000))
+
+logger = logging.getLogger("app.snapshot")
+
+# numpy se importa al activar el snapshot, como scipy en stats
+np = None
+
+# (nombre, dtype): id_comprobante, fecha en segundos desde epoch, total,
+# código del tipo de comprobante e id_emisor
+COLUMNAS = (("id", "int32"), ("fecha", "int64"), ("total", "float64"), ("tipo", "uint8"), ("emisor", "int32"))
+BYTES_POR_FILA = 25
+
+EPOCA = datetime(1970, 1, 1)
+_FIRMA = b"CFDISNAP"
+_ALINEACION = 64
+
+_FILAS = """
+    SELECT id_comprobante, EXTRACT(EPOCH FROM fecha)::bigint, total::float8, tipo_de_comprobante, id_emisor
+    FROM cfd_comprobante
+"""
+_FILAS_TODAS = text(_FILAS)
+_FILAS_RANGO = text(_FILAS + " WHERE fecha >= :inicio AND fecha < :fin")
+
+_CANTIDAD = text("SELECT COALESCE(SUM(cantidad), 0) FROM cfd_resumen_diario")
+
+# 📌 El resumen diario se mantiene en la misma transacción que cada ingesta,
+# purga o archivo: compararlo por mes cuesta O(días), no O(comprobantes)
+_TOTALES_POR_MES = text("""
+    SELECT date_trunc('month', dia)::date, SUM(cantidad), SUM(suma)::float8
+    FROM cfd_resumen_diario
+    GROUP BY 1
+""")
+
+
+def _importar_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+def segundos(fecha: datetime):
+    return calendar.timegm(fecha.timetuple())
+
+
+def _mes_siguiente(mes: date):
+    return date(mes.year + 1, 1, 1) if mes.month == 12 else date(mes.year, mes.month + 1, 1)
+
+
+def _rango_mes(mes: date):
+    return segundos(datetime.combine(mes, datetime.min.time())), segundos(datetime.combine(_mes_siguiente(mes), datetime.min.time()))
+
+
+def _alinear(bytes_):
+    return _ALINEACION * math.ceil(bytes_ / _ALINEACION)
+
+
+def _vacias(n=0):
+    return {nombre: np.empty(n, dtype=dtype) for nombre, dtype in COLUMNAS}
+
+
+def _concatenar(partes):
+    return {nombre: np.concatenate([parte[nombre] for parte in partes]) for nombre, _ in COLUMNAS}
+
+
+def _filtrar(columnas, mascara):
+    return {nombre: arreglo[mascara] for nombre, arreglo in columnas.items()}
+
+
+def _ordenar(columnas):
+    orden = np.argsort(columnas["fecha"], kind="stable")
+    return {nombre: arreglo[orden] for nombre, arreglo in columnas.items()}
+
+
+def _estadisticas(totales, fechas):
+    # Mismas llaves que consultas._resumen, para estadisticas_desde_resumen
+    valores, conteos = np.unique(totales, return_counts=True)
+    p25, p50, p75 = np.percentile(totales, (25, 50, 75))
+    return {
+        "cantidad": len(totales),
+        "suma": float(totales.sum()),
+        "media": float(totales.mean()),
+        "varianza": float(totales.var()),
+        "desviacion_estandar": float(totales.std()),
+        "minimo": float(valores[0]),
+        "maximo": float(valores[-1]),
+        "p25": float(p25),
+        "p50": float(p50),
+        "p75": float(p75),
+        # np.unique ordena: en un empate gana el menor, como mode() de Postgres
+        "moda": float(valores[np.argmax(conteos)]),
+        "primer_registro": EPOCA + timedelta(seconds=int(fechas.min())),
+        "ultimo_registro": EPOCA + timedelta(seconds=int(fechas.max()))
+    }
+
+
+_VACIO = {
+    "cantidad": 0, "suma": None, "media": None, "varianza": None, "desviacion_estandar": None,
+    "minimo": None, "maximo": None, "p25": None, "p50": None, "p75": None, "moda": None,
+    "primer_registro": None, "ultimo_registro": None
+}
+
+
+# 📌 Columnas NumPy contiguas ordenadas por fecha: un filtro de fechas es un
+# searchsorted y los de tipo y emisor son máscaras vectorizadas
+class SnapshotColumnar:
+    """
+    Comprobantes en arreglos NumPy (una columna por campo) ordenados por
+    fecha, más un bloque de capacidad fija con las filas que agrega la
+    ingesta; al llenarse se fusiona con las ordenadas.
+    """
+
+    def __init__(self, memoria_mb=SNAPSHOT_MEMORIA_MB, pendientes=SNAPSHOT_PENDIENTES):
+        self.memoria_bytes = int(memoria_mb * 1024 * 1024)
+        self.capacidad_pendientes = pendientes
+        self.columnas = None
+        self.pendientes = None
+        self.n_pendientes = 0
+        self.tipos = []
+        self._codigos = {}
+        # Durante una recarga: (rangos en segundos, filas agregadas mientras tanto)
+        self._recarga = None
+        # Meses donde el resumen diario no coincide con cfd_comprobante: mes -> (cantidad, suma) del resumen
+        self.aceptados = {}
+        # Meses que la última verificación encontró distintos y aún no se recargan:
+        # mientras tanto las consultas que los tocan van a SQL
+        self.desfasados = set()
+        self.origen = None
+        self.recargas = 0
+        self.consultas = 0
+
+    def disponible(self):
+        return self.columnas is not None
+
+    def filas(self):
+        if self.columnas is None:
+            return 0
+        return len(self.columnas["fecha"]) + self.n_pendientes
+
+    def _cabe(self, filas):
+        return (filas + self.capacidad_pendientes) * BYTES_POR_FILA <= self.memoria_bytes
+
+    def _activar(self, columnas, origen):
+        self.columnas = columnas
+        self.pendientes = _vacias(self.capacidad_pendientes)
+        self.n_pendientes = 0
+        self.origen = origen
+
+    def desactivar(self, motivo):
+        logger.warning("Snapshot de análisis desactivado: %s", motivo)
+        self.columnas = None
+        self.pendientes = None
+        self.n_pendientes = 0
+
+    def _codigo(self, tipo):
+        codigo = self._codigos.get(tipo)
+        if codigo is None:
+            codigo = self._codigos[tipo] = len(self.tipos)
+            self.tipos.append(tipo)
+        return codigo
+
+    def _arreglos(self, filas):
+        # filas: tuplas (id_comprobante, segundos, total, tipo, id_emisor)
+        if not filas:
+            return _vacias()
+        ids, fechas, totales, tipos, emisores = zip(*filas)
+        return {
+            "id": np.array(ids, dtype="int32"),
+            "fecha": np.array(fechas, dtype="int64"),
+            "total": np.array(totales, dtype="float64"),
+            "tipo": np.array([self._codigo(tipo) for tipo in tipos], dtype="uint8"),
+            "emisor": np.array(emisores, dtype="int32")
+        }
+
+    async def cargar(self, db):
+        """
+        Lee todos los comprobantes de Postgres; si no caben en el presupuesto
+        de memoria el snapshot queda desactivado.
+        :return: True si quedó cargado.
+        """
+        cantidad = await db.scalar(_CANTIDAD)
+        if not self._cabe(cantidad):
+            self.desactivar(f"{cantidad} comprobantes no caben en {SNAPSHOT_MEMORIA_MB:g} MB")
+            return False
+
+        partes = []
+        resultado = await db.stream(_FILAS_TODAS.execution_options(yield_per=50000))
+        async for lote in resultado.partitions():
+            partes.append(self._arreglos(lote))
+        self._activar(_ordenar(_concatenar(partes)) if partes else _vacias(), "postgres")
+        return True
+
+    def guardar(self, ruta):
+        """
+        Escribe el snapshot en un solo archivo: firma, longitud y cabecera JSON
+        y luego cada columna alineada, para poder abrirla con np.memmap. Se
+        escribe a un temporal y se renombra, así que es atómico.
+        """
+        self._consolidar()
+        n = len(self.columnas["fecha"])
+        # Posiciones relativas al inicio de los datos, que va alineado tras la cabecera
+        cabecera = {"version": 1, "filas": n, "tipos": self.tipos, "columnas": []}
+        posicion = 0
+        for nombre, dtype in COLUMNAS:
+            cabecera["columnas"].append([nombre, dtype, posicion])
+            posicion += _alinear(n * np.dtype(dtype).itemsize)
+        contenido = json.dumps(cabecera).encode("utf-8")
+        inicio = _alinear(len(_FIRMA) + 8 + len(contenido))
+
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "wb") as archivo:
+            archivo.write(_FIRMA + struct.pack("<Q", len(contenido)) + contenido)
+            for nombre, _, relativa in cabecera["columnas"]:
+                archivo.seek(inicio + relativa)
+                self.columnas[nombre].tofile(archivo)
+            archivo.truncate(inicio + posicion)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, ruta)
+
+    def abrir(self, ruta):
+        """
+        Abre un snapshot guardado con guardar(); las columnas quedan mapeadas
+        con mmap (sin leer el archivo) hasta la primera fusión.
+        :raises ValueError: Si el archivo no es un snapshot válido.
+        """
+        with open(ruta, "rb") as archivo:
+            if archivo.read(len(_FIRMA)) != _FIRMA:
+                raise ValueError(f"{ruta} no es un snapshot")
+            longitud, = struct.unpack("<Q", archivo.read(8))
+            cabecera = json.loads(archivo.read(longitud))
+        inicio = _alinear(len(_FIRMA) + 8 + longitud)
+        if cabecera.get("version") != 1:
+            raise ValueError(f"Versión de snapshot no soportada: {cabecera.get('version')}")
+        if not self._cabe(cabecera["filas"]):
+            self.desactivar(f"{cabecera['filas']} comprobantes no caben en {SNAPSHOT_MEMORIA_MB:g} MB")
+            return False
+
+        columnas = {}
+        for nombre, dtype, relativa in cabecera["columnas"]:
+            if cabecera["filas"]:
+                columnas[nombre] = np.memmap(ruta, dtype=dtype, mode="r", offset=inicio + relativa, shape=(cabecera["filas"],))
+            else:
+                columnas[nombre] = np.empty(0, dtype=dtype)
+        self.tipos = list(cabecera["tipos"])
+        self._codigos = {tipo: codigo for codigo, tipo in enumerate(self.tipos)}
+        self._activar(columnas, "archivo")
+        return True
+
+    def agregar(self, ids_comprobante, filas):
+        """
+        Agrega los comprobantes recién confirmados por la ingesta.
+        :param ids_comprobante: id_comprobante de cada fila.
+        :param filas: Tuplas (fecha, tipo_de_comprobante, id_emisor, total), las mismas de actualizar_resumen.
+        """
+        if self.columnas is None or not filas:
+            return
+        filas = [
+            (id_comprobante, segundos(fecha), float(total), tipo, id_emisor)
+            for id_comprobante, (fecha, tipo, id_emisor, total) in zip(ids_comprobante, filas)
+        ]
+        if self._recarga is not None:
+            rangos, durante = self._recarga
+            durante.extend(fila for fila in filas if any(inicio <= fila[1] < fin for inicio, fin in rangos))
+
+        if not self._cabe(self.filas() + len(filas)):
+            self.desactivar(f"se superó el presupuesto de {SNAPSHOT_MEMORIA_MB:g} MB")
+            return
+        for fila in filas:
+            if self.n_pendientes == self.capacidad_pendientes:
+                self._consolidar()
+            i = self.n_pendientes
+            self.pendientes["id"][i], self.pendientes["fecha"][i], self.pendientes["total"][i] = fila[0], fila[1], fila[2]
+            self.pendientes["tipo"][i], self.pendientes["emisor"][i] = self._codigo(fila[3]), fila[4]
+            self.n_pendientes += 1
+
+    def _pendientes(self):
+        return {nombre: arreglo[:self.n_pendientes] for nombre, arreglo in self.pendientes.items()}
+
+    def _fusionar(self, nuevas):
+        # Inserta filas (en cualquier orden) en las columnas ordenadas: O(n + m)
+        if not len(nuevas["fecha"]):
+            return
+        nuevas = _ordenar(nuevas)
+        posiciones = np.searchsorted(self.columnas["fecha"], nuevas["fecha"], side="right")
+        self.columnas = {
+            nombre: np.insert(arreglo, posiciones, nuevas[nombre]) for nombre, arreglo in self.columnas.items()
+        }
+
+    def _consolidar(self):
+        if self.n_pendientes:
+            self._fusionar({nombre: arreglo.copy() for nombre, arreglo in self._pendientes().items()})
+            self.n_pendientes = 0
+
+    def eliminar_emisores(self, ids_emisor):
+        """
+        Quita los comprobantes de los emisores purgados.
+        """
+        if self.columnas is None:
+            return
+        self._consolidar()
+        self.columnas = _filtrar(self.columnas, ~np.isin(self.columnas["emisor"], ids_emisor))
+
+    def eliminar_comprobantes(self, ids_comprobante):
+        """
+        Quita comprobantes por id (bloques de una purga que sí se confirmaron).
+        """
+        if self.columnas is None or not len(ids_comprobante):
+            return
+        self._consolidar()
+        self.columnas = _filtrar(self.columnas, ~np.isin(self.columnas["id"], ids_comprobante))
+
+    def _seleccionar(self, rango, tipo, id_emisor):
+        # Tramo ordenado por fecha + pendientes, filtrados por tipo y emisor
+        partes = [self.columnas, self._pendientes()]
+        if rango is not None:
+            inicio, fin = segundos(rango[0]), segundos(rango[1])
+            desde, hasta = np.searchsorted(self.columnas["fecha"], (inicio, fin))
+            partes[0] = {nombre: arreglo[desde:hasta] for nombre, arreglo in self.columnas.items()}
+            fechas = partes[1]["fecha"]
+            partes[1] = _filtrar(partes[1], (fechas >= inicio) & (fechas < fin))
+
+        totales, fechas = [], []
+        for parte in partes:
+            mascara = None
+            if tipo is not None:
+                mascara = parte["tipo"] == self._codigos[tipo]
+            if id_emisor is not None:
+                mascara = parte["emisor"] == id_emisor if mascara is None else mascara & (parte["emisor"] == id_emisor)
+            totales.append(parte["total"] if mascara is None else parte["total"][mascara])
+            fechas.append(parte["fecha"] if mascara is None else parte["fecha"][mascara])
+        return np.concatenate(totales), np.concatenate(fechas)
+
+    async def resumen(self, rango=None, tipo=None, id_emisor=None):
+        """
+        Estadísticas de los comprobantes que cumplen los filtros, con las mismas
+        llaves que la consulta consultas._resumen.
+        :param rango: Resultado de rango_fechas.
+        :return: Diccionario, o None si el snapshot no está disponible.
+        """
+        if self.columnas is None or self._toca_desfasados(rango):
+            return None
+        self.consultas += 1
+        if tipo is not None and tipo not in self._codigos:
+            return dict(_VACIO)
+        totales, fechas = self._seleccionar(rango, tipo, id_emisor)
+        if not len(totales):
+            return dict(_VACIO)
+        if len(totales) >= SNAPSHOT_FILAS_HILO:
+            # np.unique y np.percentile ordenan: en rangos grandes, fuera del event loop
+            return await asyncio.to_thread(_estadisticas, totales, fechas)
+        return _estadisticas(totales, fechas)
+
+    def _toca_desfasados(self, rango):
+        if not self.desfasados:
+            return False
+        if rango is None:
+            return True
+        inicio, fin = segundos(rango[0]), segundos(rango[1])
+        return any(desde < fin and inicio < hasta for desde, hasta in map(_rango_mes, self.desfasados))
+
+    def _totales_por_mes(self):
+        meses = {}
+        for parte in (self.columnas, self._pendientes()):
+            if not len(parte["fecha"]):
+                continue
+            claves, inverso = np.unique(parte["fecha"].astype("datetime64[s]").astype("datetime64[M]"), return_inverse=True)
+            conteos = np.bincount(inverso)
+            sumas = np.bincount(inverso, weights=parte["total"])
+            for clave, conteo, suma in zip(claves, conteos, sumas):
+                mes = clave.astype(date)
+                anterior = meses.get(mes, (0, 0.0))
+                meses[mes] = (anterior[0] + int(conteo), anterior[1] + float(suma))
+        return meses
+
+    async def verificar(self, db):
+        """
+        Compara cantidad y suma de totales por mes contra cfd_resumen_diario.
+        :return: Lista de meses (date del día 1) que difieren.
+        """
+        esperados = {mes: (int(cantidad), float(suma)) for mes, cantidad, suma in (await db.execute(_TOTALES_POR_MES)).all()}
+        propios = self._totales_por_mes()
+        diferentes = []
+        for mes in sorted(esperados.keys() | propios.keys()):
+            esperado = esperados.get(mes, (0, 0.0))
+            propio = propios.get(mes, (0, 0.0))
+            if esperado[0] == propio[0] and math.isclose(esperado[1], propio[1], rel_tol=1e-9, abs_tol=0.01):
+                self.aceptados.pop(mes, None)
+                continue
+            if self.aceptados.get(mes) == esperado:
+                continue
+            diferentes.append(mes)
+        self.desfasados = set(diferentes)
+        return diferentes
+
+    async def recargar_meses(self, db, meses):
+        """
+        Reemplaza los comprobantes de los meses dados por los de cfd_comprobante.
+        Lo que la ingesta agregue mientras se leen se conserva si la lectura no
+        lo incluyó (se compara por id_comprobante). Invalida las respuestas
+        cacheadas de esos meses.
+        """
+        rangos = [_rango_mes(mes) for mes in meses]
+        self._recarga = (rangos, [])
+        try:
+            filas = []
+            for mes in meses:
+                parametros = {"inicio": datetime.combine(mes, datetime.min.time()), "fin": datetime.combine(_mes_siguiente(mes), datetime.min.time())}
+                filas.extend((await db.execute(_FILAS_RANGO, parametros)).all())
+        finally:
+            _, durante = self._recarga
+            self._recarga = None
+        if self.columnas is None:
+            return
+
+        self._consolidar()
+        leidas = self._arreglos(filas)
+        durante = self._arreglos(durante)
+        nuevas = _concatenar([leidas, _filtrar(durante, ~np.isin(durante["id"], leidas["id"]))])
+
+        conservar = np.ones(len(self.columnas["fecha"]), dtype=bool)
+        for desde, hasta in np.searchsorted(self.columnas["fecha"], np.array(rangos, dtype="int64")):
+            conservar[desde:hasta] = False
+        self.columnas = _filtrar(self.columnas, conservar)
+        self._fusionar(nuevas)
+        self.recargas += 1
+        self.desfasados.difference_update(meses)
+        # Las respuestas cacheadas de esos meses se calcularon con las filas anteriores
+        await cache_respuestas.invalidar(cambios(
+            [(datetime.combine(mes, datetime.min.time()), datetime.combine(_mes_siguiente(mes), datetime.min.time())) for mes in meses],
+            None, None
+        ))
+
+    async def reparar(self, db):
+        """
+        Recarga los meses que no coinciden con el resumen diario; si después de
+        recargarlos siguen sin coincidir, el desfase está en el resumen (ver
+        scripts/reconstruir_resumen.py) y no se vuelven a recargar mientras no cambie.
+        :return: Meses recargados.
+        """
+        meses = await self.verificar(db)
+        if not meses:
+            return []
+        await self.recargar_meses(db, meses)
+        esperados = {mes: (int(cantidad), float(suma)) for mes, cantidad, suma in (await db.execute(_TOTALES_POR_MES)).all()}
+        for mes in await self.verificar(db):
+            logger.warning("El resumen diario no coincide con cfd_comprobante en %s", f"{mes:%Y-%m}")
+            self.aceptados[mes] = esperados.get(mes, (0, 0.0))
+        # Ya recargados, el snapshot coincide con cfd_comprobante: vuelven a consultarse aquí
+        self.desfasados.clear()
+        return meses
+
+    def metricas(self):
+        return {
+            "activo": self.columnas is not None,
+            "origen": self.origen,
+            "filas": self.filas(),
+            "pendientes": self.n_pendientes,
+            "memoria_mb": round(self.filas() * BYTES_POR_FILA / 1024 / 1024, 1),
+            "presupuesto_mb": SNAPSHOT_MEMORIA_MB,
+            "recargas": self.recargas,
+            "consultas": self.consultas,
+            "meses_aceptados_con_diferencia": sorted(f"{mes:%Y-%m}" for mes in self.aceptados),
+            "meses_desfasados": sorted(f"{mes:%Y-%m}" for mes in self.desfasados)
+        }
+
+
+snapshot_analisis = SnapshotColumnar()
+_tareas = []
+
+Medidor("snapshot_filas", "Comprobantes en el snapshot de análisis en memoria", funcion=snapshot_analisis.filas)
+
+
+async def _verificar_periodicamente():
+    while True:
+        await asyncio.sleep(SNAPSHOT_VERIFICAR_SEGUNDOS)
+        if not snapshot_analisis.disponible():
+            continue
+        try:
+            async with async_session() as db:
+                meses = await snapshot_analisis.reparar(db)
+            if meses:
+                logger.info("Snapshot: meses recargados %s", [f"{mes:%Y-%m}" for mes in meses])
+        except Exception:
+            logger.exception("Falló la verificación del snapshot de análisis")
+
+
+async def iniciar_snapshot():
+    """
+    Con SNAPSHOT_ANALISIS activo abre el snapshot en disco (y recarga los meses
+    que cambiaron desde que se guardó) o lo carga desde Postgres, y arranca la
+    verificación periódica. Se llama al iniciar la aplicación.
+    """
+    if not SNAPSHOT_ANALISIS:
+        return
+    _importar_numpy()
+    async with async_session() as db:
+        abierto = False
+        if SNAPSHOT_ARCHIVO and os.path.exists(SNAPSHOT_ARCHIVO):
+            try:
+                abierto = snapshot_analisis.abrir(SNAPSHOT_ARCHIVO)
+            except (OSError, ValueError, KeyError):
+                logger.exception("No se pudo abrir el snapshot %s; se carga desde Postgres", SNAPSHOT_ARCHIVO)
+        if abierto:
+            await snapshot_analisis.reparar(db)
+        else:
+            await snapshot_analisis.cargar(db)
+    _tareas.append(asyncio.create_task(_verificar_periodicamente()))
+
+
+async def detener_snapshot():
+    for tarea in _tareas:
+        tarea.cancel()
+    await asyncio.gather(*_tareas, return_exceptions=True)
+    _tareas.clear()
+    if snapshot_analisis.disponible() and SNAPSHOT_ARCHIVO:
+        await asyncio.to_thread(snapshot_analisis.guardar, SNAPSHOT_ARCHIVO)
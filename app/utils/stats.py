@@ -1,5 +1,22 @@
-import numpy as np
-from scipy import stats
+import math
+import os
+
+# Importar scipy/numpy en la precarga del arranque (o en el maestro de gunicorn
+# con preload) en lugar de hacerlo en la primera petición de análisis
+PRECARGA_ANALISIS = os.getenv("PRECARGA_ANALISIS", "false").lower() in ("1", "true", "si", "sí")
+
+# 📌 scipy y numpy se cargan al primer uso: importarlos al arrancar cuesta
+# segundos y decenas de MB en cada worker, aunque solo los usen los análisis
+def _stats():
+    from scipy import stats
+    return stats
+
+def precargar():
+    """
+    Importa scipy.stats y evalúa una distribución para dejar cargadas sus
+    extensiones; es idempotente.
+    """
+    _stats().f.sf(1.0, 1, 1)
 
 def calcular_estadisticas(datos):
     """
@@ -10,6 +27,9 @@ def calcular_estadisticas(datos):
     if not datos:
         return {"error": "Lista vacía, no se pueden calcular estadísticas."}
 
+    import numpy as np
+    stats = _stats()
+
     datos_np = np.array(datos)
     
     return {
@@ -18,4 +38,71 @@ def calcular_estadisticas(datos):
         "moda": stats.mode(datos_np, keepdims=False).mode,
         "varianza": np.var(datos_np),
         "desviacion_estandar": np.std(datos_np)
-    }
\ No newline at end of file
+    }
+
+def estadisticas_desde_resumen(resumen):
+    """
+    Da formato a la fila de agregados calculada por Postgres (ver consultas._resumen).
+    Produce las mismas llaves que calcular_estadisticas más los extremos y percentiles.
+    :param resumen: Mapping con cantidad, media, varianza, percentiles, moda, etc.
+    :return: Diccionario con las estadísticas descriptivas.
+    """
+    return {
+        "cantidad_registros": resumen["cantidad"],
+        "media": float(resumen["media"]),
+        "mediana": float(resumen["p50"]),
+        "moda": [float(resumen["moda"])],
+        "varianza": float(resumen["varianza"]),
+        "desviacion_estandar": float(resumen["desviacion_estandar"]),
+        "minimo": float(resumen["minimo"]),
+        "maximo": float(resumen["maximo"]),
+        "rango": float(resumen["maximo"] - resumen["minimo"]),
+        "percentiles": {
+            "25": float(resumen["p25"]),
+            "50": float(resumen["p50"]),
+            "75": float(resumen["p75"])
+        }
+    }
+
+def _finito(valor):
+    # NaN e infinito no son JSON válido
+    valor = float(valor) if valor is not None else None
+    return valor if valor is not None and math.isfinite(valor) else None
+
+def prueba_t_welch(grupo_a, grupo_b):
+    """
+    Prueba t de Welch a partir de n, media y varianza muestral de cada grupo;
+    equivale a stats.ttest_ind(a, b, equal_var=False) sobre los datos crudos.
+    :param grupo_a: Diccionario con n, media y varianza.
+    :param grupo_b: Diccionario con n, media y varianza.
+    :return: Diccionario con estadística y p-valor.
+    """
+    t_test = _stats().ttest_ind_from_stats(
+        float(grupo_a["media"]), float(grupo_a["varianza"]) ** 0.5, grupo_a["n"],
+        float(grupo_b["media"]), float(grupo_b["varianza"]) ** 0.5, grupo_b["n"],
+        equal_var=False
+    )
+    return {"statistica": _finito(t_test.statistic), "p_valor": _finito(t_test.pvalue)}
+
+def anova_desde_momentos(grupos):
+    """
+    ANOVA de un factor a partir de n, media y varianza muestral de cada grupo;
+    equivale a stats.f_oneway sobre los datos crudos. Un grupo con n = 1 no
+    tiene varianza muestral (None) y no aporta a la suma dentro de grupos,
+    pero cuenta en los grados de libertad, igual que en f_oneway.
+    :param grupos: Lista de diccionarios con n, media y varianza.
+    :return: Diccionario con estadística F, p-valor y grados de libertad.
+    """
+    total = sum(grupo["n"] for grupo in grupos)
+    media_global = sum(grupo["media"] * grupo["n"] for grupo in grupos) / total
+    entre = sum(grupo["n"] * (grupo["media"] - media_global) ** 2 for grupo in grupos)
+    dentro = sum((grupo["n"] - 1) * grupo["varianza"] for grupo in grupos if grupo["n"] > 1)
+    gl_entre = len(grupos) - 1
+    gl_dentro = total - len(grupos)
+    # Sin variación dentro de los grupos la estadística no está definida
+    estadistica = float(entre / gl_entre) / float(dentro / gl_dentro) if dentro > 0 else None
+    return {
+        "statistica": _finito(estadistica),
+        "p_valor": _finito(_stats().f.sf(estadistica, gl_entre, gl_dentro)) if estadistica is not None else None,
+        "grados_libertad": [gl_entre, gl_dentro]
+    }
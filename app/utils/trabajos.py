@@ -0,0 +1,475 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+
+from app.database.database import async_session
+from app.utils.ingesta import insertar_aislando
+from app.utils.lote import iterar_archivos, parsear_bloque
+from app.utils.metricas import Medidor
+
+# Directorio donde se guardan los XML y el estado de cada trabajo. Lo
+# comparten todos los workers de gunicorn, pero solo el que tiene el candado
+# procesa la cola; los demás dejan sus trabajos en entrantes/.
+TRABAJOS_DIRECTORIO = os.getenv("TRABAJOS_DIRECTORIO", "spool/trabajos")
+# Workers asyncio que vacían la cola
+TRABAJOS_WORKERS = int(os.getenv("TRABAJOS_WORKERS", 4))
+# Trabajos en cola a partir de los cuales se rechazan subidas nuevas (503)
+TRABAJOS_COLA_MAXIMA = int(os.getenv("TRABAJOS_COLA_MAXIMA", 10000))
+# Segundos que se piden al cliente en Retry-After cuando la cola está llena
+TRABAJOS_REINTENTAR_DESPUES = int(os.getenv("TRABAJOS_REINTENTAR_DESPUES", 30))
+# Trabajos que un worker toma de la cola para escribirlos en una transacción
+TRABAJOS_TAMANO_GRUPO = int(os.getenv("TRABAJOS_TAMANO_GRUPO", 100))
+TRABAJOS_REINTENTOS = int(os.getenv("TRABAJOS_REINTENTOS", 5))
+# Segundos antes del primer reintento; se duplica en cada intento
+TRABAJOS_ESPERA_REINTENTO = float(os.getenv("TRABAJOS_ESPERA_REINTENTO", 2))
+# Horas que se conserva el estado de los trabajos terminados
+TRABAJOS_RETENCION_HORAS = float(os.getenv("TRABAJOS_RETENCION_HORAS", 24))
+# Segundos entre revisiones de entrantes/ y del candado
+TRABAJOS_INTERVALO = float(os.getenv("TRABAJOS_INTERVALO", 0.5))
+
+logger = logging.getLogger("app.trabajos")
+
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+COMPLETADO = "completado"
+DUPLICADO = "duplicado"
+ERROR = "error"
+TERMINADOS = {COMPLETADO, DUPLICADO, ERROR}
+
+_ID = re.compile(r"^[0-9a-f]{32}$")
+
+_cola = None
+_workers = []
+# Archivo con el candado del proceso que procesa la cola, o None
+_candado = None
+# Ids en la cola o en proceso, para no encolar dos veces el mismo trabajo
+_en_cola = set()
+# Reintentos programados: id_trabajo -> TimerHandle
+_reintentos = {}
+
+
+Medidor("trabajos_en_cola", "Trabajos de ingesta esperando un worker", funcion=lambda: _cola.qsize() if _cola is not None else 0)
+
+
+class ColaLlena(Exception):
+    """La cola de ingesta está llena; el cliente debe reintentar más tarde."""
+
+
+def _ahora():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _ruta(nombre):
+    return os.path.join(TRABAJOS_DIRECTORIO, nombre)
+
+
+def _escribir(ruta, contenido: bytes):
+    # Escritura atómica y durable: un reinicio nunca deja archivos a medias
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "wb") as archivo:
+        archivo.write(contenido)
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(temporal, ruta)
+
+
+def _leer(id_trabajo):
+    try:
+        with open(_ruta(f"{id_trabajo}.json"), "rb") as archivo:
+            return json.load(archivo)
+    except FileNotFoundError:
+        return None
+
+
+def _guardar(trabajo):
+    trabajo["actualizado"] = _ahora()
+    _escribir(_ruta(f"{trabajo['id']}.json"), json.dumps(trabajo).encode())
+    if trabajo["estado"] in TERMINADOS:
+        # El XML ya no hace falta; el estado se conserva para consultarlo
+        try:
+            os.remove(_ruta(f"{trabajo['id']}.xml"))
+        except FileNotFoundError:
+            pass
+
+
+def _guardar_spool(uploads):
+    """
+    Copia al directorio de trabajos cada XML subido (también los de los ZIP).
+    El XML se escribe antes que su estado, así que al recuperar nunca hay
+    estado sin XML.
+    :return: Diccionario del lote con sus trabajos.
+    """
+    id_lote = uuid.uuid4().hex
+    trabajos = []
+    for nombre, contenido in iterar_archivos(uploads):
+        trabajo = {
+            "id": uuid.uuid4().hex,
+            "id_lote": id_lote,
+            "archivo": nombre,
+            "estado": PENDIENTE,
+            "intentos": 0,
+            "creado": _ahora(),
+        }
+        _escribir(_ruta(f"{trabajo['id']}.xml"), contenido)
+        _guardar(trabajo)
+        # Aviso para el proceso que tiene la cola, sea este u otro worker
+        open(_ruta(os.path.join("entrantes", trabajo["id"])), "wb").close()
+        trabajos.append(trabajo)
+
+    lote = {"id_lote": id_lote, "creado": _ahora(), "trabajos": [trabajo["id"] for trabajo in trabajos]}
+    _escribir(_ruta(os.path.join("lotes", f"{id_lote}.json")), json.dumps(lote).encode())
+    return {"id_lote": id_lote, "trabajos": [{"id": t["id"], "archivo": t["archivo"]} for t in trabajos]}
+
+
+def _purgar_antiguos():
+    # Estado de trabajos y lotes terminados hace más de TRABAJOS_RETENCION_HORAS,
+    # y temporales de escrituras que no terminaron
+    limite = time.time() - TRABAJOS_RETENCION_HORAS * 3600
+    for directorio in (TRABAJOS_DIRECTORIO, _ruta("lotes")):
+        for entrada in os.scandir(directorio):
+            if not entrada.name.endswith((".json", ".tmp")) or entrada.stat().st_mtime >= limite:
+                continue
+            if directorio == TRABAJOS_DIRECTORIO and entrada.name.endswith(".json"):
+                trabajo = _leer(entrada.name[:-5])
+                if trabajo is None or trabajo["estado"] not in TERMINADOS:
+                    continue
+            os.remove(entrada.path)
+
+
+def _recuperar():
+    """
+    Lee el directorio de trabajos al iniciar. Los trabajos que quedaron
+    pendientes o a medio procesar vuelven a la cola. Reprocesarlos es seguro
+    porque la cola solo acepta CFDI timbrados y la ingesta omite los UUID ya
+    registrados; un CFDI sin UUID no tendría con qué detectarse como repetido.
+    :return: Lista de ids por encolar, en orden de llegada.
+    """
+    _purgar_antiguos()
+
+    recuperados = []
+    for entrada in os.scandir(TRABAJOS_DIRECTORIO):
+        if not entrada.name.endswith(".json"):
+            continue
+        trabajo = _leer(entrada.name[:-5])
+        if trabajo is None or trabajo["estado"] in TERMINADOS:
+            continue
+        if trabajo["intentos"] >= TRABAJOS_REINTENTOS:
+            trabajo |= {"estado": ERROR, "error": "Se agotaron los reintentos."}
+        else:
+            trabajo["estado"] = PENDIENTE
+            recuperados.append(trabajo)
+        _guardar(trabajo)
+    return [trabajo["id"] for trabajo in sorted(recuperados, key=lambda t: t["creado"])]
+
+
+def _preparar_directorio():
+    os.makedirs(_ruta("lotes"), exist_ok=True)
+    os.makedirs(_ruta("entrantes"), exist_ok=True)
+
+
+def _tomar_candado():
+    """
+    Intenta ser el proceso que procesa la cola. El sistema operativo libera
+    el candado si el proceso muere, y otro worker lo toma.
+    :return: Archivo que mantiene el candado, o None si otro proceso lo tiene.
+    """
+    archivo = open(_ruta(".propietario"), "a")
+    try:
+        fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        archivo.close()
+        return None
+    return archivo
+
+
+def _contar_entrantes():
+    return len(os.listdir(_ruta("entrantes")))
+
+
+def _tomar_entrantes(limite):
+    """
+    Retira de entrantes/ hasta limite avisos, los más antiguos primero. Si el
+    proceso muere después, el trabajo sigue pendiente en disco y se recupera.
+    :return: Lista de ids de trabajo.
+    """
+    avisos = sorted(os.scandir(_ruta("entrantes")), key=lambda entrada: entrada.stat().st_mtime)[:limite]
+    for aviso in avisos:
+        os.remove(aviso.path)
+    return [aviso.name for aviso in avisos]
+
+
+def _tomar(ids):
+    """
+    Marca como en proceso los trabajos de un grupo y lee sus XML.
+    :return: Lista de tuplas (trabajo, contenido).
+    """
+    tomados = []
+    for id_trabajo in ids:
+        trabajo = _leer(id_trabajo)
+        if trabajo is None or trabajo["estado"] in TERMINADOS:
+            continue
+        try:
+            with open(_ruta(f"{id_trabajo}.xml"), "rb") as archivo:
+                contenido = archivo.read()
+        except FileNotFoundError:
+            _guardar(trabajo | {"estado": ERROR, "error": "El XML ya no está en el directorio de trabajos."})
+            continue
+        trabajo["estado"] = PROCESANDO
+        trabajo["intentos"] += 1
+        _guardar(trabajo)
+        tomados.append((trabajo, contenido))
+    return tomados
+
+
+def _encolar_id(id_trabajo):
+    if id_trabajo in _en_cola:
+        return
+    _en_cola.add(id_trabajo)
+    _cola.put_nowait(id_trabajo)
+
+
+def _reencolar(id_trabajo):
+    _reintentos.pop(id_trabajo, None)
+    _encolar_id(id_trabajo)
+
+
+def _fallar(trabajos, error):
+    """
+    Marca un fallo en los trabajos; los que tienen intentos disponibles
+    vuelven a pendiente.
+    :return: Lista de tuplas (id_trabajo, segundos de espera) por reencolar.
+    """
+    reintentar = []
+    for trabajo in trabajos:
+        trabajo["error"] = error
+        if trabajo["intentos"] >= TRABAJOS_REINTENTOS:
+            trabajo["estado"] = ERROR
+            continue
+        trabajo["estado"] = PENDIENTE
+        # Espera exponencial: 1x, 2x, 4x... TRABAJOS_ESPERA_REINTENTO
+        reintentar.append((trabajo["id"], TRABAJOS_ESPERA_REINTENTO * 2 ** (trabajo["intentos"] - 1)))
+    return reintentar
+
+
+def _guardar_todos(trabajos):
+    for trabajo in trabajos:
+        _guardar(trabajo)
+
+
+async def _procesar(ids):
+    tomados = await asyncio.to_thread(_tomar, ids)
+    if not tomados:
+        return
+    trabajos = {trabajo["id"]: trabajo for trabajo, _ in tomados}
+
+    reintentar = []
+    try:
+        # El nombre que ve el parser es el id del trabajo
+        resultados = await parsear_bloque([(trabajo["id"], contenido) for trabajo, contenido in tomados])
+        validos = []
+        for id_trabajo, cfdi, error in resultados:
+            # Un XML inválido no mejora al reintentar
+            if error is not None:
+                trabajos[id_trabajo] |= {"estado": ERROR, "error": error}
+            elif cfdi["comprobante"]["uuid"] is None:
+                trabajos[id_trabajo] |= {"estado": ERROR, "error": "El CFDI no está timbrado (no tiene UUID)."}
+            else:
+                validos.append((trabajos[id_trabajo], cfdi))
+
+        resultados_insercion = []
+        if validos:
+            async with async_session() as db:
+                resultados_insercion = await insertar_aislando(db, [cfdi for _, cfdi in validos])
+        for (trabajo, cfdi), resultado in zip(validos, resultados_insercion):
+            if isinstance(resultado, Exception):
+                reintentar += _fallar([trabajo], str(resultado) or repr(resultado))
+                continue
+            trabajo |= {
+                "estado": COMPLETADO if resultado is not None else DUPLICADO,
+                "id_comprobante": resultado,
+                "uuid": cfdi["comprobante"]["uuid"],
+                "error": None
+            }
+    except Exception as e:
+        en_proceso = [trabajo for trabajo in trabajos.values() if trabajo["estado"] == PROCESANDO]
+        reintentar += _fallar(en_proceso, str(e) or repr(e))
+
+    await asyncio.to_thread(_guardar_todos, trabajos.values())
+    _programar(reintentar)
+
+
+def _programar(reintentar):
+    loop = asyncio.get_running_loop()
+    for id_trabajo, espera in reintentar:
+        _reintentos[id_trabajo] = loop.call_later(espera, _reencolar, id_trabajo)
+
+
+def _fallar_grupo(ids, error):
+    """
+    Cuenta un fallo en los trabajos de un grupo que no se pudo procesar por un
+    error ajeno a sus XML (spool ilegible, disco lleno...). Los que no llegaron
+    a tomarse también suman el intento, para que no se reintenten sin fin.
+    :return: Lista de tuplas (id_trabajo, segundos de espera) por reencolar.
+    """
+    reintentar = []
+    for id_trabajo in ids:
+        try:
+            trabajo = _leer(id_trabajo)
+        except ValueError:
+            logger.error("Estado ilegible del trabajo %s; se deja sin procesar", id_trabajo)
+            continue
+        if trabajo is None or trabajo["estado"] in TERMINADOS:
+            continue
+        if trabajo["estado"] != PROCESANDO:
+            trabajo["intentos"] += 1
+        reintentar += _fallar([trabajo], error)
+        _guardar(trabajo)
+    return reintentar
+
+
+async def _worker():
+    while True:
+        # Toma lo que haya en la cola, hasta TRABAJOS_TAMANO_GRUPO, para escribirlo junto
+        grupo = [await _cola.get()]
+        while len(grupo) < TRABAJOS_TAMANO_GRUPO and not _cola.empty():
+            grupo.append(_cola.get_nowait())
+        try:
+            await _procesar(grupo)
+        except Exception as e:
+            logger.exception("Falló el grupo de %d trabajos de ingesta", len(grupo))
+            try:
+                _programar(await asyncio.to_thread(_fallar_grupo, grupo, str(e) or repr(e)))
+            except Exception:
+                # Ni siquiera se pudo escribir el spool: los trabajos siguen en
+                # disco y se retoman al reiniciar
+                logger.exception("No se pudo registrar el fallo de los trabajos %s", grupo)
+        finally:
+            for id_trabajo in grupo:
+                _en_cola.discard(id_trabajo)
+                _cola.task_done()
+
+
+async def _limpieza():
+    while True:
+        await asyncio.sleep(3600)
+        await asyncio.to_thread(_purgar_antiguos)
+
+
+async def _coordinar():
+    """
+    Mientras otro proceso tenga el candado solo lo reintenta. Al obtenerlo
+    recupera los trabajos sin terminar, arranca los workers y desde entonces
+    pasa a la cola los avisos de entrantes/ mientras haya lugar.
+    """
+    global _candado
+    while True:
+        if _candado is None:
+            _candado = await asyncio.to_thread(_tomar_candado)
+            if _candado is not None:
+                for id_trabajo in await asyncio.to_thread(_recuperar):
+                    _encolar_id(id_trabajo)
+                _workers.extend(asyncio.create_task(_worker()) for _ in range(TRABAJOS_WORKERS))
+                _workers.append(asyncio.create_task(_limpieza()))
+
+        if _candado is not None and _cola.qsize() < TRABAJOS_COLA_MAXIMA:
+            for id_trabajo in await asyncio.to_thread(_tomar_entrantes, TRABAJOS_COLA_MAXIMA - _cola.qsize()):
+                _encolar_id(id_trabajo)
+
+        await asyncio.sleep(TRABAJOS_INTERVALO)
+
+
+async def iniciar_trabajos():
+    """
+    Crea la cola y arranca el coordinador; el worker de gunicorn que obtiene
+    el candado retoma los trabajos sin terminar y procesa la cola. Se llama
+    al iniciar la aplicación.
+    """
+    global _cola
+    _cola = asyncio.Queue()
+    await asyncio.to_thread(_preparar_directorio)
+    _workers.append(asyncio.create_task(_coordinar()))
+
+
+async def detener_trabajos():
+    # Lo que quede en cola o a medias sigue en disco para el siguiente arranque
+    global _candado
+    for handle in _reintentos.values():
+        handle.cancel()
+    _reintentos.clear()
+    for tarea in _workers:
+        tarea.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _en_cola.clear()
+    if _candado is not None:
+        _candado.close()
+        _candado = None
+
+
+async def encolar(uploads):
+    """
+    Guarda los archivos subidos en el directorio de trabajos y avisa al
+    proceso que tiene la cola.
+    :param uploads: Lista de UploadFile (XML o ZIP con XML).
+    :return: Diccionario con id_lote y los trabajos creados.
+    :raises ColaLlena: Si hay TRABAJOS_COLA_MAXIMA trabajos esperando.
+    """
+    pendientes = await asyncio.to_thread(_contar_entrantes) + (_cola.qsize() if _candado is not None else 0)
+    if pendientes >= TRABAJOS_COLA_MAXIMA:
+        raise ColaLlena("La cola de ingesta está llena, intente más tarde.")
+    return await asyncio.to_thread(_guardar_spool, uploads)
+
+
+async def estado_trabajo(id_trabajo: str):
+    """
+    :return: Estado guardado del trabajo, o None si no existe.
+    """
+    if not _ID.match(id_trabajo):
+        return None
+    return await asyncio.to_thread(_leer, id_trabajo)
+
+
+def _leer_lote(id_lote):
+    try:
+        with open(_ruta(os.path.join("lotes", f"{id_lote}.json")), "rb") as archivo:
+            lote = json.load(archivo)
+    except FileNotFoundError:
+        return None
+    # Un trabajo purgado por antigüedad ya había terminado
+    trabajos = [_leer(id_trabajo) or {"id": id_trabajo, "estado": "purgado"} for id_trabajo in lote["trabajos"]]
+    conteos = {}
+    for trabajo in trabajos:
+        conteos[trabajo["estado"]] = conteos.get(trabajo["estado"], 0) + 1
+    return {
+        "id_lote": id_lote,
+        "creado": lote["creado"],
+        "total": len(trabajos),
+        "terminado": not (conteos.get(PENDIENTE) or conteos.get(PROCESANDO)),
+        "conteos": conteos,
+        "trabajos": trabajos
+    }
+
+
+async def estado_lote(id_lote: str):
+    """
+    :return: Conteos por estado y estado de cada trabajo del lote, o None si no existe.
+    """
+    if not _ID.match(id_lote):
+        return None
+    return await asyncio.to_thread(_leer_lote, id_lote)
+
+
+def metricas():
+    return {
+        "en_cola": _cola.qsize() if _cola is not None else 0,
+        "esperando_reintento": len(_reintentos),
+        "procesa_la_cola": _candado is not None,
+        "cola_maxima": TRABAJOS_COLA_MAXIMA,
+        "workers": TRABAJOS_WORKERS
+    }
@@ -0,0 +1,106 @@
+"""
+Tiempo de importación y memoria (RSS máxima) de la aplicación al arrancar un
+worker, sin y con la precarga de scipy, y qué módulos pesados quedan cargados.
+Cada medición corre en un proceso nuevo; no necesita base de datos.
+
+Con --guardar se escribe la línea base en JSON; con --comparar se compara
+contra ella y el proceso termina con código 1 si algún escenario empeora más
+que la tolerancia (para CI).
+
+Uso:
+    python -m benchmarks.bench_arranque --repeticiones 5 --guardar arranque.json
+    python -m benchmarks.bench_arranque --comparar arranque.json --tolerancia 0.2
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULOS_PESADOS = ("numpy", "scipy", "sklearn", "pyarrow", "pandas")
+
+ESCENARIOS = {
+    "app": "import app.app",
+    "app+precarga": "import app.app; from app.utils.stats import precargar; precargar()",
+}
+
+# Se ejecuta en el proceso hijo; imprime una línea JSON
+_MEDICION = """
+import json, resource, sys, time
+inicio = time.perf_counter()
+{codigo}
+segundos = time.perf_counter() - inicio
+print(json.dumps({{
+    "segundos": segundos,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modulos": len(sys.modules),
+    "pesados": sorted(m for m in {pesados!r} if m in sys.modules),
+}}))
+"""
+
+
+def medir(codigo):
+    salida = subprocess.run(
+        [sys.executable, "-c", _MEDICION.format(codigo=codigo, pesados=MODULOS_PESADOS)],
+        capture_output=True, text=True, check=True, env=os.environ | {"PRECARGA_ANALISIS": "false"}
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def medir_escenario(codigo, repeticiones):
+    # La primera corrida calienta la cache de bytecode y del sistema de archivos
+    medir(codigo)
+    corridas = [medir(codigo) for _ in range(repeticiones)]
+    return {
+        "ms_mediana": round(statistics.median(c["segundos"] for c in corridas) * 1000, 1),
+        "rss_mb_mediana": round(statistics.median(c["rss_mb"] for c in corridas), 1),
+        "modulos": corridas[-1]["modulos"],
+        "pesados": corridas[-1]["pesados"],
+    }
+
+
+def comparar(base, actual, tolerancia):
+    regresiones = []
+    for escenario, medicion in actual.items():
+        if escenario not in base:
+            continue
+        for metrica in ("ms_mediana", "rss_mb_mediana"):
+            antes, ahora = base[escenario][metrica], medicion[metrica]
+            cambio = (ahora - antes) / antes if antes else 0
+            marca = "REGRESION" if cambio > tolerancia else "ok"
+            print(f"  {escenario:<14} {metrica:<15} {antes:>9} -> {ahora:>9} ({cambio:+.1%}) {marca}")
+            if cambio > tolerancia:
+                regresiones.append((escenario, metrica))
+        nuevos = set(medicion["pesados"]) - set(base[escenario]["pesados"])
+        if nuevos:
+            print(f"  {escenario:<14} módulos pesados nuevos al arrancar: {sorted(nuevos)} REGRESION")
+            regresiones.append((escenario, "pesados"))
+    return regresiones
+
+
+def main(args):
+    resultados = {}
+    for escenario, codigo in ESCENARIOS.items():
+        resultados[escenario] = medir_escenario(codigo, args.repeticiones)
+        print(f"{escenario}: {resultados[escenario]}")
+
+    if args.guardar:
+        with open(args.guardar, "w") as archivo:
+            json.dump(resultados, archivo, indent=2)
+
+    if args.comparar:
+        with open(args.comparar) as archivo:
+            base = json.load(archivo)
+        print(f"Comparación contra {args.comparar} (tolerancia {args.tolerancia:.0%}):")
+        if comparar(base, resultados, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--guardar", help="Archivo JSON donde guardar la línea base")
+    parser.add_argument("--comparar", help="Línea base JSON contra la cual comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Empeoramiento relativo permitido")
+    main(parser.parse_args())
@@ -0,0 +1,97 @@
+"""
+Prueba de carga de /auth/token: lanza inicios de sesión concurrentes contra
+un servidor en marcha y reporta latencias p50/p95/p99.
+
+Para comparar antes y después, correr el mismo comando contra el servidor
+levantado en cada versión (conexión por petición vs. pool compartido).
+Requiere httpx.
+
+Uso:
+    python -m benchmarks.bench_login --url http://localhost:8000 \\
+        --concurrencia 50 --peticiones 2000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentil(valores, q):
+    ordenados = sorted(valores)
+    return ordenados[min(int(q * len(ordenados)), len(ordenados) - 1)]
+
+
+async def preparar_usuario(cliente, usuario, password):
+    # 400 significa que el usuario ya existe de una corrida anterior
+    respuesta = await cliente.post("/auth/signup", json={
+        "username": usuario, "email": f"{usuario}@benchmark.local", "password": password
+    })
+    if respuesta.status_code not in (200, 400):
+        respuesta.raise_for_status()
+
+
+async def trabajador(cliente, cola, credenciales, latencias, errores):
+    while True:
+        try:
+            cola.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        inicio = time.perf_counter()
+        try:
+            respuesta = await cliente.post("/auth/token", json=credenciales)
+            if respuesta.status_code != 200:
+                errores[respuesta.status_code] = errores.get(respuesta.status_code, 0) + 1
+                continue
+        except httpx.HTTPError as e:
+            errores[type(e).__name__] = errores.get(type(e).__name__, 0) + 1
+            continue
+        latencias.append((time.perf_counter() - inicio) * 1000)
+
+
+async def main(args):
+    credenciales = {"username": args.usuario, "password": args.password}
+    limites = httpx.Limits(max_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=args.url, limits=limites, timeout=args.timeout) as cliente:
+        await preparar_usuario(cliente, args.usuario, args.password)
+
+        cola = asyncio.Queue()
+        for _ in range(args.peticiones):
+            cola.put_nowait(None)
+        latencias = []
+        errores = {}
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(
+            trabajador(cliente, cola, credenciales, latencias, errores) for _ in range(args.concurrencia)
+        ))
+        segundos = time.perf_counter() - inicio
+
+        metricas_pool = None
+        respuesta = await cliente.get("/auth/metricas")
+        if respuesta.status_code == 200:
+            metricas_pool = respuesta.json()
+
+    print(f"peticiones={args.peticiones} concurrencia={args.concurrencia}")
+    if latencias:
+        print(f"  exitosas: {len(latencias)} en {segundos:.2f} s ({len(latencias) / segundos:.1f} por segundo)")
+        print(f"  media: {statistics.mean(latencias):.2f} ms")
+        print(f"  p50: {percentil(latencias, 0.50):.2f} ms")
+        print(f"  p95: {percentil(latencias, 0.95):.2f} ms")
+        print(f"  p99: {percentil(latencias, 0.99):.2f} ms")
+    if errores:
+        print(f"  errores: {errores}")
+    if metricas_pool is not None:
+        print(f"  pool: {metricas_pool}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--peticiones", type=int, default=2000)
+    parser.add_argument("--usuario", default="benchmark_login")
+    parser.add_argument("--password", default="benchmark_login")
+    parser.add_argument("--timeout", type=float, default=30)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark del parser incremental de CFDI contra el camino con xmltodict
+(decode + replace("cfdi:", "") + xmltodict.parse) en facturas pequeñas,
+medianas y muy grandes. Reporta tiempo y memoria pico (tracemalloc).
+
+Uso:
+    python -m benchmarks.bench_parser --conceptos 10 500 10000 --repeticiones 5
+"""
+import argparse
+import io
+import statistics
+import time
+import tracemalloc
+
+import xmltodict
+
+from app.utils.cfdi_parser import iterar_cfdi, parsear_cfdi
+
+CONCEPTO = (
+    '<cfdi:Concepto ClaveProdServ="01010101" NoIdentificacion="{i}" Cantidad="1" ClaveUnidad="H87" '
+    'Descripcion="Concepto {i}" ValorUnitario="100.00" Importe="100.00" ObjetoImp="02">'
+    '<cfdi:Impuestos><cfdi:Traslados>'
+    '<cfdi:Traslado Base="100.00" Impuesto="002" TipoFactor="Tasa" TasaOCuota="0.160000" Importe="16.00"/>'
+    '</cfdi:Traslados></cfdi:Impuestos></cfdi:Concepto>'
+)
+
+
+def factura_xml(num_conceptos):
+    conceptos = "".join(CONCEPTO.format(i=i) for i in range(num_conceptos))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" Version="4.0" Serie="B" Folio="1" '
+        f'Fecha="2024-01-01T12:00:00" SubTotal="{100 * num_conceptos}.00" Moneda="MXN" '
+        f'Total="{116 * num_conceptos}.00" TipoDeComprobante="I" Exportacion="01" LugarExpedicion="01000">'
+        '<cfdi:Emisor Rfc="AAA010101AAA" Nombre="Emisor Benchmark" RegimenFiscal="601"/>'
+        '<cfdi:Receptor Rfc="XAXX010101000" Nombre="Receptor Benchmark" DomicilioFiscalReceptor="01000" '
+        'RegimenFiscalReceptor="616" UsoCFDI="G03"/>'
+        f'<cfdi:Conceptos>{conceptos}</cfdi:Conceptos>'
+        f'<cfdi:Impuestos TotalImpuestosTrasladados="{16 * num_conceptos}.00"><cfdi:Traslados>'
+        f'<cfdi:Traslado Base="{100 * num_conceptos}.00" Impuesto="002" TipoFactor="Tasa" '
+        f'TasaOCuota="0.160000" Importe="{16 * num_conceptos}.00"/>'
+        '</cfdi:Traslados></cfdi:Impuestos></cfdi:Comprobante>'
+    ).encode("utf-8")
+
+
+def camino_xmltodict(contenido):
+    return xmltodict.parse(contenido.decode("utf-8").replace("cfdi:", ""))
+
+
+def camino_incremental(contenido):
+    # Solo recorre los registros: la memoria no depende del número de conceptos
+    for _ in iterar_cfdi(io.BytesIO(contenido)):
+        pass
+
+
+def camino_ingesta(contenido):
+    # parsear_cfdi además acumula los conceptos para insertarlos
+    return parsear_cfdi(io.BytesIO(contenido))
+
+
+def medir(funcion, contenido, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(contenido)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+
+    tracemalloc.start()
+    funcion(contenido)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"mediana_ms": round(statistics.median(tiempos), 2), "memoria_pico_kb": round(pico / 1024, 1)}
+
+
+def main(args):
+    for num_conceptos in args.conceptos:
+        contenido = factura_xml(num_conceptos)
+        print(f"conceptos={num_conceptos} ({len(contenido) / 1024:.0f} KB)")
+        print(f"  xmltodict:   {medir(camino_xmltodict, contenido, args.repeticiones)}")
+        print(f"  incremental: {medir(camino_incremental, contenido, args.repeticiones)}")
+        print(f"  ingesta:     {medir(camino_ingesta, contenido, args.repeticiones)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conceptos", type=int, nargs="+", default=[10, 500, 10000])
+    parser.add_argument("--repeticiones", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,199 @@
+"""
+Generador determinista de CFDI 4.0 sintéticos para benchmarks: misma semilla,
+mismos XML byte por byte. Se configuran los conceptos por factura, los
+traslados por concepto, cuántos emisores y receptores distintos hay y el
+rango de fechas. Cada factura lleva su TimbreFiscalDigital con un UUID
+derivado de la semilla.
+
+Uso:
+    python -m benchmarks.generador_cfdi --facturas 1000 --zip facturas.zip
+    python -m benchmarks.generador_cfdi --facturas 50 --conceptos 1 200 --emisores 5 --directorio xml/
+"""
+import argparse
+import io
+import os
+import random
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from xml.sax.saxutils import quoteattr
+
+NAMESPACES = (
+    'xmlns:cfdi="http://www.sat.gob.mx/cfd/4" '
+    'xmlns:tfd="http://www.sat.gob.mx/TimbreFiscalDigital" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+)
+
+# (Impuesto, TasaOCuota): IVA 16%, IVA 8% (frontera) e IEPS 8%
+TRASLADOS = (("002", Decimal("0.160000")), ("002", Decimal("0.080000")), ("003", Decimal("0.080000")))
+# Proporción de ingresos, egresos y traslados, aproximada a la de un emisor típico
+TIPOS = (("I", 0.85), ("E", 0.1), ("T", 0.05))
+CLAVES_PROD_SERV = ("01010101", "43211503", "81112101", "50202306", "78101802", "84111506")
+CLAVES_UNIDAD = ("H87", "E48", "ACT", "KGM", "XBX")
+
+CENTAVO = Decimal("0.01")
+
+
+def _atributos(**valores):
+    return " ".join(f"{nombre}={quoteattr(str(valor))}" for nombre, valor in valores.items() if valor is not None)
+
+
+def rfc_emisor(indice):
+    return f"EMI{indice:06d}AB1"
+
+
+def rfc_receptor(indice):
+    return f"REC{indice:06d}CD2"
+
+
+class GeneradorCFDI:
+    """
+    :param semilla: Semilla del generador; fija todo el contenido.
+    :param conceptos: Tupla (mínimo, máximo) de conceptos por factura.
+    :param traslados: Traslados por concepto (1 a 3).
+    :param emisores: Número de emisores distintos; se eligen con sesgo (unos
+        pocos emisores concentran la mayoría de las facturas).
+    :param receptores: Número de receptores distintos.
+    :param desde: Fecha de la primera factura posible.
+    :param dias: Días sobre los que se reparten las fechas.
+    """
+
+    def __init__(self, semilla=0, conceptos=(1, 10), traslados=1, emisores=100, receptores=1000,
+                 desde=datetime(2024, 1, 1), dias=365):
+        self.semilla = semilla
+        self.conceptos = conceptos
+        self.traslados = max(1, min(traslados, len(TRASLADOS)))
+        self.emisores = emisores
+        self.receptores = receptores
+        self.desde = desde
+        self.dias = dias
+
+    def _importe(self, rng, minimo, maximo):
+        return Decimal(rng.randint(int(minimo * 100), int(maximo * 100))) / 100
+
+    def _rng(self, indice):
+        return random.Random(f"{self.semilla}:{indice}")
+
+    def _fecha(self, rng):
+        return self.desde + timedelta(seconds=rng.randrange(self.dias * 86400))
+
+    def fecha(self, indice):
+        """
+        :return: Fecha de la factura número indice, sin generar el XML.
+        """
+        return self._fecha(self._rng(indice))
+
+    def factura(self, indice):
+        """
+        Genera la factura número indice; no depende de las anteriores, así
+        que se puede generar en cualquier orden o en paralelo.
+        :return: Bytes del XML.
+        """
+        rng = self._rng(indice)
+        fecha = self._fecha(rng)
+        # Distribución de Pareto truncada: pocos emisores con muchas facturas
+        emisor = min(int(rng.paretovariate(1.2)) - 1, self.emisores - 1)
+        receptor = rng.randrange(self.receptores)
+        tipo = rng.choices([t for t, _ in TIPOS], weights=[p for _, p in TIPOS])[0]
+        folio_fiscal = uuid.UUID(int=rng.getrandbits(128), version=4)
+
+        conceptos_xml = []
+        subtotal = Decimal(0)
+        totales_traslado = {}
+        for numero in range(rng.randint(*self.conceptos)):
+            cantidad = Decimal(rng.randint(1, 20))
+            valor_unitario = self._importe(rng, 1, 5000)
+            importe = (cantidad * valor_unitario).quantize(CENTAVO)
+            subtotal += importe
+
+            traslados_xml = []
+            for impuesto, tasa in rng.sample(TRASLADOS, self.traslados):
+                importe_traslado = (importe * tasa).quantize(CENTAVO)
+                base, acumulado = totales_traslado.get((impuesto, tasa), (Decimal(0), Decimal(0)))
+                totales_traslado[(impuesto, tasa)] = (base + importe, acumulado + importe_traslado)
+                traslados_xml.append(f"<cfdi:Traslado {_atributos(Base=importe, Impuesto=impuesto, TipoFactor='Tasa', TasaOCuota=tasa, Importe=importe_traslado)}/>")
+
+            conceptos_xml.append(
+                f"<cfdi:Concepto {_atributos(ClaveProdServ=rng.choice(CLAVES_PROD_SERV), NoIdentificacion=f'SKU-{numero}', Cantidad=cantidad, ClaveUnidad=rng.choice(CLAVES_UNIDAD), Descripcion=f'Producto sintético {rng.randrange(10000)}', ValorUnitario=valor_unitario, Importe=importe, ObjetoImp='02')}>"
+                f"<cfdi:Impuestos><cfdi:Traslados>{''.join(traslados_xml)}</cfdi:Traslados></cfdi:Impuestos>"
+                "</cfdi:Concepto>"
+            )
+
+        total_traslados = sum((importe for _, importe in totales_traslado.values()), Decimal(0))
+        traslados_generales = "".join(
+            f"<cfdi:Traslado {_atributos(Base=base, Impuesto=impuesto, TipoFactor='Tasa', TasaOCuota=tasa, Importe=importe)}/>"
+            for (impuesto, tasa), (base, importe) in sorted(totales_traslado.items())
+        )
+
+        comprobante = _atributos(
+            Version="4.0", Serie="S", Folio=indice, Fecha=fecha.strftime("%Y-%m-%dT%H:%M:%S"),
+            SubTotal=subtotal, Moneda="MXN", Total=subtotal + total_traslados, TipoDeComprobante=tipo,
+            Exportacion="01", MetodoPago="PUE", LugarExpedicion=f"{rng.randrange(1000, 99999):05d}"
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            f"<cfdi:Comprobante {NAMESPACES} {comprobante}>"
+            f"<cfdi:Emisor {_atributos(Rfc=rfc_emisor(emisor), Nombre=f'Emisor Sintético {emisor}', RegimenFiscal='601')}/>"
+            f"<cfdi:Receptor {_atributos(Rfc=rfc_receptor(receptor), Nombre=f'Receptor Sintético {receptor}', DomicilioFiscalReceptor='01000', RegimenFiscalReceptor='616', UsoCFDI='G03')}/>"
+            f"<cfdi:Conceptos>{''.join(conceptos_xml)}</cfdi:Conceptos>"
+            f"<cfdi:Impuestos {_atributos(TotalImpuestosTrasladados=total_traslados)}><cfdi:Traslados>{traslados_generales}</cfdi:Traslados></cfdi:Impuestos>"
+            "<cfdi:Complemento>"
+            f"<tfd:TimbreFiscalDigital {_atributos(Version='1.1', UUID=folio_fiscal, FechaTimbrado=(fecha + timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%S'), RfcProvCertif='SAT970701NN3', NoCertificadoSAT='00001000000509846663')}/>"
+            "</cfdi:Complemento>"
+            "</cfdi:Comprobante>"
+        ).encode("utf-8")
+
+    def generar(self, cantidad, inicio=0):
+        """
+        :return: Generador de tuplas (nombre, contenido) de las facturas inicio .. inicio + cantidad - 1.
+        """
+        for indice in range(inicio, inicio + cantidad):
+            yield f"factura_{indice:07d}.xml", self.factura(indice)
+
+
+def zip_en_memoria(facturas):
+    # ZIP listo para subir a /procesar_xml/lote
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archivo_zip:
+        for nombre, contenido in facturas:
+            archivo_zip.writestr(nombre, contenido)
+    return buffer.getvalue()
+
+
+def main(args):
+    generador = GeneradorCFDI(
+        semilla=args.semilla, conceptos=tuple(args.conceptos), traslados=args.traslados,
+        emisores=args.emisores, receptores=args.receptores,
+        desde=datetime.strptime(args.desde, "%Y-%m-%d"), dias=args.dias
+    )
+    facturas = generador.generar(args.facturas)
+    if args.zip:
+        with open(args.zip, "wb") as archivo:
+            archivo.write(zip_en_memoria(facturas))
+    else:
+        os.makedirs(args.directorio, exist_ok=True)
+        for nombre, contenido in facturas:
+            with open(os.path.join(args.directorio, nombre), "wb") as archivo:
+                archivo.write(contenido)
+    print(f"{args.facturas} facturas generadas en {args.zip or args.directorio}")
+
+
+def agregar_argumentos(parser):
+    parser.add_argument("--facturas", type=int, default=1000)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--conceptos", type=int, nargs=2, default=[1, 10], metavar=("MIN", "MAX"))
+    parser.add_argument("--traslados", type=int, default=1, help="Traslados por concepto (1 a 3)")
+    parser.add_argument("--emisores", type=int, default=100)
+    parser.add_argument("--receptores", type=int, default=1000)
+    parser.add_argument("--desde", default="2024-01-01", help="Primera fecha (YYYY-MM-DD)")
+    parser.add_argument("--dias", type=int, default=365, help="Días sobre los que se reparten las fechas")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    agregar_argumentos(parser)
+    salida = parser.add_mutually_exclusive_group()
+    salida.add_argument("--zip", help="Escribir un ZIP con todas las facturas")
+    salida.add_argument("--directorio", default="facturas", help="Escribir un XML por factura")
+    main(parser.parse_args())
@@ -0,0 +1,42 @@
+"""
+Configuración de gunicorn con workers de uvicorn.
+
+Con preload la aplicación se importa una sola vez en el proceso maestro y
+los workers la heredan al hacer fork (copy-on-write): arrancan más rápido y
+comparten la memoria de los módulos. Con PRECARGA_ANALISIS también scipy se
+carga en el maestro.
+
+Uso:
+    gunicorn -c gunicorn.conf.py app.app:app
+    WEB_CONCURRENCY=8 GUNICORN_PRELOAD=false gunicorn -c gunicorn.conf.py app.app:app
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+# 📌 Un worker por omisión: /metrics, los caches RFC -> id y el snapshot de
+# análisis son por proceso, así que con varios workers cada scrape de
+# Prometheus ve solo el worker que lo atendió. El paralelismo del parseo lo da
+# el pool de procesos (INGESTA_PROCESOS); subir WEB_CONCURRENCY solo si las
+# métricas se recogen por worker.
+workers = int(os.getenv("WEB_CONCURRENCY", 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "si", "sí")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+# Reinicia cada worker tras N peticiones (0 = nunca), con variación para no reiniciarlos a la vez
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 0))
+
+# Cada worker tiene su propio pool de procesos para parsear XML; por omisión
+# se reparten los núcleos entre los workers en lugar de uno por núcleo en cada uno
+os.environ.setdefault("INGESTA_PROCESOS", str(max(1, multiprocessing.cpu_count() // workers)))
+
+
+def when_ready(server):
+    # Corre en el maestro antes de crear los workers
+    if preload_app:
+        from app.utils.stats import precargar, PRECARGA_ANALISIS
+        if PRECARGA_ANALISIS:
+            precargar()
@@ -0,0 +1,96 @@
+"""Esquema inicial de las tablas CFDI
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+Para una base de datos que ya tiene las tablas creadas, marcarla con
+`alembic stamp 0001` antes de `alembic upgrade head`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "cfd_emisor",
+        sa.Column("id_emisor", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("rfc", sa.String(15), nullable=False),
+        sa.Column("nombre", sa.String(255), nullable=False),
+        sa.Column("regimen_fiscal", sa.String(5), nullable=False),
+    )
+    op.create_table(
+        "cfd_receptor",
+        sa.Column("id_receptor", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("rfc", sa.String(15), nullable=False),
+        sa.Column("nombre", sa.String(255), nullable=False),
+        sa.Column("domicilio_fiscal", sa.String(10)),
+        sa.Column("regimen_fiscal", sa.String(5), nullable=False),
+        sa.Column("uso_cfdi", sa.String(5), nullable=False),
+    )
+    op.create_table(
+        "cfd_comprobante",
+        sa.Column("id_comprobante", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("version", sa.String(10), nullable=False),
+        sa.Column("serie", sa.String(50)),
+        sa.Column("folio", sa.String(50)),
+        sa.Column("fecha", sa.TIMESTAMP, nullable=False),
+        sa.Column("subtotal", sa.Numeric(19, 4), nullable=False),
+        sa.Column("descuento", sa.Numeric(19, 4)),
+        sa.Column("moneda", sa.String(10), nullable=False),
+        sa.Column("tipo_cambio", sa.Numeric(19, 6)),
+        sa.Column("total", sa.Numeric(19, 4), nullable=False),
+        sa.Column("tipo_de_comprobante", sa.String(1), nullable=False),
+        sa.Column("exportacion", sa.String(2)),
+        sa.Column("lugar_expedicion", sa.String(10)),
+        sa.Column("id_emisor", sa.Integer, sa.ForeignKey("cfd_emisor.id_emisor"), nullable=False),
+        sa.Column("id_receptor", sa.Integer, sa.ForeignKey("cfd_receptor.id_receptor"), nullable=False),
+        sa.Column("total_impuestos_trasladados", sa.Numeric(19, 4)),
+    )
+    op.create_table(
+        "cfd_concepto",
+        sa.Column("id_concepto", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("id_comprobante", sa.Integer, sa.ForeignKey("cfd_comprobante.id_comprobante"), nullable=False),
+        sa.Column("clave_prod_serv", sa.String(10), nullable=False),
+        sa.Column("cantidad", sa.Numeric(19, 4), nullable=False),
+        sa.Column("clave_unidad", sa.String(10), nullable=False),
+        sa.Column("descripcion", sa.String, nullable=False),
+        sa.Column("valor_unitario", sa.Numeric(19, 4), nullable=False),
+        sa.Column("importe", sa.Numeric(19, 4), nullable=False),
+        sa.Column("descuento", sa.Numeric(19, 4)),
+        sa.Column("objeto_imp", sa.String(2)),
+    )
+    op.create_table(
+        "cfd_impuesto_trasladado_concepto",
+        sa.Column("id_impuesto_trasladado_concepto", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("id_concepto", sa.Integer, sa.ForeignKey("cfd_concepto.id_concepto"), nullable=False),
+        sa.Column("base", sa.Numeric(19, 4), nullable=False),
+        sa.Column("impuesto", sa.String(3), nullable=False),
+        sa.Column("tipo_factor", sa.String(10), nullable=False),
+        sa.Column("tasa_o_cuota", sa.Numeric(19, 6)),
+        sa.Column("importe", sa.Numeric(19, 4)),
+    )
+    op.create_table(
+        "cfd_impuesto_trasladado_general",
+        sa.Column("id_impuesto_trasladado_general", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("id_comprobante", sa.Integer, sa.ForeignKey("cfd_comprobante.id_comprobante"), nullable=False),
+        sa.Column("base", sa.Numeric(19, 4), nullable=False),
+        sa.Column("impuesto", sa.String(3), nullable=False),
+        sa.Column("tipo_factor", sa.String(10), nullable=False),
+        sa.Column("tasa_o_cuota", sa.Numeric(19, 6)),
+        sa.Column("importe", sa.Numeric(19, 4)),
+    )
+
+
+def downgrade():
+    op.drop_table("cfd_impuesto_trasladado_general")
+    op.drop_table("cfd_impuesto_trasladado_concepto")
+    op.drop_table("cfd_concepto")
+    op.drop_table("cfd_comprobante")
+    op.drop_table("cfd_receptor")
+    op.drop_table("cfd_emisor")
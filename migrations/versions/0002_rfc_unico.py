@@ -0,0 +1,45 @@
+"""Un solo emisor/receptor por RFC
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+Antes cada comprobante creaba su propio emisor y receptor. Se conserva el id
+más bajo de cada RFC, se reapuntan los comprobantes y se eliminan los
+duplicados antes de crear los índices únicos.
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _deduplicar(tabla, columna_id):
+    op.execute(f"""
+        CREATE TEMPORARY TABLE dup_{tabla} ON COMMIT DROP AS
+        SELECT {columna_id} AS id_duplicado,
+               MIN({columna_id}) OVER (PARTITION BY rfc) AS id_conservado
+        FROM {tabla}
+    """)
+    op.execute(f"DELETE FROM dup_{tabla} WHERE id_duplicado = id_conservado")
+    op.execute(f"""
+        UPDATE cfd_comprobante c
+        SET {columna_id} = d.id_conservado
+        FROM dup_{tabla} d
+        WHERE c.{columna_id} = d.id_duplicado
+    """)
+    op.execute(f"DELETE FROM {tabla} t USING dup_{tabla} d WHERE t.{columna_id} = d.id_duplicado")
+
+
+def upgrade():
+    _deduplicar("cfd_emisor", "id_emisor")
+    _deduplicar("cfd_receptor", "id_receptor")
+    op.create_unique_constraint("cfd_emisor_rfc_key", "cfd_emisor", ["rfc"])
+    op.create_unique_constraint("cfd_receptor_rfc_key", "cfd_receptor", ["rfc"])
+
+
+def downgrade():
+    op.drop_constraint("cfd_receptor_rfc_key", "cfd_receptor", type_="unique")
+    op.drop_constraint("cfd_emisor_rfc_key", "cfd_emisor", type_="unique")
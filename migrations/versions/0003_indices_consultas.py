@@ -0,0 +1,37 @@
+"""Índices para los filtros por fecha, tipo y emisor
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+Los índices se crean con CONCURRENTLY para no bloquear la escritura en tablas
+grandes, por eso cada uno corre fuera de la transacción de la migración.
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDICES = [
+    ("ix_cfd_comprobante_fecha", "cfd_comprobante", "btree", "fecha"),
+    ("ix_cfd_comprobante_tipo_fecha", "cfd_comprobante", "btree", "tipo_de_comprobante, fecha"),
+    ("ix_cfd_comprobante_id_emisor", "cfd_comprobante", "btree", "id_emisor"),
+    ("brin_cfd_comprobante_fecha", "cfd_comprobante", "brin", "fecha"),
+    ("ix_cfd_concepto_id_comprobante", "cfd_concepto", "btree", "id_comprobante"),
+    ("ix_cfd_impuesto_trasladado_concepto_id_concepto", "cfd_impuesto_trasladado_concepto", "btree", "id_concepto"),
+    ("ix_cfd_impuesto_trasladado_general_id_comprobante", "cfd_impuesto_trasladado_general", "btree", "id_comprobante"),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for nombre, tabla, metodo, columnas in INDICES:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON {tabla} USING {metodo} ({columnas})")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for nombre, _, _, _ in reversed(INDICES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
@@ -0,0 +1,81 @@
+"""Resumen diario por tipo y emisor con sketch de cuantiles
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+Crea cfd_resumen_diario, la función cfd_sketch_combinar y el agregado
+cfd_sketch_union para fusionar sketches en SQL, y lo llena a partir de
+cfd_comprobante. GAMMA debe coincidir con app/utils/sketch.py.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+GAMMA = (1 + 0.01) / (1 - 0.01)
+
+
+def upgrade():
+    op.create_table(
+        "cfd_resumen_diario",
+        sa.Column("dia", sa.Date, primary_key=True),
+        sa.Column("tipo_de_comprobante", sa.String(1), primary_key=True),
+        sa.Column("id_emisor", sa.Integer, sa.ForeignKey("cfd_emisor.id_emisor"), primary_key=True),
+        sa.Column("cantidad", sa.BigInteger, nullable=False),
+        sa.Column("suma", sa.Numeric, nullable=False),
+        sa.Column("suma_cuadrados", sa.Numeric, nullable=False),
+        sa.Column("minimo", sa.Numeric(19, 4), nullable=False),
+        sa.Column("maximo", sa.Numeric(19, 4), nullable=False),
+        sa.Column("sketch", JSONB, nullable=False),
+    )
+    op.create_index("ix_cfd_resumen_diario_id_emisor", "cfd_resumen_diario", ["id_emisor"])
+
+    op.execute("""
+        CREATE FUNCTION cfd_sketch_combinar(a jsonb, b jsonb) RETURNS jsonb
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT COALESCE(jsonb_object_agg(k, s), '{}'::jsonb)
+            FROM (
+                SELECT k, SUM(v::bigint) AS s
+                FROM (
+                    SELECT key, value FROM jsonb_each_text(COALESCE(a, '{}'::jsonb))
+                    UNION ALL
+                    SELECT key, value FROM jsonb_each_text(COALESCE(b, '{}'::jsonb))
+                ) t(k, v)
+                GROUP BY k
+            ) u
+        $$
+    """)
+    op.execute("""
+        CREATE AGGREGATE cfd_sketch_union(jsonb) (
+            SFUNC = cfd_sketch_combinar,
+            STYPE = jsonb,
+            INITCOND = '{}'
+        )
+    """)
+
+    op.execute(f"""
+        INSERT INTO cfd_resumen_diario
+        SELECT dia, tipo_de_comprobante, id_emisor,
+               SUM(n), SUM(s), SUM(sc), MIN(mn), MAX(mx), jsonb_object_agg(cubeta, n)
+        FROM (
+            SELECT fecha::date AS dia, tipo_de_comprobante, id_emisor,
+                   CASE WHEN total <= 0 THEN 'z'
+                        ELSE CEIL(LN(total::float8) / LN({GAMMA!r}::float8))::int::text END AS cubeta,
+                   COUNT(*) AS n, SUM(total) AS s, SUM(total * total) AS sc, MIN(total) AS mn, MAX(total) AS mx
+            FROM cfd_comprobante
+            GROUP BY 1, 2, 3, 4
+        ) b
+        GROUP BY dia, tipo_de_comprobante, id_emisor
+    """)
+
+
+def downgrade():
+    op.execute("DROP AGGREGATE cfd_sketch_union(jsonb)")
+    op.execute("DROP FUNCTION cfd_sketch_combinar(jsonb, jsonb)")
+    op.drop_index("ix_cfd_resumen_diario_id_emisor", table_name="cfd_resumen_diario")
+    op.drop_table("cfd_resumen_diario")
@@ -0,0 +1,27 @@
+"""Índice compuesto (fecha, id_comprobante) para paginación por cursor
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+El índice compuesto sirve también los filtros por fecha, así que reemplaza
+a ix_cfd_comprobante_fecha.
+"""
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cfd_comprobante_fecha_id ON cfd_comprobante (fecha, id_comprobante)")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_cfd_comprobante_fecha")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cfd_comprobante_fecha ON cfd_comprobante (fecha)")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_cfd_comprobante_fecha_id")
@@ -0,0 +1,53 @@
+"""Estado incremental de la regresión de /analisis_predictivo
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+
+Crea cfd_regresion_estado con n, Σx, Σy, Σxy, Σx² y Σy² (x = segundos desde
+epoch de fecha, y = total) para todos los comprobantes, por tipo y por
+emisor, y lo llena a partir de cfd_comprobante.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "cfd_regresion_estado",
+        sa.Column("dimension", sa.String(6), primary_key=True),
+        sa.Column("clave", sa.String(20), primary_key=True),
+        sa.Column("n", sa.BigInteger, nullable=False),
+        sa.Column("suma_x", sa.Numeric, nullable=False),
+        sa.Column("suma_y", sa.Numeric, nullable=False),
+        sa.Column("suma_xy", sa.Numeric, nullable=False),
+        sa.Column("suma_xx", sa.Numeric, nullable=False),
+        sa.Column("suma_yy", sa.Numeric, nullable=False),
+    )
+
+    op.execute("""
+        INSERT INTO cfd_regresion_estado
+        SELECT CASE WHEN GROUPING(tipo_de_comprobante) = 0 THEN 'tipo'
+                    WHEN GROUPING(id_emisor) = 0 THEN 'emisor'
+                    ELSE 'todos' END,
+               CASE WHEN GROUPING(tipo_de_comprobante) = 0 THEN COALESCE(tipo_de_comprobante, '')
+                    WHEN GROUPING(id_emisor) = 0 THEN id_emisor::text
+                    ELSE '' END,
+               COUNT(*), SUM(x), SUM(total), SUM(x * total), SUM(x * x), SUM(total * total)
+        FROM (
+            SELECT tipo_de_comprobante, id_emisor, EXTRACT(EPOCH FROM fecha)::numeric AS x, total
+            FROM cfd_comprobante
+            WHERE fecha IS NOT NULL AND total IS NOT NULL
+        ) c
+        GROUP BY GROUPING SETS ((), (tipo_de_comprobante), (id_emisor))
+        HAVING COUNT(*) > 0
+    """)
+
+
+def downgrade():
+    op.drop_table("cfd_regresion_estado")
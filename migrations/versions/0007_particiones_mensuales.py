@@ -0,0 +1,195 @@
+"""Particionado mensual por fecha de cfd_comprobante y sus tablas hijas
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+
+cfd_comprobante, cfd_concepto y las dos tablas de impuestos pasan a ser
+tablas particionadas por rango mensual de fecha. Las hijas llevan una copia
+de la fecha del comprobante (co-particionadas), así que un mes completo
+puede separarse de las cuatro tablas a la vez. Las llaves primarias y
+foráneas incluyen fecha, como exige Postgres en tablas particionadas.
+
+Las tablas se reescriben completas: correr en una ventana de mantenimiento.
+Los ids conservan sus secuencias, que se pasan a las tablas nuevas.
+"""
+from alembic import op
+from sqlalchemy import text
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+# (tabla, columna id, columna por la que se obtiene la fecha, tabla de la que se obtiene)
+TABLAS = [
+    ("cfd_comprobante", "id_comprobante", None, None),
+    ("cfd_concepto", "id_concepto", "id_comprobante", "cfd_comprobante"),
+    ("cfd_impuesto_trasladado_concepto", "id_impuesto_trasladado_concepto", "id_concepto", "cfd_concepto"),
+    ("cfd_impuesto_trasladado_general", "id_impuesto_trasladado_general", "id_comprobante", "cfd_comprobante"),
+]
+
+LLAVES_FORANEAS = [
+    ("cfd_comprobante", "id_emisor", "cfd_emisor (id_emisor)"),
+    ("cfd_comprobante", "id_receptor", "cfd_receptor (id_receptor)"),
+    ("cfd_concepto", "id_comprobante, fecha", "cfd_comprobante (id_comprobante, fecha)"),
+    ("cfd_impuesto_trasladado_concepto", "id_concepto, fecha", "cfd_concepto (id_concepto, fecha)"),
+    ("cfd_impuesto_trasladado_general", "id_comprobante, fecha", "cfd_comprobante (id_comprobante, fecha)"),
+]
+
+INDICES = [
+    ("ix_cfd_comprobante_fecha_id", "cfd_comprobante", "btree", "fecha, id_comprobante"),
+    ("ix_cfd_comprobante_tipo_fecha", "cfd_comprobante", "btree", "tipo_de_comprobante, fecha"),
+    ("ix_cfd_comprobante_id_emisor", "cfd_comprobante", "btree", "id_emisor"),
+    ("brin_cfd_comprobante_fecha", "cfd_comprobante", "brin", "fecha"),
+    ("ix_cfd_concepto_id_comprobante", "cfd_concepto", "btree", "id_comprobante"),
+    ("ix_cfd_impuesto_trasladado_concepto_id_concepto", "cfd_impuesto_trasladado_concepto", "btree", "id_concepto"),
+    ("ix_cfd_impuesto_trasladado_general_id_comprobante", "cfd_impuesto_trasladado_general", "btree", "id_comprobante"),
+]
+
+# Meses futuros que se dejan creados
+MESES_ADELANTE = 3
+
+# Crea las particiones mensuales de las cuatro tablas para [desde, hasta);
+# es idempotente y segura si dos sesiones la llaman a la vez.
+FUNCION_CREAR = """
+    CREATE FUNCTION cfd_crear_particiones(desde date, hasta date) RETURNS integer
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        mes date := date_trunc('month', desde)::date;
+        tabla text;
+        nombre text;
+        creadas integer := 0;
+    BEGIN
+        WHILE mes < hasta LOOP
+            FOREACH tabla IN ARRAY ARRAY['cfd_comprobante', 'cfd_concepto',
+                                         'cfd_impuesto_trasladado_concepto', 'cfd_impuesto_trasladado_general'] LOOP
+                nombre := tabla || '_p' || to_char(mes, 'YYYY_MM');
+                IF to_regclass(nombre) IS NULL THEN
+                    BEGIN
+                        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                                       nombre, tabla, mes, (mes + interval '1 month')::date);
+                        creadas := creadas + 1;
+                    EXCEPTION WHEN duplicate_table THEN
+                        NULL;
+                    END;
+                END IF;
+            END LOOP;
+            mes := (mes + interval '1 month')::date;
+        END LOOP;
+        RETURN creadas;
+    END
+    $$
+"""
+
+
+def _renombrar_indices(tabla, sufijo):
+    # Los nombres de índices son únicos por esquema: se liberan para la tabla nueva
+    op.execute(f"""
+        DO $$
+        DECLARE indice record;
+        BEGIN
+            FOR indice IN SELECT indexname FROM pg_indexes
+                          WHERE schemaname = current_schema() AND tablename = '{tabla}' LOOP
+                EXECUTE format('ALTER INDEX %I RENAME TO %I', indice.indexname,
+                               left(indice.indexname, 63 - length('{sufijo}')) || '{sufijo}');
+            END LOOP;
+        END
+        $$
+    """)
+
+
+def _secuencia(tabla, columna):
+    return op.get_bind().execute(text("SELECT pg_get_serial_sequence(:tabla, :columna)"), {"tabla": tabla, "columna": columna}).scalar()
+
+
+def upgrade():
+    secuencias = {}
+    for tabla, columna, _, _ in TABLAS:
+        secuencias[tabla] = _secuencia(tabla, columna)
+        # Sin esto la secuencia se borraría junto con la tabla vieja
+        op.execute(f"ALTER SEQUENCE {secuencias[tabla]} OWNED BY NONE")
+        op.execute(f"ALTER TABLE {tabla} RENAME TO {tabla}_antigua")
+        _renombrar_indices(f"{tabla}_antigua", "_antigua")
+
+    for tabla, columna, _, origen in TABLAS:
+        columna_fecha = "" if origen is None else "fecha timestamp NOT NULL,"
+        op.execute(f"""
+            CREATE TABLE {tabla} (
+                LIKE {tabla}_antigua INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+                {columna_fecha}
+                PRIMARY KEY ({columna}, fecha)
+            ) PARTITION BY RANGE (fecha)
+        """)
+
+    op.execute(FUNCION_CREAR)
+    op.execute(f"""
+        SELECT cfd_crear_particiones(
+            COALESCE((SELECT MIN(fecha) FROM cfd_comprobante_antigua)::date, CURRENT_DATE),
+            (date_trunc('month', GREATEST(CURRENT_DATE, (SELECT MAX(fecha) FROM cfd_comprobante_antigua)::date))
+             + interval '{MESES_ADELANTE + 1} months')::date
+        )
+    """)
+
+    # Copia: las hijas toman la fecha de su padre ya copiado
+    for tabla, _, llave, origen in TABLAS:
+        if origen is None:
+            op.execute(f"INSERT INTO {tabla} SELECT * FROM {tabla}_antigua")
+        else:
+            op.execute(f"""
+                INSERT INTO {tabla}
+                SELECT h.*, p.fecha FROM {tabla}_antigua h JOIN {origen} p ON p.{llave} = h.{llave}
+            """)
+
+    # Índices y llaves después de copiar: una sola pasada de validación por tabla
+    for nombre, tabla, metodo, columnas in INDICES:
+        op.execute(f"CREATE INDEX {nombre} ON {tabla} USING {metodo} ({columnas})")
+    for tabla, columnas, referencia in LLAVES_FORANEAS:
+        op.execute(f"ALTER TABLE {tabla} ADD FOREIGN KEY ({columnas}) REFERENCES {referencia}")
+
+    for tabla, columna, _, _ in reversed(TABLAS):
+        op.execute(f"DROP TABLE {tabla}_antigua")
+    for tabla, columna, _, _ in TABLAS:
+        op.execute(f"ALTER SEQUENCE {secuencias[tabla]} OWNED BY {tabla}.{columna}")
+
+    for tabla, _, _, _ in TABLAS:
+        op.execute(f"ANALYZE {tabla}")
+
+
+def downgrade():
+    secuencias = {}
+    for tabla, columna, _, _ in TABLAS:
+        secuencias[tabla] = _secuencia(tabla, columna)
+        op.execute(f"ALTER SEQUENCE {secuencias[tabla]} OWNED BY NONE")
+        op.execute(f"ALTER TABLE {tabla} RENAME TO {tabla}_particionada")
+        _renombrar_indices(f"{tabla}_particionada", "_part")
+
+    for tabla, columna, _, origen in TABLAS:
+        op.execute(f"CREATE TABLE {tabla} (LIKE {tabla}_particionada INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        if origen is not None:
+            op.execute(f"ALTER TABLE {tabla} DROP COLUMN fecha")
+        op.execute(f"ALTER TABLE {tabla} ADD PRIMARY KEY ({columna})")
+
+    for tabla, _, _, origen in TABLAS:
+        if origen is None:
+            op.execute(f"INSERT INTO {tabla} SELECT * FROM {tabla}_particionada")
+        else:
+            columnas = op.get_bind().execute(text("""
+                SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position)
+                FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = :tabla
+            """), {"tabla": tabla}).scalar()
+            op.execute(f"INSERT INTO {tabla} ({columnas}) SELECT {columnas} FROM {tabla}_particionada")
+
+    for nombre, tabla, metodo, columnas in INDICES:
+        op.execute(f"CREATE INDEX {nombre} ON {tabla} USING {metodo} ({columnas})")
+    for tabla, columnas, referencia in LLAVES_FORANEAS:
+        columnas = columnas.replace(", fecha", "")
+        referencia = referencia.replace(", fecha", "")
+        op.execute(f"ALTER TABLE {tabla} ADD FOREIGN KEY ({columnas}) REFERENCES {referencia}")
+
+    for tabla, _, _, _ in reversed(TABLAS):
+        op.execute(f"DROP TABLE {tabla}_particionada")
+    for tabla, columna, _, _ in TABLAS:
+        op.execute(f"ALTER SEQUENCE {secuencias[tabla]} OWNED BY {tabla}.{columna}")
+    op.execute("DROP FUNCTION cfd_crear_particiones(date, date)")
@@ -0,0 +1,29 @@
+"""UUID del timbre fiscal en cfd_comprobante, único para ingesta idempotente
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+
+La columna queda nula en los comprobantes ya cargados (el XML no se guarda),
+así que no choca con el índice único. En una tabla particionada el índice
+único debe incluir la llave de partición; la fecha viene del mismo XML que
+el UUID, por lo que un reenvío siempre cae en la misma partición. Postgres no
+permite CONCURRENTLY sobre la tabla particionada.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("cfd_comprobante", sa.Column("uuid", sa.String(36)))
+    op.create_index("ux_cfd_comprobante_uuid_fecha", "cfd_comprobante", ["uuid", "fecha"], unique=True)
+
+
+def downgrade():
+    op.drop_index("ux_cfd_comprobante_uuid_fecha", table_name="cfd_comprobante")
+    op.drop_column("cfd_comprobante", "uuid")
@@ -0,0 +1,30 @@
+"""Quita la fila "todos" de cfd_regresion_estado
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+
+Toda ingesta actualizaba esa única fila y las transacciones concurrentes se
+serializaban en su candado. El total general ahora se obtiene al leer,
+sumando las filas de la dimensión "tipo".
+"""
+from alembic import op
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("DELETE FROM cfd_regresion_estado WHERE dimension = 'todos'")
+
+
+def downgrade():
+    op.execute("""
+        INSERT INTO cfd_regresion_estado
+        SELECT 'todos', '', SUM(n), SUM(suma_x), SUM(suma_y), SUM(suma_xy), SUM(suma_xx), SUM(suma_yy)
+        FROM cfd_regresion_estado
+        WHERE dimension = 'tipo'
+        HAVING COUNT(*) > 0
+    """)
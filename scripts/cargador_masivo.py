@@ -0,0 +1,406 @@
+"""
+Carga masiva de CFDI históricos desde directorios, XML sueltos o archivos ZIP,
+sin pasar por la API. Los XML se parsean en el pool de procesos de la
+ingesta (INGESTA_PROCESOS, uno por núcleo) con el mismo mapeo de campos que
+/procesar_xml. Cada bloque se copia a tablas temporales con COPY binario
+(copy_records_to_table de asyncpg) y se fusiona con INSERT ... SELECT:
+emisores, receptores, comprobantes, conceptos y ambas tablas de traslados.
+Los ids de comprobantes y conceptos se reservan antes con nextval, así que
+las hijas se copian ya con la llave de su padre.
+
+Como la API, omite los UUID ya registrados (o repetidos en la carga) y suma
+los comprobantes nuevos al resumen diario y a la regresión en la misma
+transacción. Después de cada bloque guarda el avance en el archivo de
+checkpoint; con el mismo checkpoint una corrida interrumpida continúa desde
+el primer bloque sin confirmar (si se cortó entre el commit y el checkpoint,
+ese bloque se vuelve a leer y sus UUID se omiten como duplicados).
+
+Uso:
+    python -m scripts.cargador_masivo /datos/cfdi/2019 /datos/cfdi/2020.zip
+    python -m scripts.cargador_masivo /datos/cfdi --checkpoint carga.json --tamano-bloque 10000
+    INGESTA_PROCESOS=16 python -m scripts.cargador_masivo historico.zip --errores errores.tsv
+"""
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+import sys
+import time
+import zipfile
+from datetime import timedelta
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.database import async_session, engine
+from app.database.particiones import asegurar_particiones
+from app.utils.cache_respuestas import cache_respuestas, cambios
+from app.utils.lote import parsear_bloque, cerrar_pool
+from app.utils.regresion import actualizar_regresion
+from app.utils.resumen import actualizar_resumen
+
+TABLAS = (
+    "cfd_emisor",
+    "cfd_receptor",
+    "cfd_comprobante",
+    "cfd_concepto",
+    "cfd_impuesto_trasladado_concepto",
+    "cfd_impuesto_trasladado_general",
+)
+
+# 📌 Tablas temporales de la sesión; ON COMMIT DELETE ROWS las vacía al
+# confirmar cada bloque
+_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS stg_emisor (
+        rfc text, nombre text, regimen_fiscal text
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS stg_receptor (
+        rfc text, nombre text, regimen_fiscal text, uso_cfdi text
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS stg_comprobante (
+        id_comprobante int, uuid text, rfc_emisor text, rfc_receptor text,
+        version text, serie text, folio text, fecha timestamp, subtotal numeric, descuento numeric,
+        moneda text, tipo_cambio numeric, total numeric, tipo_de_comprobante text, exportacion text,
+        lugar_expedicion text, total_impuestos_trasladados numeric
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS stg_concepto (
+        id_concepto int, id_comprobante int, fecha timestamp, clave_prod_serv text, cantidad numeric,
+        clave_unidad text, descripcion text, valor_unitario numeric, importe numeric, descuento numeric,
+        objeto_imp text
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS stg_traslado_concepto (
+        id_concepto int, fecha timestamp, base numeric, impuesto text, tipo_factor text,
+        tasa_o_cuota numeric, importe numeric
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS stg_traslado_general (
+        id_comprobante int, fecha timestamp, base numeric, impuesto text, tipo_factor text,
+        tasa_o_cuota numeric, importe numeric
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS stg_nuevos (
+        id_comprobante int, fecha timestamp, tipo_de_comprobante text, id_emisor int, total numeric
+    ) ON COMMIT DELETE ROWS;
+"""
+
+COLUMNAS_COMPROBANTE = (
+    "version", "serie", "folio", "fecha", "subtotal", "descuento", "moneda", "tipo_cambio", "total",
+    "tipo_de_comprobante", "exportacion", "lugar_expedicion", "total_impuestos_trasladados"
+)
+COLUMNAS_CONCEPTO = (
+    "clave_prod_serv", "cantidad", "clave_unidad", "descripcion", "valor_unitario", "importe", "descuento", "objeto_imp"
+)
+COLUMNAS_TRASLADO = ("base", "impuesto", "tipo_factor", "tasa_o_cuota", "importe")
+
+_RESERVAR_IDS = text("""
+    SELECT ARRAY(SELECT nextval(pg_get_serial_sequence('cfd_comprobante', 'id_comprobante')) FROM generate_series(1, :comprobantes)),
+           ARRAY(SELECT nextval(pg_get_serial_sequence('cfd_concepto', 'id_concepto')) FROM generate_series(1, :conceptos))
+""")
+
+# Un RFC que ya existe solo se actualiza si cambió su nombre o régimen (evita reescribir la fila)
+_FUSIONAR_EMISORES = """
+    INSERT INTO cfd_emisor (rfc, nombre, regimen_fiscal)
+    SELECT DISTINCT ON (rfc) rfc, nombre, regimen_fiscal FROM stg_emisor ORDER BY rfc
+    ON CONFLICT (rfc) DO UPDATE SET nombre = EXCLUDED.nombre, regimen_fiscal = EXCLUDED.regimen_fiscal
+    WHERE (cfd_emisor.nombre, cfd_emisor.regimen_fiscal) IS DISTINCT FROM (EXCLUDED.nombre, EXCLUDED.regimen_fiscal)
+"""
+
+_FUSIONAR_RECEPTORES = """
+    INSERT INTO cfd_receptor (rfc, nombre, regimen_fiscal, uso_cfdi)
+    SELECT DISTINCT ON (rfc) rfc, nombre, regimen_fiscal, uso_cfdi FROM stg_receptor ORDER BY rfc
+    ON CONFLICT (rfc) DO UPDATE SET nombre = EXCLUDED.nombre, regimen_fiscal = EXCLUDED.regimen_fiscal, uso_cfdi = EXCLUDED.uso_cfdi
+    WHERE (cfd_receptor.nombre, cfd_receptor.regimen_fiscal, cfd_receptor.uso_cfdi)
+          IS DISTINCT FROM (EXCLUDED.nombre, EXCLUDED.regimen_fiscal, EXCLUDED.uso_cfdi)
+"""
+
+# 📌 Un UUID repetido en el bloque se inserta una vez (el primero); uno ya
+# registrado se omite con ON CONFLICT. Los insertados quedan en stg_nuevos
+# para que las hijas y los agregados solo tomen esos.
+_FUSIONAR_COMPROBANTES = f"""
+    WITH insertados AS (
+        INSERT INTO cfd_comprobante (id_comprobante, uuid, id_emisor, id_receptor, {", ".join(COLUMNAS_COMPROBANTE)})
+        SELECT DISTINCT ON (COALESCE(s.uuid, s.id_comprobante::text))
+               s.id_comprobante, s.uuid, e.id_emisor, r.id_receptor, {", ".join(f"s.{c}" for c in COLUMNAS_COMPROBANTE)}
+        FROM stg_comprobante s
+        JOIN cfd_emisor e ON e.rfc = s.rfc_emisor
+        JOIN cfd_receptor r ON r.rfc = s.rfc_receptor
+        ORDER BY COALESCE(s.uuid, s.id_comprobante::text), s.id_comprobante
+        ON CONFLICT (uuid, fecha) DO NOTHING
+        RETURNING id_comprobante, fecha, tipo_de_comprobante, id_emisor, total
+    )
+    INSERT INTO stg_nuevos SELECT * FROM insertados
+    RETURNING fecha, tipo_de_comprobante, id_emisor, total
+"""
+
+_FUSIONAR_CONCEPTOS = f"""
+    INSERT INTO cfd_concepto (id_concepto, id_comprobante, fecha, {", ".join(COLUMNAS_CONCEPTO)})
+    SELECT c.id_concepto, c.id_comprobante, c.fecha, {", ".join(f"c.{col}" for col in COLUMNAS_CONCEPTO)}
+    FROM stg_concepto c JOIN stg_nuevos n USING (id_comprobante)
+"""
+
+_FUSIONAR_TRASLADOS_CONCEPTO = f"""
+    INSERT INTO cfd_impuesto_trasladado_concepto (id_concepto, fecha, {", ".join(COLUMNAS_TRASLADO)})
+    SELECT t.id_concepto, t.fecha, {", ".join(f"t.{col}" for col in COLUMNAS_TRASLADO)}
+    FROM stg_traslado_concepto t
+    JOIN stg_concepto c USING (id_concepto)
+    JOIN stg_nuevos n ON n.id_comprobante = c.id_comprobante
+"""
+
+_FUSIONAR_TRASLADOS_GENERAL = f"""
+    INSERT INTO cfd_impuesto_trasladado_general (id_comprobante, fecha, {", ".join(COLUMNAS_TRASLADO)})
+    SELECT t.id_comprobante, t.fecha, {", ".join(f"t.{col}" for col in COLUMNAS_TRASLADO)}
+    FROM stg_traslado_general t JOIN stg_nuevos n USING (id_comprobante)
+"""
+
+
+def _leer(ruta):
+    with open(ruta, "rb") as archivo:
+        return archivo.read()
+
+
+def recorrer_fuentes(rutas):
+    """
+    Recorre en orden fijo (alfabético) los XML de las rutas: directorios
+    (recursivos, con sus .xml y .zip), XML sueltos y ZIP.
+    :return: Generador de tuplas (nombre, leer); leer() devuelve el contenido,
+        así que saltar archivos ya cargados no los lee.
+    """
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            for raiz, directorios, archivos in os.walk(ruta):
+                directorios.sort()
+                yield from recorrer_fuentes(
+                    os.path.join(raiz, nombre) for nombre in sorted(archivos)
+                    if nombre.lower().endswith((".xml", ".zip"))
+                )
+        elif zipfile.is_zipfile(ruta):
+            with zipfile.ZipFile(ruta) as archivo_zip:
+                for info in sorted(archivo_zip.infolist(), key=lambda info: info.filename):
+                    if not info.is_dir() and info.filename.lower().endswith(".xml"):
+                        yield f"{ruta}/{info.filename}", functools.partial(archivo_zip.read, info)
+        else:
+            yield ruta, functools.partial(_leer, ruta)
+
+
+def bloques(fuentes, tamano):
+    # Lee el contenido mientras el generador sigue dentro de su ZIP
+    while True:
+        bloque = [(nombre, leer()) for nombre, leer in itertools.islice(fuentes, tamano)]
+        if not bloque:
+            return
+        yield bloque
+
+
+class Checkpoint:
+    """
+    Avance de la carga en un archivo JSON: archivos ya confirmados (en el
+    orden de recorrer_fuentes) y contadores. Se reescribe de forma atómica.
+    """
+
+    def __init__(self, ruta, fuentes):
+        self.ruta = ruta
+        self.estado = {
+            "fuentes": fuentes, "archivos": 0, "comprobantes": 0, "duplicados": 0, "errores": 0,
+            "filas": dict.fromkeys(TABLAS, 0)
+        }
+        if ruta and os.path.exists(ruta):
+            with open(ruta) as archivo:
+                guardado = json.load(archivo)
+            if guardado["fuentes"] != fuentes:
+                raise SystemExit(f"El checkpoint {ruta} es de otras fuentes: {guardado['fuentes']}")
+            self.estado = guardado
+
+    def guardar(self):
+        if not self.ruta:
+            return
+        temporal = f"{self.ruta}.tmp"
+        with open(temporal, "w") as archivo:
+            json.dump(self.estado, archivo, indent=2)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, self.ruta)
+
+
+def _registros(cfdis, ids_comprobante, ids_concepto):
+    """
+    Filas de cada tabla de staging para un bloque, con los ids ya reservados.
+    """
+    filas = {nombre: [] for nombre in ("emisor", "receptor", "comprobante", "concepto", "traslado_concepto", "traslado_general")}
+    ids_concepto = iter(ids_concepto)
+    for cfdi, id_comprobante in zip(cfdis, ids_comprobante):
+        comprobante = cfdi["comprobante"]
+        fecha = comprobante["fecha"]
+        emisor, receptor = cfdi["emisor"], cfdi["receptor"]
+        filas["emisor"].append((emisor["rfc"], emisor["nombre"], emisor["regimen_fiscal"]))
+        filas["receptor"].append((receptor["rfc"], receptor["nombre"], receptor["regimen_fiscal"], receptor["uso_cfdi"]))
+        filas["comprobante"].append(
+            (id_comprobante, comprobante.get("uuid"), emisor["rfc"], receptor["rfc"])
+            + tuple(comprobante[columna] for columna in COLUMNAS_COMPROBANTE)
+        )
+        for concepto in cfdi["conceptos"]:
+            id_concepto = next(ids_concepto)
+            filas["concepto"].append(
+                (id_concepto, id_comprobante, fecha) + tuple(concepto[columna] for columna in COLUMNAS_CONCEPTO)
+            )
+            filas["traslado_concepto"].extend(
+                (id_concepto, fecha) + tuple(traslado[columna] for columna in COLUMNAS_TRASLADO)
+                for traslado in concepto["traslados"]
+            )
+        filas["traslado_general"].extend(
+            (id_comprobante, fecha) + tuple(traslado[columna] for columna in COLUMNAS_TRASLADO)
+            for traslado in cfdi["traslados"]
+        )
+    return filas
+
+
+class Medicion:
+    """Filas escritas y segundos (COPY a staging más fusión) por tabla."""
+
+    def __init__(self, filas=None):
+        self.filas = dict(filas or dict.fromkeys(TABLAS, 0))
+        self.segundos = dict.fromkeys(TABLAS, 0.0)
+
+    async def medir(self, tabla, corrutina):
+        inicio = time.perf_counter()
+        resultado = await corrutina
+        self.segundos[tabla] += time.perf_counter() - inicio
+        return resultado
+
+    def reporte(self, filas_previas, segundos_totales):
+        lineas = [f"  {'tabla':<34} {'filas':>12} {'filas/s (bd)':>14} {'filas/s (total)':>16}"]
+        for tabla in TABLAS:
+            nuevas = self.filas[tabla] - filas_previas[tabla]
+            en_bd = nuevas / self.segundos[tabla] if self.segundos[tabla] else 0
+            lineas.append(f"  {tabla:<34} {nuevas:>12} {en_bd:>14.0f} {nuevas / segundos_totales:>16.0f}")
+        return "\n".join(lineas)
+
+
+async def cargar_bloque(conn, driver, cfdis, medicion):
+    """
+    Copia un bloque a staging y lo fusiona en una sola transacción.
+    :return: Número de comprobantes nuevos y sus fechas (para el cache).
+    """
+    # Crear particiones bloquea al padre: va en su propia transacción, antes
+    async with async_session() as db:
+        await asegurar_particiones(db, [cfdi["comprobante"]["fecha"] for cfdi in cfdis])
+
+    await conn.begin()
+    try:
+        # Primera sentencia del bloque: abre la transacción en la que corren los COPY
+        ids_comprobante, ids_concepto = (await conn.execute(_RESERVAR_IDS, {
+            "comprobantes": len(cfdis), "conceptos": sum(len(cfdi["conceptos"]) for cfdi in cfdis)
+        })).one()
+        filas = _registros(cfdis, ids_comprobante, ids_concepto)
+
+        copias = (
+            ("cfd_emisor", "stg_emisor", filas["emisor"]),
+            ("cfd_receptor", "stg_receptor", filas["receptor"]),
+            ("cfd_comprobante", "stg_comprobante", filas["comprobante"]),
+            ("cfd_concepto", "stg_concepto", filas["concepto"]),
+            ("cfd_impuesto_trasladado_concepto", "stg_traslado_concepto", filas["traslado_concepto"]),
+            ("cfd_impuesto_trasladado_general", "stg_traslado_general", filas["traslado_general"]),
+        )
+        for tabla, staging, registros in copias:
+            if registros:
+                await medicion.medir(tabla, driver.copy_records_to_table(staging, records=registros))
+
+        for tabla, sql in (("cfd_emisor", _FUSIONAR_EMISORES), ("cfd_receptor", _FUSIONAR_RECEPTORES)):
+            medicion.filas[tabla] += (await medicion.medir(tabla, conn.exec_driver_sql(sql))).rowcount
+
+        nuevos = (await medicion.medir("cfd_comprobante", conn.exec_driver_sql(_FUSIONAR_COMPROBANTES))).all()
+        medicion.filas["cfd_comprobante"] += len(nuevos)
+
+        for tabla, sql in (
+            ("cfd_concepto", _FUSIONAR_CONCEPTOS),
+            ("cfd_impuesto_trasladado_concepto", _FUSIONAR_TRASLADOS_CONCEPTO),
+            ("cfd_impuesto_trasladado_general", _FUSIONAR_TRASLADOS_GENERAL),
+        ):
+            medicion.filas[tabla] += (await medicion.medir(tabla, conn.exec_driver_sql(sql))).rowcount
+
+        # Mismos agregados que la ingesta de la API, en la misma transacción
+        db = AsyncSession(bind=conn)
+        await actualizar_resumen(db, nuevos)
+        await actualizar_regresion(db, nuevos)
+        await conn.commit()
+    except Exception:
+        await conn.rollback()
+        raise
+    return len(nuevos), [fila[0] for fila in nuevos]
+
+
+async def main(args):
+    fuentes = [os.path.abspath(ruta) for ruta in args.rutas]
+    checkpoint = Checkpoint(args.checkpoint, fuentes)
+    estado = checkpoint.estado
+    if estado["archivos"]:
+        print(f"Continuando desde el archivo {estado['archivos']} ({estado['comprobantes']} comprobantes ya cargados)")
+
+    medicion = Medicion(estado["filas"])
+    filas_previas = dict(estado["filas"])
+    archivo_errores = open(args.errores, "a") if args.errores else None
+    fechas = []
+    inicio = time.perf_counter()
+
+    async with engine.connect() as conn:
+        driver = (await conn.get_raw_connection()).driver_connection
+        await driver.execute(_STAGING)
+
+        pendientes = bloques(itertools.islice(recorrer_fuentes(fuentes), estado["archivos"], None), args.tamano_bloque)
+        siguiente = next(pendientes, None)
+        parseo = asyncio.ensure_future(parsear_bloque(siguiente)) if siguiente else None
+        try:
+            while parseo is not None:
+                resultados = await parseo
+                # Mientras se escribe este bloque se parsea el siguiente
+                siguiente = next(pendientes, None)
+                parseo = asyncio.ensure_future(parsear_bloque(siguiente)) if siguiente else None
+
+                cfdis = [cfdi for _, cfdi, error in resultados if error is None]
+                errores = [(nombre, error) for nombre, _, error in resultados if error is not None]
+                if archivo_errores is not None:
+                    archivo_errores.writelines(f"{nombre}\t{error}\n" for nombre, error in errores)
+                    archivo_errores.flush()
+
+                nuevos, fechas_bloque = await cargar_bloque(conn, driver, cfdis, medicion) if cfdis else (0, [])
+                if fechas_bloque:
+                    fechas.extend((min(fechas_bloque), max(fechas_bloque)))
+
+                estado["archivos"] += len(resultados)
+                estado["comprobantes"] += nuevos
+                estado["duplicados"] += len(cfdis) - nuevos
+                estado["errores"] += len(errores)
+                estado["filas"] = medicion.filas
+                checkpoint.guardar()
+
+                transcurrido = time.perf_counter() - inicio
+                print(f"{estado['archivos']} archivos: {estado['comprobantes']} comprobantes, "
+                      f"{estado['duplicados']} duplicados, {estado['errores']} errores "
+                      f"({sum(medicion.filas.values()) - sum(filas_previas.values())} filas, "
+                      f"{(sum(medicion.filas.values()) - sum(filas_previas.values())) / transcurrido:.0f} filas/s)")
+        finally:
+            if parseo is not None:
+                parseo.cancel()
+            if archivo_errores is not None:
+                archivo_errores.close()
+            cerrar_pool()
+
+    transcurrido = time.perf_counter() - inicio
+    print(f"Terminado en {transcurrido:.1f} s")
+    print(medicion.reporte(filas_previas, transcurrido))
+
+    if fechas:
+        # Solo surte efecto con el cache en Redis; el de memoria vive en cada worker
+        await cache_respuestas.invalidar(cambios([(min(fechas), max(fechas) + timedelta(days=1))], None, None))
+    await engine.dispose()
+    sys.exit(1 if estado["errores"] and args.estricto else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rutas", nargs="+", help="Directorios, XML o ZIP")
+    parser.add_argument("--checkpoint", default="cargador_masivo.checkpoint.json",
+                        help="Archivo con el avance; vacío para no guardar avance")
+    parser.add_argument("--tamano-bloque", type=int, default=5000, help="Archivos por transacción")
+    parser.add_argument("--errores", help="Archivo TSV donde anotar los XML inválidos")
+    parser.add_argument("--estricto", action="store_true", help="Terminar con código 1 si hubo XML inválidos")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,202 @@
+"""
+Administra las particiones mensuales de cfd_comprobante y sus tablas hijas.
+
+    crear      Crea las particiones de los próximos meses (para cron; la
+               aplicación también lo hace al iniciar y la ingesta crea al
+               vuelo las de meses nuevos).
+    listar     Muestra las particiones y sus filas estimadas.
+    archivar   Separa uno o más meses: descuenta sus comprobantes del resumen
+               diario y de la regresión, y mueve las particiones al esquema
+               de archivo (o las borra con --eliminar).
+    verificar  Comprueba con EXPLAIN que las consultas por día, mes y año solo
+               leen las particiones del rango, tanto con plan a la medida
+               (valores literales) como con plan genérico (prepared statement).
+
+Uso:
+    python -m scripts.particiones crear --meses 3
+    python -m scripts.particiones archivar --antes-de 2020-01
+    python -m scripts.particiones verificar --year 2024 --month 1 --day 15
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import literal
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import asyncpg as dialecto_asyncpg
+
+from app.database.database import async_session, engine
+from app.database.consultas import rango_fechas, parametros_rango, consulta_registros, parametros_registros, consulta_resumen
+from app.database.particiones import (
+    crear_particiones_futuras, listar_particiones, separar_mes, mes_siguiente, nombre_particion, ESQUEMA_ARCHIVO
+)
+from app.utils.cache_respuestas import cache_respuestas, cambios
+from app.utils.regresion import restar_regresion_rango
+from app.utils.resumen import eliminar_resumen_rango
+
+TABLA = "cfd_comprobante"
+
+
+def mes(valor):
+    return datetime.strptime(valor, "%Y-%m").date()
+
+
+async def crear(args):
+    async with async_session() as db:
+        creadas = await crear_particiones_futuras(db, args.meses)
+    print(f"Particiones creadas: {creadas}")
+
+
+async def listar(args):
+    async with async_session() as db:
+        for particion in await listar_particiones(db, args.tabla):
+            print(f"{particion['nombre']:<45} {particion['limites']:<70} ~{particion['filas_estimadas']} filas")
+
+
+async def archivar(args):
+    async with async_session() as db:
+        if args.mes:
+            meses = [args.mes]
+        else:
+            meses = sorted({
+                mes(particion["nombre"][-7:].replace("_", "-"))
+                for particion in await listar_particiones(db)
+                if particion["nombre"].startswith(f"{TABLA}_p")
+            })
+            meses = [m for m in meses if m < args.antes_de]
+
+        for m in meses:
+            rango = (datetime.combine(m, datetime.min.time()), datetime.combine(mes_siguiente(m), datetime.min.time()))
+            try:
+                # Los agregados se descuentan mientras los comprobantes siguen en la tabla
+                await restar_regresion_rango(db, *rango)
+                await eliminar_resumen_rango(db, rango)
+                separadas = await separar_mes(db, m, eliminar=args.eliminar)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+            # Solo surte efecto con el cache en Redis; el de memoria vive en cada worker
+            await cache_respuestas.invalidar(cambios([rango], None, None))
+            destino = "eliminadas" if args.eliminar else f"movidas a {ESQUEMA_ARCHIVO}"
+            print(f"{m:%Y-%m}: {len(separadas)} particiones {destino}")
+
+
+def _recorrer_plan(nodo):
+    yield nodo
+    for hijo in nodo.get("Plans", []):
+        yield from _recorrer_plan(hijo)
+
+
+def _particiones_leidas(plan):
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return sorted({
+        nodo["Relation Name"] for nodo in _recorrer_plan(plan[0]["Plan"])
+        if nodo.get("Relation Name", "").startswith(f"{TABLA}_p")
+    })
+
+
+def _sql_literal(stmt, params):
+    compilado = stmt.params(**params).compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    return str(compilado)
+
+
+def _sql_preparado(stmt, params):
+    # Mismo SQL con $1, $2... que envía asyncpg, y los valores como literales para EXECUTE
+    compilado = stmt.compile(dialect=dialecto_asyncpg.dialect())
+    valores = [
+        str(literal(params[nombre]).compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+        for nombre in compilado.positiontup
+    ]
+    return str(compilado), valores
+
+
+async def verificar(args):
+    hoy = date.today()
+    year = args.year or hoy.year
+    month = args.month or hoy.month
+    day = args.day or 1
+    rangos = {
+        "dia": rango_fechas(year=year, month=month, day=day),
+        "mes": rango_fechas(year=year, month=month),
+        "ano": rango_fechas(year=year),
+    }
+
+    fallas = 0
+    async with engine.connect() as conn:
+        existentes = {fila[0] for fila in (await conn.exec_driver_sql(
+            f"SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = '{TABLA}'::regclass"
+        )).all()}
+        driver = (await conn.get_raw_connection()).driver_connection
+
+        for periodo, rango in rangos.items():
+            esperadas = set()
+            m = rango[0].date()
+            while m < rango[1].date():
+                esperadas.add(nombre_particion(TABLA, m))
+                m = mes_siguiente(m)
+            esperadas &= existentes
+
+            consultas = {
+                f"/registros/{periodo}": (consulta_registros(rango), parametros_registros(rango, 100)),
+                f"/estadisticas ({periodo})": (consulta_resumen(rango), parametros_rango(rango)),
+            }
+            for nombre, (stmt, params) in consultas.items():
+                plan = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {_sql_literal(stmt, params)}")).scalar()
+                a_la_medida = _particiones_leidas(plan)
+
+                # Plan genérico: la poda ocurre al iniciar la ejecución (Subplans Removed)
+                sql, valores = _sql_preparado(stmt, params)
+                async with driver.transaction():
+                    await driver.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+                    await driver.execute(f"PREPARE verificar_particiones AS {sql}")
+                    try:
+                        plan = await driver.fetchval(f"EXPLAIN (FORMAT JSON) EXECUTE verificar_particiones({', '.join(valores)})")
+                    finally:
+                        await driver.execute("DEALLOCATE verificar_particiones")
+                generico = _particiones_leidas(plan)
+
+                for modo, leidas in (("literal", a_la_medida), ("generico", generico)):
+                    podado = set(leidas) <= esperadas
+                    fallas += not podado
+                    print(f"{'OK   ' if podado else 'FALLA'} {nombre} [{modo}]: {len(leidas)} particiones "
+                          f"(esperadas {len(esperadas)} de {len(existentes)})")
+
+    return 1 if fallas else 0
+
+
+async def main(args):
+    codigo = await args.comando(args)
+    await engine.dispose()
+    sys.exit(codigo or 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(required=True)
+
+    p_crear = comandos.add_parser("crear", help="Crear particiones de los próximos meses")
+    p_crear.add_argument("--meses", type=int, default=3)
+    p_crear.set_defaults(comando=crear)
+
+    p_listar = comandos.add_parser("listar", help="Listar particiones")
+    p_listar.add_argument("--tabla", default=TABLA)
+    p_listar.set_defaults(comando=listar)
+
+    p_archivar = comandos.add_parser("archivar", help="Separar meses antiguos")
+    grupo = p_archivar.add_mutually_exclusive_group(required=True)
+    grupo.add_argument("--mes", type=mes, help="Mes a archivar (YYYY-MM)")
+    grupo.add_argument("--antes-de", type=mes, help="Archivar todos los meses anteriores (YYYY-MM)")
+    p_archivar.add_argument("--eliminar", action="store_true", help="Borrar las particiones en lugar de moverlas")
+    p_archivar.set_defaults(comando=archivar)
+
+    p_verificar = comandos.add_parser("verificar", help="Verificar la poda de particiones")
+    p_verificar.add_argument("--year", type=int)
+    p_verificar.add_argument("--month", type=int)
+    p_verificar.add_argument("--day", type=int)
+    p_verificar.set_defaults(comando=verificar)
+
+    asyncio.run(main(parser.parse_args()))
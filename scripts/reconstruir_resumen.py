@@ -0,0 +1,30 @@
+"""
+Recalcula cfd_resumen_diario a partir de cfd_comprobante, por ejemplo después
+de un backfill o de cargar datos por fuera de la API.
+
+Uso:
+    python -m scripts.reconstruir_resumen                      # toda la tabla
+    python -m scripts.reconstruir_resumen --desde 2024-01-01 --hasta 2024-03-31
+"""
+import argparse
+import asyncio
+from datetime import date
+
+from app.database.database import async_session, engine
+from app.database.consultas import rango_fechas
+from app.utils.resumen import reconstruir_resumen
+
+
+async def main(args):
+    rango = rango_fechas(args.desde, args.hasta) if args.desde and args.hasta else None
+    async with async_session() as db:
+        filas = await reconstruir_resumen(db, rango)
+    await engine.dispose()
+    print(f"Resumen diario reconstruido: {filas} filas")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--desde", type=date.fromisoformat, help="Primer día (YYYY-MM-DD)")
+    parser.add_argument("--hasta", type=date.fromisoformat, help="Último día, inclusive (YYYY-MM-DD)")
+    asyncio.run(main(parser.parse_args()))
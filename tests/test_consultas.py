@@ -0,0 +1,50 @@
+from datetime import date, datetime
+
+import pytest
+
+from app.database.consultas import rango_fechas, codificar_cursor, decodificar_cursor
+
+
+@pytest.mark.parametrize("filtros, esperado", [
+    ({}, None),
+    ({"year": 2024}, (datetime(2024, 1, 1), datetime(2025, 1, 1))),
+    ({"year": 2024, "month": 2}, (datetime(2024, 2, 1), datetime(2024, 3, 1))),
+    ({"year": 2024, "month": 12}, (datetime(2024, 12, 1), datetime(2025, 1, 1))),
+    ({"year": 2024, "month": 2, "day": 29}, (datetime(2024, 2, 29), datetime(2024, 3, 1))),
+    # fecha_fin es inclusiva: el rango termina al inicio del día siguiente
+    ({"fecha_inicio": date(2024, 1, 15), "fecha_fin": date(2024, 1, 15)}, (datetime(2024, 1, 15), datetime(2024, 1, 16))),
+    ({"fecha_inicio": date(2024, 1, 1), "fecha_fin": date(2024, 12, 31)}, (datetime(2024, 1, 1), datetime(2025, 1, 1))),
+])
+def test_rango_fechas(filtros, esperado):
+    assert rango_fechas(**filtros) == esperado
+
+
+@pytest.mark.parametrize("filtros", [
+    {"year": 2023, "month": 2, "day": 29},
+    {"year": 2024, "month": 13},
+    {"year": 0},
+    {"fecha_inicio": date(2024, 1, 1), "fecha_fin": date.max},
+])
+def test_rango_fechas_invalido_no_coincide_con_nada(filtros):
+    inicio, fin = rango_fechas(**filtros)
+
+    assert inicio >= fin
+
+
+@pytest.mark.parametrize("fecha, id_comprobante", [
+    (datetime(2024, 5, 17, 13, 45, 2), 1),
+    (datetime(2024, 5, 17, 13, 45, 2, 123456), 9876543210),
+    (datetime(1999, 12, 31, 23, 59, 59), 0),
+])
+def test_cursor_ida_y_vuelta(fecha, id_comprobante):
+    cursor = codificar_cursor(fecha, id_comprobante)
+
+    assert decodificar_cursor(cursor) == (fecha, id_comprobante)
+    # Va en la query string sin escapar
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+
+
+@pytest.mark.parametrize("cursor", ["", "no-es-base64!", "bm8gZXMganNvbg==", codificar_cursor(datetime(2024, 1, 1), 1)[:-4], "WzFd", "ñ"])
+def test_cursor_invalido(cursor):
+    with pytest.raises(ValueError):
+        decodificar_cursor(cursor)
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from app.utils.regresion import ajustar, segundos
+
+
+def _estado(fechas, totales):
+    # Fila de cfd_regresion_estado con las sumas exactas, como las acumula Postgres
+    xs = [segundos(fecha) for fecha in fechas]
+    ys = [Decimal(str(total)) for total in totales]
+    return {
+        "n": len(xs),
+        "suma_x": sum(xs),
+        "suma_y": sum(ys),
+        "suma_xy": sum(x * y for x, y in zip(xs, ys)),
+        "suma_xx": sum(x * x for x in xs),
+        "suma_yy": sum(y * y for y in ys)
+    }
+
+
+def test_ajustar_igual_a_polyfit():
+    rng = np.random.default_rng(3)
+    inicio = datetime(2023, 1, 1)
+    fechas = [inicio + timedelta(seconds=int(s)) for s in np.sort(rng.integers(0, 365 * 86400, 2000))]
+    x = np.array([(fecha - inicio).total_seconds() for fecha in fechas])
+    totales = np.round(1000 + 0.00005 * x + rng.normal(0, 300, len(x)), 2)
+
+    modelo = ajustar(_estado(fechas, totales))
+
+    # polyfit sobre x desplazada: con x del orden de 1e9 perdería precisión en float
+    pendiente, intercepto_local = np.polyfit(x, totales, 1)
+    intercepto = intercepto_local - pendiente * float(segundos(inicio))
+    assert float(modelo["pendiente"]) == pytest.approx(pendiente, rel=1e-9)
+    assert float(modelo["intercepto"]) == pytest.approx(intercepto, rel=1e-9)
+    assert float(modelo["r2"]) == pytest.approx(np.corrcoef(x, totales)[0, 1] ** 2, rel=1e-9)
+
+
+def test_ajustar_recta_exacta():
+    fechas = [datetime(2024, 3, 1) + timedelta(days=dia) for dia in range(10)]
+    totales = [100 + 5 * dia for dia in range(10)]
+
+    modelo = ajustar(_estado(fechas, totales))
+
+    assert modelo["pendiente"] * 86400 == pytest.approx(Decimal(5))
+    assert modelo["r2"] == pytest.approx(Decimal(1))
+
+
+def test_ajustar_sin_dos_fechas_distintas():
+    fecha = datetime(2024, 3, 1, 12)
+
+    assert ajustar(_estado([fecha], [100])) is None
+    assert ajustar(_estado([fecha, fecha], [100, 200])) is None
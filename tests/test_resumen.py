@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from app.utils import sketch
+from app.utils.resumen import estadisticas_desde_agregados
+
+
+@pytest.fixture
+def datos():
+    return np.round(np.random.default_rng(7).lognormal(7, 1.5, 5000), 2)
+
+
+@pytest.mark.parametrize("q", [0, 0.01, 0.25, 0.5, 0.75, 0.99, 1])
+def test_cuantil_dentro_de_la_precision_relativa(datos, q):
+    # El sketch devuelve la cubeta del elemento en la posición floor(q * (n - 1))
+    esperado = np.percentile(datos, q * 100, method="lower")
+
+    assert sketch.cuantil(sketch.crear_sketch(datos), q) == pytest.approx(esperado, rel=sketch.PRECISION_RELATIVA)
+
+
+def test_combinar_equivale_a_un_solo_sketch(datos):
+    por_dia = [sketch.crear_sketch(parte) for parte in np.array_split(datos, 30)]
+
+    assert sketch.combinar(*por_dia) == sketch.crear_sketch(datos)
+
+
+def test_ceros_y_sketch_vacio():
+    assert sketch.cuantil(sketch.crear_sketch([0, 0, 5]), 0.5) == 0.0
+    assert sketch.cuantil({}, 0.5) is None
+    assert sketch.moda({}) is None
+
+
+def test_moda_dentro_de_la_precision_relativa():
+    datos = [10.0] * 5 + [250.0] * 40 + [3000.0] * 7
+
+    assert sketch.moda(sketch.crear_sketch(datos)) == pytest.approx(250.0, rel=sketch.PRECISION_RELATIVA)
+
+
+def test_estadisticas_desde_agregados_igual_a_numpy(datos):
+    totales = [Decimal(str(valor)) for valor in datos]
+    # Fila como la de consulta_agregados: sumas exactas en numeric y sketch fusionado
+    agregados = {
+        "cantidad": len(totales),
+        "suma": sum(totales),
+        "suma_cuadrados": sum(total * total for total in totales),
+        "minimo": min(totales),
+        "maximo": max(totales),
+        "sketch": sketch.crear_sketch(datos)
+    }
+
+    resultado = estadisticas_desde_agregados(agregados)
+
+    assert resultado["cantidad_registros"] == len(datos)
+    assert resultado["media"] == pytest.approx(np.mean(datos), rel=1e-12)
+    assert resultado["varianza"] == pytest.approx(np.var(datos), rel=1e-9)
+    assert resultado["desviacion_estandar"] == pytest.approx(np.std(datos), rel=1e-9)
+    assert resultado["minimo"] == datos.min()
+    assert resultado["maximo"] == datos.max()
+    for q in (25, 50, 75):
+        assert resultado["percentiles"][str(q)] == pytest.approx(np.percentile(datos, q, method="lower"), rel=sketch.PRECISION_RELATIVA)
+    assert resultado["mediana"] == resultado["percentiles"]["50"]
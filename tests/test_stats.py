@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+from app.utils.stats import estadisticas_desde_resumen, prueba_t_welch, anova_desde_momentos
+
+
+def _momentos(datos):
+    # n, media y varianza muestral, como momentos_por_tipo (None con n = 1)
+    return {"n": len(datos), "media": float(np.mean(datos)), "varianza": float(np.var(datos, ddof=1)) if len(datos) > 1 else None}
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(20240101)
+
+
+def test_prueba_t_welch_igual_a_ttest_ind(rng):
+    a = rng.lognormal(7, 1, 500)
+    b = rng.lognormal(7.2, 1.3, 80)
+
+    resultado = prueba_t_welch(_momentos(a), _momentos(b))
+    esperado = stats.ttest_ind(a, b, equal_var=False)
+
+    assert resultado["statistica"] == pytest.approx(esperado.statistic, rel=1e-9)
+    assert resultado["p_valor"] == pytest.approx(esperado.pvalue, rel=1e-9)
+
+
+def test_anova_igual_a_f_oneway(rng):
+    grupos = [rng.normal(1000, 200, 300), rng.normal(1050, 250, 40), rng.normal(990, 150, 7)]
+
+    resultado = anova_desde_momentos([_momentos(g) for g in grupos])
+    esperado = stats.f_oneway(*grupos)
+
+    assert resultado["statistica"] == pytest.approx(esperado.statistic, rel=1e-9)
+    assert resultado["p_valor"] == pytest.approx(esperado.pvalue, rel=1e-9)
+    assert resultado["grados_libertad"] == [2, 344]
+
+
+def test_anova_con_grupo_de_un_elemento(rng):
+    # f_oneway cuenta el grupo de n = 1 en los grados de libertad
+    grupos = [rng.normal(1000, 200, 50), rng.normal(1100, 200, 20), np.array([950.0])]
+
+    resultado = anova_desde_momentos([_momentos(g) for g in grupos])
+    esperado = stats.f_oneway(*grupos)
+
+    assert resultado["statistica"] == pytest.approx(esperado.statistic, rel=1e-9)
+    assert resultado["p_valor"] == pytest.approx(esperado.pvalue, rel=1e-9)
+    assert resultado["grados_libertad"] == [2, 68]
+
+
+def test_anova_sin_variacion_dentro_de_grupos():
+    resultado = anova_desde_momentos([{"n": 1, "media": 10.0, "varianza": None}, {"n": 1, "media": 20.0, "varianza": None}])
+
+    assert resultado["statistica"] is None
+    assert resultado["p_valor"] is None
+
+
+def test_estadisticas_desde_resumen_igual_a_numpy(rng):
+    datos = np.round(rng.lognormal(7, 1, 1001), 2)
+    # Fila como la de consultas._resumen (var_pop, stddev_pop, percentile_cont, mode)
+    valores, conteos = np.unique(datos, return_counts=True)
+    resumen = {
+        "cantidad": len(datos),
+        "media": datos.mean(),
+        "varianza": datos.var(),
+        "desviacion_estandar": datos.std(),
+        "minimo": datos.min(),
+        "maximo": datos.max(),
+        "p25": np.percentile(datos, 25),
+        "p50": np.percentile(datos, 50),
+        "p75": np.percentile(datos, 75),
+        "moda": valores[np.argmax(conteos)]
+    }
+
+    resultado = estadisticas_desde_resumen(resumen)
+
+    assert resultado["cantidad_registros"] == 1001
+    assert resultado["media"] == pytest.approx(np.mean(datos))
+    assert resultado["mediana"] == pytest.approx(np.median(datos))
+    assert resultado["moda"] == [pytest.approx(stats.mode(datos, keepdims=False).mode)]
+    assert resultado["varianza"] == pytest.approx(np.var(datos))
+    assert resultado["desviacion_estandar"] == pytest.approx(np.std(datos))
+    assert resultado["rango"] == pytest.approx(np.ptp(datos))
+    assert resultado["percentiles"] == {
+        "25": pytest.approx(np.percentile(datos, 25)),
+        "50": pytest.approx(np.percentile(datos, 50)),
+        "75": pytest.approx(np.percentile(datos, 75))
+    }